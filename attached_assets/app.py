@@ -2,21 +2,26 @@
 #from lovable import Lovable as st  # Asegúrate de que la biblioteca Lovable esté instalada
 from datetime import datetime
 import pandas as pd
-from database import db_manager, init_db
+from database import init_db
+from models import Candidate
+from ranking_cache import ranking_cache
+from preranking import shortlist, select_oldest_subsidy
+from candidate_table import PAGE_SIZES, SORT_COLUMNS, TableQuery, candidate_table
+from candidate_mirror import candidate_mirror
+from disbursement import DisbursementResult, disburse_batch
+from conversational_call.call_dispatcher import enqueue_call
 import os
-from dotenv import load_dotenv  # Asegúrate de instalar python-dotenv si no lo tienes
-from openai import OpenAI
-from voice import voice_interface # Asegúrate de importar la función
+from typing import List, Optional, Tuple
+from resources import load_env, process_resources, session_cache
+from clients import openai_client
+from tts_cache import NOTIFICATION_MESSAGE
 import streamlit as st
 
 
-# Cargar las variables de entorno desde el archivo .env
-load_dotenv("./conversational_call/.env")
+# Cargar las variables de entorno desde el archivo .env (una vez por proceso)
+load_env()
 
-# Inicializar el cliente de OpenAI
-client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
-
-# Inicializar la base de datos
+# Inicializar la base de datos, ya con DB_BACKEND / DB_PATH del .env
 db = init_db()
 
 def init_session_state():
@@ -78,12 +83,61 @@ async def get_best_candidate(prompt):
             "content": prompt
         }
     ]
-    completion = await client.chat.completions.create(
+    completion = await openai_client().chat.completions.create(
         model="gpt-4o",  # Asegúrate de que este modelo esté disponible
         messages=messages
     )
     return completion.choices[0].message.content
 
+RANKING_MODEL = "gpt-4o"
+# Número de candidatos pre-seleccionados localmente que se envían al modelo
+SHORTLIST_SIZE = 20
+RANKING_PROMPT = "De los siguientes candidatos, ¿quién es el mejor candidato para recibir un subsidio?\n{candidate_info}. proporcionar solo [nombre, identificacion, subsidio]"
+
+def rank_candidates(candidates, now: datetime) -> str:
+    """Pide al modelo de OpenAI el mejor candidato de la lista pre-seleccionada"""
+    # Crear un prompt para el modelo de OpenAI sólo con la lista corta
+    candidate_info = "\n".join([f"Name: {c.name}, ID: {c.identification}, Last Subsidy: {c.last_subsidy}, Is Eligible: {c.is_eligible_at(now)}" for c in shortlist(candidates, SHORTLIST_SIZE, now)])
+
+    # Cliente compartido entre re-ejecuciones; openai se importa con el primer ranking
+    completion = openai_client().chat.completions.create(
+        model=RANKING_MODEL,
+        messages=[
+            {"role": "developer", "content": "You are a helpful assistant."},
+            {
+                "role": "user",
+                "content": RANKING_PROMPT.format(candidate_info=candidate_info)
+            }
+        ]
+    )
+    return completion.choices[0].message.content
+
+def best_candidate(now: datetime) -> Tuple[Optional[str], Optional[str]]:
+    """Respuesta del modelo y la identificación del candidato seleccionado"""
+    # Réplica al día con el change feed: sólo se aplican los cambios desde la última lectura
+    candidates, snapshot_hash = candidate_mirror.sync(db)
+    # Llamar al modelo de OpenAI sólo si cambió el contenido relevante para el ranking
+    cache_key = ranking_cache.make_key(snapshot_hash, RANKING_PROMPT, RANKING_MODEL)
+    try:
+        best_candidate_info = ranking_cache.get_or_compute(cache_key, lambda: rank_candidates(candidates, now))
+    except Exception as e:
+        print(f"Error ranking candidates with OpenAI: {str(e)}")
+        best_candidate_info = None
+
+    # Extraer el nombre del mejor candidato del resultado de manera más segura
+    try:
+        parts = best_candidate_info.split(":")
+        if len(parts) > 1:
+            best_candidate_name = parts[1].strip()
+            # Buscar el candidato en la base de datos
+            selected_candidate = db.get_candidate_by_name(best_candidate_name)
+        else:
+            raise ValueError("El formato de la respuesta no es el esperado.")
+    except (IndexError, AttributeError, ValueError) as e:
+        # Lógica alternativa: seleccionar el candidato con subsidio None o el más antiguo
+        selected_candidate = select_oldest_subsidy(candidates)
+    return best_candidate_info, selected_candidate.identification if selected_candidate else None
+
 def candidate_management():
     """Gestión de candidatos y transferencias"""
     if not st.session_state.phone_number:
@@ -92,66 +146,44 @@ def candidate_management():
         return
 
     st.subheader("Candidate Management")
+    # Un único instante de referencia para toda la página: tabla, prompt y selección coinciden
+    now = datetime.now()
 
     # List candidates
     st.subheader("Eligible Candidates")
-    candidates = db.get_all_candidates()
-    
-    if candidates:
-        # Convertir la lista de candidatos a un DataFrame
-        df = pd.DataFrame([{
-            'Name': c.name,
-            'ID': c.identification,
-            'Phone': c.phone,
-            'Last Subsidy': c.last_subsidy.strftime('%Y-%m-%d') if c.last_subsidy else 'Never',
-            'Is Eligible': c.is_eligible
-        } for c in candidates])
-
-        st.dataframe(df)
-
-        # Crear un prompt para el modelo de OpenAI
-        candidate_info = "\n".join([f"Name: {c.name}, ID: {c.identification}, Last Subsidy: {c.last_subsidy}, Is Eligible: {c.is_eligible}" for c in candidates])
-        
-        # Llamar al modelo de OpenAI para seleccionar el mejor candidato
-        completion = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "developer", "content": "You are a helpful assistant."},
-                {
-                    "role": "user",
-                    "content": f"De los siguientes candidatos, ¿quién es el mejor candidato para recibir un subsidio?\n{candidate_info}. proporcionar solo [nombre, identificacion, subsidio]"
-                }
-            ]
+    session = session_cache(st.session_state)
+
+    if candidate_table.count(db):
+        # Paginación, filtro y orden en el servidor: sólo se envía la página visible
+        search = st.text_input("Search by name, ID or phone")
+        sort_col, order_col, eligible_col, size_col = st.columns(4)
+        sort_label = sort_col.selectbox("Sort by", list(SORT_COLUMNS))
+        descending = order_col.checkbox("Descending")
+        eligible_only = eligible_col.checkbox("Only eligible")
+        page_size = size_col.selectbox("Rows per page", PAGE_SIZES, index=1)
+        query = TableQuery(search.strip(), eligible_only, SORT_COLUMNS[sort_label], descending)
+
+        _, positions = candidate_table.view(db, query, now)
+        pages = max(1, -(-len(positions) // page_size))
+        page = st.number_input("Page", min_value=1, max_value=pages, value=1, step=1)
+        df, total = session.get(
+            "candidate_page",
+            (id(db), db.candidates_version, query, page, page_size, now.replace(second=0, microsecond=0)),
+            lambda: candidate_table.page(db, query, page - 1, page_size, now)
         )
 
-        best_candidate_info = completion.choices[0].message.content
+        st.dataframe(df, hide_index=True)
+        st.caption(f"{total} candidates · page {page} of {pages}")
+
+        # El registro completo sólo se lee cuando cambia el contenido relevante para el ranking
+        best_candidate_info, selected_id = session.get(
+            "ranking",
+            (id(db), db.ranking_version, now.date()),
+            lambda: best_candidate(now)
+        )
         st.subheader("Mejor Candidato Seleccionado")
-        st.write(best_candidate_info)
-
-        # Extraer el nombre del mejor candidato del resultado de manera más segura
-        try:
-            parts = best_candidate_info.split(":")
-            if len(parts) > 1:
-                best_candidate_name = parts[1].strip()
-                # Buscar el candidato en la base de datos usando db_manager
-                selected_candidate = db_manager.get_candidate_by_name(best_candidate_name)  # Asegúrate de que esta función exista
-            else:
-                raise ValueError("El formato de la respuesta no es el esperado.")
-        except (IndexError, AttributeError, ValueError) as e:
-            # Lógica alternativa: seleccionar el candidato con subsidio None o el más antiguo
-            best_candidate_name = None
-            best_candidate = None  # Definir best_candidate antes de usarlo
-            for candidate in candidates:
-                if candidate.last_subsidy is None:
-                    best_candidate_name = candidate.name
-                    best_candidate = candidate
-                    break
-                elif best_candidate_name is None or (candidate.last_subsidy and candidate.last_subsidy < best_candidate.last_subsidy):
-                    best_candidate_name = candidate.name
-                    best_candidate = candidate
-
-        # Buscar el candidato en la base de datos
-        selected_candidate = next((c for c in candidates if c.name == best_candidate_name), None)
+        st.write(best_candidate_info or "Selección local (modelo no disponible)")
+        selected_candidate = db.get_candidate(selected_id) if selected_id else None
 
         if selected_candidate:
             # Mostrar toda la información del candidato seleccionado
@@ -159,37 +191,92 @@ def candidate_management():
             st.write(f"Nombre: {selected_candidate.name}")
             st.write(f"ID: {selected_candidate.identification}")
             st.write(f"Teléfono: {selected_candidate.phone}")
-            st.write(f"Elegible: {'Sí' if selected_candidate.is_eligible else 'No'}")
+            st.write(f"Elegible: {'Sí' if selected_candidate.is_eligible_at(now) else 'No'}")
             
             # Verificar si existe el atributo notes
             notes = getattr(selected_candidate, 'notes', 'No hay notas disponibles')
             st.write(f"Notas: {notes}")
 
             amount = st.number_input("Amount ($)", min_value=1.0, value=10.0, step=1.0)
+            run_id = st.text_input(
+                "Run ID",
+                value=datetime.now().strftime("%Y-%m"),
+                key="single_run_id",
+                help="Repeating a transfer with the same ID never pays the candidate twice"
+            )
 
             if st.button("Transfer Subsidy"):
-                success, message = simple_phone_transfer(
-                    st.session_state.phone_number,
-                    selected_candidate.phone,
-                    amount
-                )
-
-                if success:
-                    db.update_candidate(selected_candidate.identification, {
-                        "last_subsidy": datetime.now()
-                    })
-
-                    call_message = f"Hello {selected_candidate.name}, you have received a subsidy of ${amount}."
-                    os.system(f"python conversational_call/main.py {selected_candidate.phone} {call_message}")
-
+                # Mismo camino que los lotes: diario, clave de idempotencia y Transaction
+                result = pay_candidates([selected_candidate], amount, run_id)[0]
+                if result.status == "succeeded":
+                    session.invalidate("ranking")
                     st.success("Transfer successful and notification call initiated!")
+                elif result.status == "skipped":
+                    st.warning(result.message)
                 else:
-                    st.error(f"Transfer error: {message}")
+                    st.error(f"Transfer error: {result.message}")
         else:
             st.error("No candidate found.")
+
+        batch_disbursement(now)
     else:
         st.error("No candidates in the system")
 
+def pay_candidates(candidates: List[Candidate], amount: float, run_id: str) -> List[DisbursementResult]:
+    """Paga con disburse_batch y encola la llamada de aviso de cada transferencia completada"""
+    results = disburse_batch(
+        db,
+        candidates,
+        st.session_state.phone_number,
+        amount,
+        simple_phone_transfer,
+        run_id
+    )
+    candidates_by_id = {c.identification: c for c in candidates}
+    for result in results:
+        if result.status == "succeeded":
+            candidate = candidates_by_id[result.identification]
+            enqueue_call(
+                candidate.phone,
+                NOTIFICATION_MESSAGE.format(name=candidate.name, amount=amount),
+                candidate.identification
+            )
+    return results
+
+def batch_disbursement(now: datetime):
+    """Pago de subsidios a varios candidatos elegibles en un solo lote"""
+    st.subheader("Batch Disbursement")
+    eligible = db.get_eligible_candidates(now=now)
+    if not eligible:
+        st.info("No eligible candidates for a batch payout")
+        return
+
+    with st.form("batch_disbursement"):
+        labels = {f"{c.name} ({c.identification})": c for c in eligible}
+        # Nada preseleccionado: pagar a todos los elegibles tiene que pedirse explícitamente
+        pay_all = st.checkbox(
+            f"Select all eligible candidates ({len(eligible)})",
+            help="Pays every eligible candidate and ignores the selection below"
+        )
+        selection = st.multiselect("Candidates", list(labels))
+        amount = st.number_input("Amount per candidate ($)", min_value=1.0, value=10.0, step=1.0)
+        run_id = st.text_input(
+            "Run ID",
+            value=datetime.now().strftime("%Y-%m"),
+            help="Repeating a run with the same ID never pays the same candidate twice"
+        )
+
+        if st.form_submit_button("Run Batch Disbursement"):
+            chosen = eligible if pay_all else [labels[label] for label in selection]
+            if not chosen:
+                st.warning("Select at least one candidate")
+                return
+            results = pay_candidates(chosen, amount, run_id)
+            summary = pd.DataFrame([r.model_dump() for r in results])
+            succeeded = int((summary["status"] == "succeeded").sum()) if not summary.empty else 0
+            st.success(f"{succeeded} of {len(results)} transfers completed")
+            st.dataframe(summary)
+
 def login_page():
     st.title("Subsidy Management System")
     st.header("Login")
@@ -201,7 +288,7 @@ def login_page():
 
     with col1:
         if st.button("Login", use_container_width=True):
-            success, message = db_manager.authenticate_user(username, password)
+            success, message = db.authenticate_user(username, password)
             if success:
                 st.session_state.authenticated = True
                 st.session_state.current_user = username
@@ -243,7 +330,7 @@ def register_page():
             if new_password != confirm_password:
                 st.error("Passwords don't match")
             else:
-                success, message = db_manager.add_user(new_username, new_password, new_email)
+                success, message = db.add_user(new_username, new_password, new_email)
                 if success:
                     st.success(message)
                     st.session_state.current_page = "login"
@@ -261,7 +348,7 @@ def recover_page():
 
     with col1:
         if st.button("Request Code", use_container_width=True):
-            recovery_code = db_manager.generate_recovery_code(recovery_email)
+            recovery_code = db.generate_recovery_code(recovery_email)
             if recovery_code:
                 st.success(f"Recovery code: {recovery_code}")
             else:
@@ -284,7 +371,7 @@ def recover_page():
             if new_pass != confirm_new_pass:
                 st.error("Passwords don't match")
             else:
-                success, message = db_manager.reset_password(recovery_email, reset_code, new_pass)
+                success, message = db.reset_password(recovery_email, reset_code, new_pass)
                 if success:
                     st.success(message)
                     st.session_state.current_page = "login"
@@ -316,9 +403,21 @@ def main():
         elif menu == "Gestión de Candidatos":
             candidate_management()
         elif menu == "Interfaz de Voz":
+            # speech_recognition, gTTS y el audio local sólo se cargan al abrir esta página
+            from voice import voice_interface
             voice_interface()  # Llama a la función de voice.py
 
+        with st.sidebar.expander("Cachés"):
+            st.json({
+                "process": process_resources.stats(),
+                "session": session_cache(st.session_state).stats(),
+                "ranking": {"hits": ranking_cache.hits, "misses": ranking_cache.misses},
+                "candidate_table": candidate_table.stats(),
+                "candidate_mirror": candidate_mirror.stats(),
+            })
+
         if st.sidebar.button("Cerrar sesión"):
+            session_cache(st.session_state).invalidate()
             st.session_state.authenticated = False
             st.session_state.current_user = None
             st.session_state.phone_number = None
@@ -0,0 +1,359 @@
+"""
+Prueba de carga del media stream de Twilio contra el servidor de llamadas.
+
+Levanta conversational_call.main con uvicorn en un proceso hijo, sin red:
+  - el entorno se rellena con valores falsos antes de crear la aplicación
+  - el cliente REST de Twilio es un sustituto local (no hace llamadas)
+  - la conversación de ElevenLabs es EchoConversation, que devuelve al
+    llamante el audio que le llega por TwilioAudioInterface
+Cada llamada simulada abre /media-stream-eleven, envía connected/start,
+un frame "media" de 20 ms cada 20 ms en tiempo real, y stop. Cada frame
+lleva su número de secuencia, así que al volver con el eco se mide la
+latencia de ida y vuelta por frame.
+
+Por cada nivel de concurrencia informa percentiles de latencia, frames
+perdidos y CPU / memoria del servidor por llamada (leídos de /proc, sólo
+en Linux).
+
+Uso (desde attached_assets):
+    python -m benchmarks.bench_call_load [--concurrency 1,10,50] [--seconds 5]
+"""
+import argparse
+import asyncio
+import base64
+import json
+import multiprocessing
+import os
+import queue
+import socket
+import struct
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional
+
+import websockets
+
+FRAME_BYTES = 160  # 20 ms de μ-law a 8 kHz
+FRAME_SECONDS = 0.02
+MAGIC = b"LOAD"
+FILLER = b"\x7f" * (FRAME_BYTES - 8)
+
+
+class FakeCall:
+    sid = "CA00000000000000000000000000000000"
+
+
+class FakeCalls:
+    def create(self, **kwargs) -> FakeCall:
+        return FakeCall()
+
+
+class FakeTwilioClient:
+    """Cliente REST de Twilio local: calls.create no sale de la máquina"""
+
+    def __init__(self):
+        self.calls = FakeCalls()
+
+
+class EchoConversation:
+    """
+    Sustituto local de Conversation de ElevenLabs.
+
+    Como la conversación real, corre en su propio hilo y recibe el audio
+    del llamante por el input_callback del AudioInterface; en lugar de
+    mandarlo al agente, lo devuelve con audio_interface.output tras
+    `delay` segundos.
+    """
+
+    def __init__(self, audio_interface, delay: float = 0.0, **callbacks):
+        self.audio_interface = audio_interface
+        self.delay = delay
+        self._inbox: "queue.Queue[Optional[tuple]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+
+    def start_session(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        self.audio_interface.start(lambda audio: self._inbox.put((time.monotonic(), audio)))
+        while True:
+            item = self._inbox.get()
+            if item is None:
+                break
+            received_at, audio = item
+            wait = received_at + self.delay - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            self.audio_interface.output(audio)
+
+    def end_session(self):
+        self.audio_interface.stop()
+        self._inbox.put(None)
+
+    def wait_for_session_end(self) -> Optional[str]:
+        if self._thread:
+            self._thread.join()
+        return "echo"
+
+
+class EchoSessions:
+    """Sustituto de AgentSessionPool que entrega EchoConversation"""
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+
+    def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    def conversation(self, **kwargs) -> EchoConversation:
+        return EchoConversation(delay=self.delay, **kwargs)
+
+    def metrics(self) -> dict:
+        return {"ready": 0, "healthy": True, "hits": 0, "misses": 0, "evicted": 0}
+
+
+def fake_env(workdir: str) -> Dict[str, str]:
+    return {
+        "AGENT_ID": "agent_load_test",
+        "ELEVENLABS_API_KEY": "",
+        "OPENAI_API_KEY": "sk-load-test",
+        "TWILIO_ACCOUNT_SID": "AC00000000000000000000000000000000",
+        "TWILIO_AUTH_TOKEN": "load-test",
+        "TWILIO_FROM_NUMBER": "+10000000000",
+        "TWILIO_NUMBER_TO_CALL": "+10000000001",
+        "PUBLIC_URL": "http://127.0.0.1",
+        "DB_BACKEND": "memory",
+        "CALL_QUEUE_PATH": os.path.join(workdir, "call_jobs.db"),
+        "TTS_CACHE_DIR": os.path.join(workdir, "tts_cache"),
+        "TRANSACTION_JOURNAL_PATH": os.path.join(workdir, "journal.jsonl"),
+    }
+
+
+def serve(port: int, agent_delay: float, verbose: bool):
+    """Proceso hijo: servidor de llamadas con clientes y agente locales"""
+    os.environ.update(fake_env(tempfile.mkdtemp(prefix="call_load_")))
+    if not verbose:
+        sys.stdout = open(os.devnull, "w")
+
+    import uvicorn
+    from conversational_call.main import CallServices, create_app
+
+    services = CallServices(twilio=FakeTwilioClient(), agent_sessions=EchoSessions(agent_delay))
+    uvicorn.run(create_app(services), host="127.0.0.1", port=port, log_level="warning")
+
+
+class ProcessSampler:
+    """CPU y memoria residente de otro proceso leídos de /proc"""
+
+    def __init__(self, pid: int):
+        self.pid = pid
+        self.available = os.path.exists(f"/proc/{pid}/stat")
+        self._ticks = os.sysconf("SC_CLK_TCK") if self.available else 1
+        self._page = os.sysconf("SC_PAGE_SIZE") if self.available else 1
+
+    def cpu_seconds(self) -> float:
+        if not self.available:
+            return 0.0
+        with open(f"/proc/{self.pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / self._ticks
+
+    def rss_bytes(self) -> int:
+        if not self.available:
+            return 0
+        with open(f"/proc/{self.pid}/statm") as f:
+            return int(f.read().split()[1]) * self._page
+
+
+def frame(sequence_number: int) -> bytes:
+    return struct.pack(">I", sequence_number) + MAGIC + FILLER
+
+
+def media_message(stream_sid: str, sequence_number: int) -> str:
+    return json.dumps({
+        "event": "media",
+        "sequenceNumber": str(sequence_number),
+        "media": {
+            "track": "inbound",
+            "chunk": str(sequence_number - 1),
+            "timestamp": str(sequence_number * 20),
+            "payload": base64.b64encode(frame(sequence_number)).decode("ascii"),
+        },
+        "streamSid": stream_sid,
+    }, separators=(",", ":"))
+
+
+class CallResult:
+    def __init__(self):
+        self.sent: Dict[int, float] = {}
+        self.latencies: List[float] = []
+        self.late_sends = 0
+        self.error: Optional[str] = None
+
+    @property
+    def dropped(self) -> int:
+        return len(self.sent) - len(self.latencies)
+
+
+async def simulate_call(url: str, index: int, seconds: float, grace: float) -> CallResult:
+    result = CallResult()
+    stream_sid = f"MZ{index:032d}"
+    call_sid = f"CA{index:032d}"
+    loop = asyncio.get_running_loop()
+
+    async def receive(ws):
+        buffer = bytearray()
+        async for raw in ws:
+            data = json.loads(raw)
+            if data.get("event") != "media":
+                continue
+            now = loop.time()
+            buffer += base64.b64decode(data["media"]["payload"])
+            while len(buffer) >= FRAME_BYTES:
+                echoed = bytes(buffer[:FRAME_BYTES])
+                del buffer[:FRAME_BYTES]
+                if echoed[4:8] != MAGIC:
+                    continue
+                sent_at = result.sent.get(struct.unpack(">I", echoed[:4])[0])
+                if sent_at is not None:
+                    result.latencies.append(now - sent_at)
+
+    try:
+        async with websockets.connect(url, max_size=None) as ws:
+            receiver = asyncio.create_task(receive(ws))
+            await ws.send(json.dumps({"event": "connected", "protocol": "Call", "version": "1.0.0"}))
+            await ws.send(json.dumps({
+                "event": "start",
+                "sequenceNumber": "1",
+                "start": {"streamSid": stream_sid, "callSid": call_sid, "tracks": ["inbound"],
+                          "mediaFormat": {"encoding": "audio/x-mulaw", "sampleRate": 8000, "channels": 1}},
+                "streamSid": stream_sid,
+            }))
+            # Ritmo real: cada frame sale en su instante, sin acumular deriva
+            start = loop.time()
+            for sequence_number in range(2, 2 + int(seconds / FRAME_SECONDS)):
+                due = start + (sequence_number - 2) * FRAME_SECONDS
+                delay = due - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                elif delay < -FRAME_SECONDS:
+                    result.late_sends += 1
+                result.sent[sequence_number] = loop.time()
+                await ws.send(media_message(stream_sid, sequence_number))
+            await ws.send(json.dumps({"event": "stop", "sequenceNumber": str(sequence_number + 1),
+                                      "streamSid": stream_sid}))
+            await asyncio.sleep(grace)
+            receiver.cancel()
+    except Exception as e:
+        result.error = f"{type(e).__name__}: {e}"
+    return result
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+async def run_level(url: str, sampler: ProcessSampler, calls: int, seconds: float, grace: float) -> dict:
+    rss_before = sampler.rss_bytes()
+    cpu_before = sampler.cpu_seconds()
+    peak_rss = rss_before
+    done = asyncio.Event()
+
+    async def sample_rss():
+        nonlocal peak_rss
+        while not done.is_set():
+            peak_rss = max(peak_rss, sampler.rss_bytes())
+            await asyncio.sleep(0.1)
+
+    sampler_task = asyncio.create_task(sample_rss())
+    started = time.perf_counter()
+    results = await asyncio.gather(*(simulate_call(url, i, seconds, grace) for i in range(calls)))
+    elapsed = time.perf_counter() - started
+    done.set()
+    await sampler_task
+
+    latencies = [latency for r in results for latency in r.latencies]
+    sent = sum(len(r.sent) for r in results)
+    dropped = sum(r.dropped for r in results)
+    errors = [r.error for r in results if r.error]
+    return {
+        "calls": calls,
+        "frames": sent,
+        "dropped": dropped,
+        "drop_pct": 100 * dropped / sent if sent else 0.0,
+        "p50": 1000 * percentile(latencies, 0.50),
+        "p90": 1000 * percentile(latencies, 0.90),
+        "p99": 1000 * percentile(latencies, 0.99),
+        "late_sends": sum(r.late_sends for r in results),
+        "cpu_pct_per_call": 100 * (sampler.cpu_seconds() - cpu_before) / elapsed / calls,
+        "rss_kb_per_call": (peak_rss - rss_before) / 1024 / calls,
+        "errors": errors,
+    }
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port: int, timeout: float):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Call server did not start on port {port}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", default="1,10,25,50", help="Llamadas simultáneas por nivel, separadas por comas")
+    parser.add_argument("--seconds", type=float, default=5.0, help="Duración de cada llamada")
+    parser.add_argument("--grace", type=float, default=0.5, help="Espera del eco tras el último frame")
+    parser.add_argument("--agent-delay-ms", type=float, default=0.0, help="Retardo del agente de eco")
+    parser.add_argument("--verbose", action="store_true", help="Mostrar la salida del servidor")
+    args = parser.parse_args()
+
+    port = free_port()
+    server = multiprocessing.get_context("spawn").Process(
+        target=serve, args=(port, args.agent_delay_ms / 1000, args.verbose), daemon=True
+    )
+    server.start()
+    try:
+        wait_for_port(port, timeout=60)
+        sampler = ProcessSampler(server.pid)
+        url = f"ws://127.0.0.1:{port}/media-stream-eleven"
+
+        # Una llamada corta antes de medir: el primer nivel no incluye imports perezosos
+        asyncio.run(simulate_call(url, 0, 0.2, 0.1))
+
+        print(f"{'calls':>5} {'frames':>7} {'drop %':>7} {'p50 ms':>7} {'p90 ms':>7} {'p99 ms':>7} "
+              f"{'late tx':>7} {'cpu %/call':>10} {'rss KB/call':>11}")
+        for calls in (int(level) for level in args.concurrency.split(",")):
+            level = asyncio.run(run_level(url, sampler, calls, args.seconds, args.grace))
+            print(f"{level['calls']:>5} {level['frames']:>7} {level['drop_pct']:>7.2f} {level['p50']:>7.1f} "
+                  f"{level['p90']:>7.1f} {level['p99']:>7.1f} {level['late_sends']:>7} "
+                  f"{level['cpu_pct_per_call']:>10.2f} {level['rss_kb_per_call']:>11.0f}")
+            for error in level["errors"][:3]:
+                print(f"      error: {error}")
+        if not sampler.available:
+            print("CPU and memory need /proc (Linux)")
+    finally:
+        server.terminate()
+        server.join(5)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Memoria por candidato y coste de las vistas del registro.
+
+Compara InMemoryDB (un objeto pydantic por candidato) con ColumnarDB
+(columnas numpy) sobre un registro sintético: bytes por candidato medidos
+con tracemalloc, tiempo de candidates_frame() y de get_eligible_candidates().
+En ColumnarDB también eligible_rows(), que no materializa Candidate.
+
+Uso (desde attached_assets):
+    python -m benchmarks.bench_candidate_store [--candidates 200000]
+"""
+import argparse
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from columnar_db import ColumnarDB
+from database import InMemoryDB
+from models import Candidate
+
+NOW = datetime(2025, 1, 1)
+
+
+def synthetic_candidates(count: int):
+    for i in range(count):
+        yield Candidate(
+            name=f"Candidate {i}",
+            identification=f"ID{i:07d}",
+            address=f"{i % 2000} Main St",
+            phone=f"+57{i:010d}",
+            wallet_address=f"0x{i:040x}",
+            last_subsidy=None if i % 4 == 0 else NOW - timedelta(hours=i % 5000),
+            resumen="Desempleado, vive solo" if i % 20 == 0 else None
+        )
+
+
+def build_in_memory(count: int) -> InMemoryDB:
+    db = InMemoryDB()
+    for candidate in synthetic_candidates(count):
+        db.add_candidate(candidate)
+    return db
+
+
+def build_columnar(count: int) -> ColumnarDB:
+    return ColumnarDB(synthetic_candidates(count))
+
+
+def timed(func):
+    start = time.perf_counter()
+    result = func()
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--candidates", type=int, default=200_000)
+    args = parser.parse_args()
+
+    print(f"{'store':<12} {'bytes/cand':>10} {'frame ms':>9} {'eligible ms':>12} {'rows ms':>8}")
+    for name, build in (("InMemoryDB", build_in_memory), ("ColumnarDB", build_columnar)):
+        tracemalloc.start()
+        db = build(args.candidates)
+        per_candidate = tracemalloc.get_traced_memory()[0] / args.candidates
+        tracemalloc.stop()
+        frame_seconds, _ = timed(db.candidates_frame)
+        eligible_seconds, _ = timed(lambda: db.get_eligible_candidates(60, NOW))
+        rows = f"{1000 * timed(lambda: db.eligible_rows(60, NOW))[0]:>8,.1f}" if hasattr(db, "eligible_rows") else f"{'-':>8}"
+        print(f"{name:<12} {per_candidate:>10,.0f} {1000 * frame_seconds:>9,.0f} {1000 * eligible_seconds:>12,.0f} {rows}")
+        del db
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Tiempo de arranque en frío del servidor de llamadas y de la app de Streamlit.
+
+Cada medida se toma en un intérprete nuevo (mediana de --repeat):
+  - import: importar conversational_call.main (no debe cargar ElevenLabs,
+    OpenAI, pandas ni abrir la base de datos)
+  - create_app: construir la aplicación y sus servicios con entorno falso
+  - preload: importar en segundo plano los módulos pesados al arrancar
+  - ready: desde lanzar el proceso hasta que /metrics responde
+  - import app: la app de Streamlit sin abrir la interfaz de voz
+
+Uso (desde attached_assets):
+    python -m benchmarks.bench_cold_start [--repeat 5]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+from benchmarks.bench_call_load import fake_env, free_port
+
+HEAVY = ("elevenlabs", "openai", "pandas", "twilio.rest", "speech_recognition", "gtts", "database")
+
+PROBE = """
+import json, sys, time
+started = time.perf_counter()
+{code}
+elapsed = time.perf_counter() - started
+print(json.dumps({{"ms": 1000 * elapsed, "loaded": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+STEPS = {
+    "import": "import conversational_call.main",
+    "create_app": "from conversational_call.main import create_app\ncreate_app()",
+    "preload": "from conversational_call.main import preload_heavy_modules\npreload_heavy_modules()",
+    "import app": "import app",
+}
+# Lo que cada paso necesita ya importado; no cuenta en su tiempo
+SETUP = {
+    "create_app": "import conversational_call.main",
+    "preload": "import conversational_call.main",
+}
+
+
+def env() -> dict:
+    return {**os.environ, **fake_env(tempfile.mkdtemp(prefix="cold_start_"))}
+
+
+def probe(step: str) -> dict:
+    code = SETUP.get(step, "") + "\n" + PROBE.format(code=STEPS[step], heavy=HEAVY)
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, env=env())
+    if result.returncode != 0:
+        return {"error": result.stderr.strip().splitlines()[-1]}
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def time_to_ready(timeout: float = 60.0) -> dict:
+    port = free_port()
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-c", f"from benchmarks.bench_call_load import serve; serve({port}, 0.0, False)"],
+        env=env(), stderr=subprocess.DEVNULL
+    )
+    try:
+        while time.perf_counter() - started < timeout:
+            try:
+                urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=1).read()
+                return {"ms": 1000 * (time.perf_counter() - started), "loaded": []}
+            except OSError:
+                time.sleep(0.01)
+        return {"error": "timeout"}
+    finally:
+        server.terminate()
+        server.wait(5)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'step':<12} {'median ms':>10}  heavy modules loaded")
+    for step in (*STEPS, "ready"):
+        runs = [time_to_ready() if step == "ready" else probe(step) for _ in range(args.repeat)]
+        errors = [run["error"] for run in runs if "error" in run]
+        if errors:
+            print(f"{step:<12} {'-':>10}  {errors[0]}")
+            continue
+        median = statistics.median(run["ms"] for run in runs)
+        print(f"{step:<12} {median:>10.0f}  {', '.join(runs[-1]['loaded']) or '-'}")
+
+
+if __name__ == "__main__":
+    main()
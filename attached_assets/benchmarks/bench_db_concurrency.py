@@ -0,0 +1,130 @@
+"""
+Lecturas concurrentes de InMemoryDB con y sin escrituras en curso.
+
+Por cada número de hilos lectores mide operaciones de lectura por segundo
+y la latencia p99 de una lectura, primero sin escrituras y después con un
+hilo escritor que actualiza candidatos sin parar. Cada lectura comprueba
+además que el snapshot es coherente: el Candidate está en los índices por
+nombre, teléfono y billetera y en el de elegibilidad con su fecha actual,
+y su nombre y teléfono pertenecen a la misma escritura. Cualquier lectura rota se cuenta.
+
+Con el GIL el throughput total no escala con los hilos; lo que importa es
+que los lectores no esperan a los escritores ni ven estados a medias.
+
+Uso (desde attached_assets):
+    python -m benchmarks.bench_db_concurrency [--candidates 20000] [--threads 1,2,4,8] [--seconds 2]
+"""
+import argparse
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+
+from database import InMemoryDB, NEVER_SUBSIDIZED
+from models import Candidate
+
+NOW = datetime(2025, 1, 1)
+
+
+def build_db(count: int) -> InMemoryDB:
+    db = InMemoryDB()
+    for i in range(count):
+        db.add_candidate(Candidate(
+            name=f"Candidate {i} gen 0",
+            identification=f"ID{i:07d}",
+            address=f"{i % 2000} Main St",
+            phone=f"+57{i:010d}-0",
+            wallet_address=f"0x{i:040x}",
+            last_subsidy=None if i % 4 == 0 else NOW - timedelta(hours=i % 5000)
+        ))
+    return db
+
+
+def torn(db: InMemoryDB, identification: str) -> bool:
+    """True si el snapshot no es coherente para este candidato"""
+    snapshot = db.snapshot()
+    candidate = snapshot.candidates.get(identification)
+    if candidate is None:
+        return False
+    if identification not in snapshot.by_name.get(candidate.name, ()):
+        return True
+    if identification not in snapshot.by_phone.get(candidate.phone, ()):
+        return True
+    if identification not in snapshot.by_wallet.get(candidate.wallet_address, ()):
+        return True
+    if (candidate.last_subsidy or NEVER_SUBSIDIZED, identification) not in snapshot.eligibility:
+        return True
+    # El escritor pone la misma generación en nombre y teléfono
+    return candidate.name.rsplit(" ", 1)[1] != candidate.phone.rsplit("-", 1)[1]
+
+
+def reader(db: InMemoryDB, ids, stop: threading.Event, results: list):
+    rng = random.Random(threading.get_ident())
+    ops, broken, latencies = 0, 0, []
+    while not stop.is_set():
+        identification = rng.choice(ids)
+        start = time.perf_counter()
+        db.get_candidate(identification)
+        db.get_oldest_subsidy_candidate()
+        broken += torn(db, identification)
+        latencies.append(time.perf_counter() - start)
+        ops += 1
+    results.append((ops, broken, latencies))
+
+
+def writer(db: InMemoryDB, ids, stop: threading.Event, pause: float, results: list):
+    rng = random.Random(0)
+    writes = 0
+    while not stop.is_set():
+        identification = rng.choice(ids)
+        writes += 1
+        i = int(identification[2:])
+        db.update_candidate(identification, {
+            "name": f"Candidate {i} gen {writes}",
+            "phone": f"+57{i:010d}-{writes}",
+            "last_subsidy": NOW - timedelta(minutes=rng.randrange(200_000))
+        })
+        if pause:
+            time.sleep(pause)
+    results.append(writes)
+
+
+def run(db: InMemoryDB, ids, readers: int, writing: bool, seconds: float, pause: float):
+    stop = threading.Event()
+    read_results, write_results = [], []
+    threads = [threading.Thread(target=reader, args=(db, ids, stop, read_results)) for _ in range(readers)]
+    if writing:
+        threads.append(threading.Thread(target=writer, args=(db, ids, stop, pause, write_results)))
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    ops = sum(r[0] for r in read_results)
+    broken = sum(r[1] for r in read_results)
+    latencies = sorted(latency for r in read_results for latency in r[2])
+    p99 = latencies[int(0.99 * (len(latencies) - 1))] if latencies else 0.0
+    return ops / seconds, p99, broken, sum(write_results) / seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--candidates", type=int, default=20_000)
+    parser.add_argument("--threads", default="1,2,4,8", help="Hilos lectores, separados por comas")
+    parser.add_argument("--seconds", type=float, default=2.0)
+    parser.add_argument("--write-pause", type=float, default=0.001, help="Pausa del escritor entre escrituras (s)")
+    args = parser.parse_args()
+
+    db = build_db(args.candidates)
+    ids = [f"ID{i:07d}" for i in range(args.candidates)]
+    print(f"{'readers':>7} {'writer':>6} {'reads/s':>10} {'p99 us':>8} {'writes/s':>9} {'torn':>5}")
+    for readers in (int(t) for t in args.threads.split(",")):
+        for writing in (False, True):
+            reads, p99, broken, writes = run(db, ids, readers, writing, args.seconds, args.write_pause)
+            print(f"{readers:>7} {'yes' if writing else 'no':>6} {reads:>10,.0f} {1e6 * p99:>8,.0f} "
+                  f"{writes:>9,.0f} {broken:>5}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+Latencia del reconocimiento de voz después de que la persona deja de hablar.
+
+Reproduce un WAV (PCM 16 bits mono) al ritmo real de captura y mide cuánto
+tarda el texto final desde el último frame:
+  - lote: se acumula todo el audio y se reconoce al final (como
+    recognizer.listen + recognize_google)
+  - streaming: cada frame se entrega a Vosk según llega
+
+Ambos usan el mismo modelo local de Vosk, así que no hace falta red.
+Modelos: https://alphacephei.com/vosk/models (p. ej. vosk-model-small-es-0.42)
+
+Uso (desde attached_assets):
+    python -m benchmarks.bench_streaming_recognition --model RUTA_MODELO audio.wav
+"""
+import argparse
+import time
+import wave
+
+from speech_stream import VoskRecognizer, load_vosk_model, recognize_stream, wav_frames
+
+
+def batch(model_path: str, wav_path: str, sample_rate: int):
+    audio = b"".join(wav_frames(wav_path, realtime=True))
+    start = time.perf_counter()
+    recognizer = VoskRecognizer(model_path, sample_rate)
+    recognizer.accept(audio)
+    text = recognizer.finish()
+    return time.perf_counter() - start, text
+
+
+def streaming(model_path: str, wav_path: str, sample_rate: int):
+    last_frame = [0.0]
+
+    def frames():
+        for frame in wav_frames(wav_path, realtime=True):
+            yield frame
+        last_frame[0] = time.perf_counter()
+
+    text = recognize_stream(frames(), VoskRecognizer(model_path, sample_rate), stop_on_final=False)
+    return time.perf_counter() - last_frame[0], text
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("wav", help="WAV PCM de 16 bits mono")
+    parser.add_argument("--model", required=True, help="Directorio del modelo de Vosk")
+    args = parser.parse_args()
+
+    with wave.open(args.wav, "rb") as wav:
+        sample_rate = wav.getframerate()
+        duration = wav.getnframes() / sample_rate
+    load_vosk_model(args.model)
+
+    print(f"audio: {duration:.1f} s")
+    for name, run in (("batch", batch), ("streaming", streaming)):
+        latency, text = run(args.model, args.wav, sample_rate)
+        print(f"{name:<10} {1000 * latency:>8.0f} ms after speech ended  {text!r}")
+
+
+if __name__ == "__main__":
+    main()
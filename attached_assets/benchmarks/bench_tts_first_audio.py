@@ -0,0 +1,93 @@
+"""
+Tiempo hasta el primer audio (TTFA) de la síntesis de voz.
+
+Compara, para la respuesta de voice_interface y la notificación de las
+llamadas:
+  - tempfile: sintetizar todo, guardar en disco y volver a leer (camino anterior)
+  - memoria: sintetizar todo en memoria con TTSCache.render
+  - streaming: TTSCache.render_stream, primer trozo
+  - streaming + caché: igual, con los segmentos fijos de la plantilla ya en caché
+
+Por defecto usa un sintetizador simulado que, como gTTS, parte el texto en
+tramos de 100 caracteres y tarda `--part-latency` segundos por tramo, así
+que no necesita red. Con --live usa gTTS de verdad.
+
+Uso (desde attached_assets):
+    python -m benchmarks.bench_tts_first_audio [--live]
+"""
+import argparse
+import os
+import tempfile
+import textwrap
+import time
+
+from tts_cache import NOTIFICATION_MESSAGE, VOICE_REPLY, TTSCache, gtts_stream
+
+
+def simulated_gtts(part_latency: float):
+    def synthesize(text, voice, fmt):
+        for part in textwrap.wrap(text, 100) or [text]:
+            time.sleep(part_latency)
+            yield os.urandom(len(part) * 150)
+    return synthesize
+
+
+def tempfile_path(synthesize, text, voice) -> float:
+    start = time.perf_counter()
+    audio = b"".join(synthesize(text, voice, "mp3"))
+    with tempfile.NamedTemporaryFile(suffix=".mp3") as tmp_file:
+        tmp_file.write(audio)
+        tmp_file.flush()
+        with open(tmp_file.name, "rb") as f:
+            f.read()
+    return time.perf_counter() - start
+
+
+def memory_path(synthesize, text, voice) -> float:
+    start = time.perf_counter()
+    TTSCache(synthesize).render(text, voice, templates=())
+    return time.perf_counter() - start
+
+
+def first_chunk(cache: TTSCache, text, voice) -> float:
+    start = time.perf_counter()
+    stream = cache.render_stream(text, voice)
+    next(stream)
+    elapsed = time.perf_counter() - start
+    for _ in stream:
+        pass
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--live", action="store_true", help="Usar gTTS (requiere red)")
+    parser.add_argument("--part-latency", type=float, default=0.25, help="Segundos por tramo simulado")
+    args = parser.parse_args()
+
+    synthesize = gtts_stream if args.live else simulated_gtts(args.part_latency)
+    cases = [
+        ("voice reply", "es", VOICE_REPLY, {"text": "quisiera saber cuándo se deposita el subsidio del mes y si "
+                                                    "puedo cambiar el número de teléfono asociado a mi billetera, "
+                                                    "porque el que tienen registrado ya no lo uso"},
+         {"text": "hola"}),
+        ("notification", "en", NOTIFICATION_MESSAGE, {"name": "Maria Fernanda Rodriguez", "amount": 100},
+         {"name": "Juan", "amount": 100}),
+    ]
+
+    print(f"{'message':<14} {'tempfile':>10} {'memory':>10} {'streaming':>10} {'+cache':>10}   (ms to first audio)")
+    for name, voice, template, values, warmup_values in cases:
+        text = template.format(**values)
+        warm = TTSCache(synthesize)
+        warm.render(template.format(**warmup_values), voice)
+        row = [
+            tempfile_path(synthesize, text, voice),
+            memory_path(synthesize, text, voice),
+            first_chunk(TTSCache(synthesize), text, voice),
+            first_chunk(warm, text, voice),
+        ]
+        print(f"{name:<14} " + " ".join(f"{1000 * seconds:>10.0f}" for seconds in row))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Microbenchmark del códec del media stream de Twilio.
+
+Compara mensajes por segundo en un núcleo entre el camino anterior
+(json.loads + base64.b64decode / base64.b64encode + dict + json.dumps)
+y conversational_call.twilio_codec.
+
+Uso (desde attached_assets):
+    python -m benchmarks.bench_twilio_codec
+"""
+import argparse
+import base64
+import json
+import os
+import time
+
+from conversational_call.twilio_codec import MediaEncoder, decode_message
+
+STREAM_SID = "MZ18ad3ab5a668481ce02b83e7395059f0"
+FRAME = os.urandom(160)  # 20 ms de μ-law a 8 kHz
+
+
+def inbound_message(sequence_number: int) -> str:
+    return json.dumps({
+        "event": "media",
+        "sequenceNumber": str(sequence_number),
+        "media": {
+            "track": "inbound",
+            "chunk": str(sequence_number - 1),
+            "timestamp": str(sequence_number * 20),
+            "payload": base64.b64encode(FRAME).decode("ascii"),
+        },
+        "streamSid": STREAM_SID,
+    }, separators=(",", ":"))
+
+
+def decode_baseline(raw: str):
+    data = json.loads(raw)
+    if data["event"] == "media":
+        return base64.b64decode(data["media"]["payload"])
+
+
+def decode_codec(raw: str):
+    return decode_message(raw).payload
+
+
+def encode_baseline(audio: bytes) -> str:
+    # send_json de Starlette serializa con json.dumps
+    return json.dumps({
+        "event": "media",
+        "streamSid": STREAM_SID,
+        "media": {"payload": base64.b64encode(audio).decode("utf-8")},
+    })
+
+
+def measure(func, items, seconds: float) -> float:
+    count = 0
+    start = time.perf_counter()
+    deadline = start + seconds
+    while time.perf_counter() < deadline:
+        for item in items:
+            func(item)
+        count += len(items)
+    return count / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=2.0, help="Duración de cada medición")
+    args = parser.parse_args()
+
+    messages = [inbound_message(i) for i in range(1, 1001)]
+    frames = [FRAME] * 1000
+    encoder = MediaEncoder(STREAM_SID)
+
+    assert decode_codec(messages[0]) == decode_baseline(messages[0])
+    assert json.loads(encoder.media(FRAME)) == json.loads(encode_baseline(FRAME))
+
+    results = [
+        ("inbound decode", measure(decode_baseline, messages, args.seconds), measure(decode_codec, messages, args.seconds)),
+        ("outbound encode", measure(encode_baseline, frames, args.seconds), measure(encoder.media, frames, args.seconds)),
+    ]
+
+    print(f"{'path':<16} {'before msg/s':>14} {'after msg/s':>14} {'speedup':>8}")
+    for name, before, after in results:
+        print(f"{name:<16} {before:>14,.0f} {after:>14,.0f} {after / before:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Réplica local del registro de candidatos para el ranking.
+
+El ranking necesita todos los candidatos y un hash de su contenido, y
+releerlos con get_all_candidates() cuesta O(registro) (en SQLite, además,
+un Candidate por fila). La réplica los lee una vez y después aplica sólo
+los cambios del change feed, manteniendo el hash con una suma de hashes
+por candidato (ver ranking_cache.candidate_digest).
+"""
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from change_feed import CANDIDATE_ADDED, CANDIDATE_KINDS, Change
+from models import Candidate
+from ranking_cache import candidate_digest, combined_hash
+
+
+class CandidateMirror:
+    """
+    Args:
+        max_delta (int): Con más cambios pendientes se relee el registro completo.
+    """
+
+    def __init__(self, max_delta: int = 1000):
+        self.max_delta = max_delta
+        self._lock = threading.Lock()
+        self._db_id: Optional[int] = None
+        self._changes_version = 0
+        self._candidates: Dict[str, Candidate] = {}
+        self._digests: Dict[str, int] = {}
+        self._total = 0
+        self._snapshot: Optional[Tuple[List[Candidate], str]] = None
+        self.rebuilds = 0
+        self.patches = 0
+
+    def _rebuild(self, db):
+        # Leída antes que los candidatos: lo que entre en medio se vuelve a aplicar en orden
+        self._changes_version = db.changes_version
+        self._candidates = {c.identification: c for c in db.get_all_candidates()}
+        self._digests = {identification: candidate_digest(c) for identification, c in self._candidates.items()}
+        self._total = sum(self._digests.values())
+        self._db_id = id(db)
+        self._snapshot = None
+        self.rebuilds += 1
+
+    def _apply(self, changes: List[Change]) -> bool:
+        for change in changes:
+            if change.kind not in CANDIDATE_KINDS:
+                continue
+            if change.kind == CANDIDATE_ADDED:
+                candidate = Candidate.model_construct(**change.data)
+            else:
+                current = self._candidates.get(change.key)
+                if current is None or "identification" in change.data:
+                    return False
+                candidate = current.model_copy(update=change.data)
+            digest = candidate_digest(candidate)
+            self._total += digest - self._digests.get(change.key, 0)
+            self._digests[change.key] = digest
+            self._candidates[change.key] = candidate
+            self._snapshot = None
+        return True
+
+    def sync(self, db) -> Tuple[List[Candidate], str]:
+        """
+        Candidatos de `db` al día y hash de su contenido relevante para el ranking.
+
+        Returns:
+            Tuple[List[Candidate], str]: Los candidatos y el hash, que no
+                depende del orden.
+        """
+        with self._lock:
+            if self._db_id != id(db):
+                self._rebuild(db)
+            else:
+                changes = db.changes_since(self._changes_version)
+                if changes is None or len(changes) > self.max_delta or not self._apply(changes):
+                    self._rebuild(db)
+                elif changes:
+                    self._changes_version = changes[-1].version
+                    self.patches += 1
+            if self._snapshot is None:
+                self._snapshot = (list(self._candidates.values()), combined_hash(self._total))
+            return self._snapshot
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"candidates": len(self._candidates), "rebuilds": self.rebuilds, "patches": self.patches}
+
+
+# Instancia compartida entre todas las sesiones de Streamlit del proceso
+candidate_mirror = CandidateMirror()
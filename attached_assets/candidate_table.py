@@ -0,0 +1,280 @@
+"""
+Tabla de candidatos paginada en el servidor.
+
+Filtra, ordena y pagina sobre db.candidates_frame() y sólo convierte a
+tabla de presentación la ventana visible, así lo que se envía al navegador
+no crece con el registro. El orden de cada combinación de filtro y columna
+se guarda como un array de posiciones; pasar de página es un slice de ese
+array. Cuando avanza db.changes_version, la tabla pide al change feed
+lo ocurrido desde su última versión y parchea el frame y cada orden
+guardado sólo en las filas afectadas; si los cambios ya no se conservan o
+son demasiados, lo reconstruye todo.
+"""
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from change_feed import CANDIDATE_ADDED, CANDIDATE_KINDS, Change
+from eligibility import DEFAULT_POLICY, EligibilityPolicy
+
+# Columnas visibles -> campo de Candidate por el que se ordena
+SORT_COLUMNS = {
+    "Name": "name",
+    "ID": "identification",
+    "Phone": "phone",
+    "Last Subsidy": "last_subsidy",
+}
+SEARCH_FIELDS = ("name", "identification", "phone")
+PAGE_SIZES = (25, 50, 100)
+
+
+@dataclass(frozen=True)
+class TableQuery:
+    """
+    Args:
+        search (str): Texto buscado en nombre, identificación o teléfono.
+        eligible_only (bool): Mostrar sólo candidatos elegibles.
+        sort_by (str): Campo de Candidate por el que se ordena.
+        descending (bool): Orden descendente.
+    """
+    search: str = ""
+    eligible_only: bool = False
+    sort_by: str = "name"
+    descending: bool = False
+
+
+def _sort_values(column: pd.Series) -> np.ndarray:
+    values = column.to_numpy()
+    if values.dtype.kind == "M":
+        # NaT es el int64 mínimo: "nunca subsidiado" ordena primero, como en la base de datos
+        return values.view("i8")
+    return column.to_numpy(dtype=object)
+
+
+def _patched_column(column: pd.Series, rows: List[int], values: List[Any]) -> pd.Series:
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        missing = [value for value in set(values) if value is not None and value not in column.cat.categories]
+        if missing:
+            column = column.cat.add_categories(missing)
+    elif column.dtype.kind == "M":
+        values = [pd.NaT if value is None else value for value in values]
+    column = column.copy()
+    column.iloc[rows] = values
+    return column
+
+
+class CandidateTable:
+    """
+    Vistas ordenadas del registro, compartidas entre sesiones de Streamlit.
+
+    Se guardan hasta `maxsize` vistas (LRU) para la versión actual del
+    registro. El filtro de elegibilidad depende de la hora, por eso sus
+    vistas se calculan con la hora truncada al minuto. Con hasta
+    `max_delta` cambios pendientes se parchean frame y vistas en lugar de
+    reconstruirlos.
+    """
+
+    def __init__(self, maxsize: int = 32, policy: EligibilityPolicy = DEFAULT_POLICY, max_delta: int = 1000):
+        self.maxsize = maxsize
+        self.policy = policy
+        self.max_delta = max_delta
+        self._lock = threading.Lock()
+        self._version: Optional[tuple] = None
+        self._changes_version = 0
+        self._frame: Optional[pd.DataFrame] = None
+        self._ids: Optional[pd.Index] = None
+        self._views: "OrderedDict[tuple, np.ndarray]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.rebuilds = 0
+        self.patches = 0
+
+    def _current_frame(self, db) -> Tuple[tuple, pd.DataFrame]:
+        # La versión es la del último cambio aplicado, no una lectura aparte
+        # de candidates_version: así nunca se da por vista una versión cuyos
+        # cambios no llegaron a aplicarse
+        changes_version = db.changes_version
+        with self._lock:
+            if self._version is not None and self._version[0] == id(db):
+                if changes_version <= self._changes_version:
+                    return self._version, self._frame
+                changes = db.changes_since(self._changes_version)
+                if changes is not None and len(changes) <= self.max_delta and self._apply_changes(changes):
+                    if changes:
+                        self._changes_version = changes[-1].version
+                        self._version = (id(db), self._changes_version)
+                        self.patches += 1
+                    return self._version, self._frame
+        # Leída antes que el frame, y el backend no la publica antes que los
+        # datos: lo que entre en medio se vuelve a aplicar, y aplicarlo es idempotente
+        frame = db.candidates_frame()
+        version = (id(db), changes_version)
+        with self._lock:
+            self._version = version
+            self._changes_version = changes_version
+            self._frame = frame
+            self._ids = None
+            self._views.clear()
+            self.rebuilds += 1
+        return version, frame
+
+    def _apply_changes(self, changes: List[Change]) -> bool:
+        """
+        Aplica los cambios de candidatos al frame y a las vistas guardadas.
+        Se llama con el lock tomado; False si hay que reconstruir.
+        """
+        frame = self._frame
+        if self._ids is None:
+            self._ids = pd.Index(frame["identification"])
+        added: Dict[str, Dict[str, Any]] = {}
+        updates: Dict[str, Tuple[List[int], List[Any]]] = {}
+        touched = set()
+        for change in changes:
+            if change.kind not in CANDIDATE_KINDS:
+                continue
+            if change.kind == CANDIDATE_ADDED:
+                # Puede estar ya en el frame si se leyó después de la versión guardada
+                if change.key not in added and change.key not in self._ids:
+                    added[change.key] = dict(change.data)
+                continue
+            if "identification" in change.data:
+                return False
+            if change.key in added:
+                added[change.key].update(change.data)
+                continue
+            row = self._ids.get_indexer([change.key])[0]
+            if row < 0:
+                return False
+            touched.add(row)
+            for field, value in change.data.items():
+                rows, values = updates.setdefault(field, ([], []))
+                rows.append(row)
+                values.append(value)
+        if not added and not updates:
+            return True
+
+        try:
+            # Copia superficial: quien ya tenga el frame anterior lo sigue viendo intacto
+            frame = frame.copy(deep=False)
+            for field, (rows, values) in updates.items():
+                frame[field] = _patched_column(frame[field], rows, values)
+            if added:
+                new_rows = pd.DataFrame.from_records(list(added.values()), columns=list(frame.columns))
+                new_rows["last_subsidy"] = pd.to_datetime(new_rows["last_subsidy"])
+                touched.update(range(len(frame), len(frame) + len(new_rows)))
+                frame = pd.concat([frame, new_rows], ignore_index=True)
+                self._ids = self._ids.append(pd.Index(list(added)))
+        except (TypeError, ValueError) as e:
+            print(f"Error patching candidate table, rebuilding: {str(e)}")
+            return False
+
+        rows = np.fromiter(sorted(touched), dtype=np.intp, count=len(touched))
+        for (query, now), positions in self._views.items():
+            self._views[(query, now)] = self._patch_view(frame, positions, query, now, rows)
+        self._frame = frame
+        return True
+
+    def _patch_view(self, frame: pd.DataFrame, positions: np.ndarray, query: TableQuery,
+                    now: Optional[datetime], rows: np.ndarray) -> np.ndarray:
+        """Saca `rows` de un orden guardado y vuelve a insertar las que cumplen el filtro en su sitio"""
+        # Se trabaja sobre el orden ascendente; el descendente es su inverso exacto
+        ascending = positions[::-1] if query.descending else positions
+        ascending = ascending[~np.isin(ascending, rows)]
+        keep = rows[self._filter(frame.take(rows), query, now)]
+        if len(keep):
+            keys = _sort_values(frame[query.sort_by].take(ascending))
+            new_keys = _sort_values(frame[query.sort_by].take(keep))
+            # Mismo orden que argsort estable sobre posiciones crecientes: (valor, posición)
+            inserts = sorted(zip(new_keys.tolist(), keep.tolist()))
+            at = []
+            for key, row in inserts:
+                lo = int(np.searchsorted(keys, key, side="left"))
+                hi = int(np.searchsorted(keys, key, side="right"))
+                at.append(lo + int(np.searchsorted(ascending[lo:hi], row)))
+            ascending = np.insert(ascending, at, [row for _, row in inserts])
+        return ascending[::-1] if query.descending else ascending
+
+    def count(self, db) -> int:
+        """Número de candidatos del registro"""
+        return len(self._current_frame(db)[1])
+
+    def _filter(self, frame: pd.DataFrame, query: TableQuery, now: datetime) -> np.ndarray:
+        mask = np.ones(len(frame), dtype=bool)
+        if query.search:
+            found = np.zeros(len(frame), dtype=bool)
+            for field in SEARCH_FIELDS:
+                found |= frame[field].str.contains(query.search, case=False, regex=False).to_numpy(dtype=bool)
+            mask &= found
+        if query.eligible_only:
+            mask &= self.policy.mask(frame["last_subsidy"], now)
+        return np.flatnonzero(mask)
+
+    def view(self, db, query: TableQuery, now: Optional[datetime] = None) -> Tuple[pd.DataFrame, np.ndarray]:
+        """
+        Posiciones de las filas que cumplen el filtro, ya ordenadas.
+
+        Returns:
+            Tuple[pd.DataFrame, np.ndarray]: El frame del registro y las posiciones.
+        """
+        now = (now or datetime.now()).replace(second=0, microsecond=0)
+        version, frame = self._current_frame(db)
+        key = (query, now if query.eligible_only else None)
+        with self._lock:
+            positions = self._views.get(key)
+            if positions is not None and self._version == version:
+                self._views.move_to_end(key)
+                self.hits += 1
+                return frame, positions
+            self.misses += 1
+        positions = self._filter(frame, query, now)
+        order = np.argsort(_sort_values(frame[query.sort_by].iloc[positions]), kind="stable")
+        positions = positions[order[::-1] if query.descending else order]
+        with self._lock:
+            if self._version == version:
+                self._views[key] = positions
+                while len(self._views) > self.maxsize:
+                    self._views.popitem(last=False)
+        return frame, positions
+
+    def page(self, db, query: TableQuery, page: int = 0, page_size: int = PAGE_SIZES[1],
+             now: Optional[datetime] = None) -> Tuple[pd.DataFrame, int]:
+        """
+        Una página lista para st.dataframe.
+
+        Args:
+            page (int): Número de página, empezando en 0.
+            page_size (int): Filas por página.
+            now (datetime): Instante de referencia para la columna de elegibilidad.
+
+        Returns:
+            Tuple[pd.DataFrame, int]: Filas de la página y total de filas del filtro.
+        """
+        now = now or datetime.now()
+        frame, positions = self.view(db, query, now)
+        start = max(page, 0) * page_size
+        rows = frame.take(positions[start:start + page_size])
+        last_subsidy = rows["last_subsidy"]
+        table = pd.DataFrame({
+            "Name": rows["name"].to_numpy(),
+            "ID": rows["identification"].to_numpy(),
+            "Phone": rows["phone"].to_numpy(),
+            "Last Subsidy": last_subsidy.dt.strftime("%Y-%m-%d").fillna("Never").to_numpy(),
+            "Is Eligible": self.policy.mask(last_subsidy, now),
+        })
+        return table, len(positions)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "views": len(self._views), "hits": self.hits, "misses": self.misses,
+                "rebuilds": self.rebuilds, "patches": self.patches
+            }
+
+
+# Instancia compartida entre todas las sesiones de Streamlit del proceso
+candidate_table = CandidateTable()
@@ -0,0 +1,115 @@
+"""
+Registro secuenciado de cambios de la base de datos.
+
+Cada alta o modificación de un candidato y cada transacción registrada
+produce un Change con un número de versión creciente. Quien mantiene una
+vista derivada (tabla, réplica, caché) guarda la última versión que aplicó
+y en la siguiente lectura pide sólo lo posterior con changes_since(): el
+trabajo es proporcional a los cambios, no al registro. Si la versión pedida
+ya no está retenida, changes_since() devuelve None y hay que reconstruir.
+"""
+from collections import deque
+import threading
+from typing import Any, Callable, Deque, Dict, List, NamedTuple, Optional, Sequence
+
+CANDIDATE_ADDED = "candidate_added"
+CANDIDATE_UPDATED = "candidate_updated"
+TRANSACTION_ADDED = "transaction_added"
+CANDIDATE_KINDS = (CANDIDATE_ADDED, CANDIDATE_UPDATED)
+
+
+class Change(NamedTuple):
+    """
+    Args:
+        version (int): Número de secuencia, consecutivo desde 1.
+        kind (str): CANDIDATE_ADDED, CANDIDATE_UPDATED o TRANSACTION_ADDED.
+        key (str): Identificación del candidato, o billetera destino de la transacción.
+        data (dict): Campos nuevos; en las altas, el registro completo.
+    """
+    version: int
+    kind: str
+    key: str
+    data: Dict[str, Any]
+
+
+Subscriber = Callable[[Change], None]
+
+
+class ChangeFeed:
+    """
+    Cambios recientes de un proceso, en memoria.
+
+    Los suscriptores se llaman en orden de versión desde el hilo que
+    escribió, antes de que la escritura termine: deben ser rápidos y no
+    pueden escribir en la base de datos.
+
+    Args:
+        retained (int): Cambios que se conservan para changes_since().
+    """
+
+    def __init__(self, retained: int = 10_000):
+        # Reentrante: un suscriptor puede darse de baja desde su propia llamada
+        self._lock = threading.RLock()
+        self._changes: Deque[Change] = deque(maxlen=retained)
+        self._subscribers: List[Subscriber] = []
+        self.version = 0
+
+    def _publish(self, change: Change):
+        self._changes.append(change)
+        for subscriber in list(self._subscribers):
+            try:
+                subscriber(change)
+            except Exception as e:
+                print(f"Error in change feed subscriber: {str(e)}")
+
+    def append(self, kind: str, key: str, data: Dict[str, Any]) -> Change:
+        with self._lock:
+            self.version += 1
+            change = Change(self.version, kind, key, data)
+            self._publish(change)
+        return change
+
+    def extend(self, kind: str, keys: Sequence[str], records: Sequence[Any]) -> int:
+        """
+        Publica un cambio por registro (modelos pydantic) en un solo paso.
+
+        En una carga masiva sólo se materializan los cambios que caben en
+        la retención, salvo que haya suscriptores. Devuelve la versión final.
+        """
+        with self._lock:
+            first = self.version + 1
+            self.version += len(records)
+            skip = 0 if self._subscribers else max(0, len(records) - self._changes.maxlen)
+            for offset in range(skip, len(records)):
+                change = Change(first + offset, kind, keys[offset], dict(records[offset]))
+                self._publish(change)
+            return self.version
+
+    def since(self, version: int) -> Optional[List[Change]]:
+        """Cambios posteriores a `version`, o None si ya no están todos retenidos"""
+        with self._lock:
+            if version > self.version:
+                return None
+            if version == self.version:
+                return []
+            if not self._changes or self._changes[0].version > version + 1:
+                return None
+            # Se recorre desde el final: O(cambios pedidos), no O(retenidos)
+            changes = []
+            for change in reversed(self._changes):
+                if change.version <= version:
+                    break
+                changes.append(change)
+        changes.reverse()
+        return changes
+
+    def subscribe(self, subscriber: Subscriber) -> Callable[[], None]:
+        """Registra `subscriber` para los cambios siguientes; devuelve la función para darlo de baja"""
+        with self._lock:
+            self._subscribers.append(subscriber)
+
+        def unsubscribe():
+            with self._lock:
+                if subscriber in self._subscribers:
+                    self._subscribers.remove(subscriber)
+        return unsubscribe
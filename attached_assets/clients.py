@@ -0,0 +1,107 @@
+"""
+Registro compartido de clientes de API.
+
+Cada cliente se crea una sola vez por proceso y reutiliza un pool de
+conexiones HTTP keep-alive, de modo que las peticiones siguientes no
+repiten el handshake TCP/TLS. Streamlit vuelve a ejecutar app.py en cada
+interacción, pero los clientes quedan en la caché de recursos del proceso.
+"""
+import os
+from typing import Callable, TypeVar
+
+import httpx
+
+from resources import process_resources
+
+T = TypeVar("T")
+
+# Conexiones keep-alive por host; el despachador de llamadas usa hasta
+# CALL_CONCURRENCY peticiones simultáneas a Twilio
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", 64))
+KEEPALIVE_SECONDS = 60.0
+
+
+def _shared(name: str, factory: Callable[[], T]) -> T:
+    return process_resources.get(f"client:{name}", factory)
+
+
+def _pop(name: str):
+    return process_resources.pop(f"client:{name}")
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=HTTP_POOL_SIZE,
+        max_keepalive_connections=HTTP_POOL_SIZE,
+        keepalive_expiry=KEEPALIVE_SECONDS
+    )
+
+
+def http_client() -> httpx.Client:
+    """Pool HTTP síncrono compartido por OpenAI y ElevenLabs"""
+    return _shared("http", lambda: httpx.Client(limits=_limits(), timeout=60.0))
+
+
+def async_http_client() -> httpx.AsyncClient:
+    """Pool HTTP asíncrono; debe usarse siempre desde el mismo event loop"""
+    return _shared("async_http", lambda: httpx.AsyncClient(limits=_limits(), timeout=60.0))
+
+
+def openai_client():
+    from openai import OpenAI
+
+    return _shared("openai", lambda: OpenAI(
+        api_key=os.getenv("OPENAI_API_KEY"),
+        http_client=http_client()
+    ))
+
+
+def async_openai_client():
+    from openai import AsyncOpenAI
+
+    return _shared("async_openai", lambda: AsyncOpenAI(
+        api_key=os.getenv("OPENAI_API_KEY"),
+        http_client=async_http_client()
+    ))
+
+
+def elevenlabs_client():
+    from elevenlabs import ElevenLabs
+
+    return _shared("elevenlabs", lambda: ElevenLabs(
+        api_key=os.getenv("ELEVENLABS_API_KEY"),
+        httpx_client=http_client()
+    ))
+
+
+def twilio_client():
+    def build():
+        from requests.adapters import HTTPAdapter
+        from twilio.http.http_client import TwilioHttpClient
+        from twilio.rest import Client
+
+        http = TwilioHttpClient(pool_connections=True, timeout=30)
+        # El adaptador por defecto sólo guarda min(32, cpus + 4) conexiones
+        http.session.mount("https://", HTTPAdapter(pool_maxsize=HTTP_POOL_SIZE))
+        return Client(os.getenv("TWILIO_ACCOUNT_SID"), os.getenv("TWILIO_AUTH_TOKEN"), http_client=http)
+
+    return _shared("twilio", build)
+
+
+def close_clients():
+    """Cierra los pools síncronos (los asíncronos se cierran con aclose_clients)"""
+    for name in ("http", "twilio"):
+        client = _pop(name)
+        if isinstance(client, httpx.Client):
+            client.close()
+        elif client is not None:
+            client.http_client.session.close()
+    for name in ("openai", "elevenlabs"):
+        _pop(name)
+
+
+async def aclose_clients():
+    client = _pop("async_http")
+    _pop("async_openai")
+    if client is not None:
+        await client.aclose()
@@ -0,0 +1,520 @@
+from datetime import datetime
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+import pandas as pd
+
+from change_feed import CANDIDATE_ADDED, CANDIDATE_UPDATED
+from cow_collections import ChunkedMap, ChunkedMapEditor
+from database import InMemoryDB
+from models import Candidate, RANKING_FIELDS
+from eligibility import policy_for
+
+# Columnas de texto guardadas como arrays de bytes UTF-8 de ancho fijo
+TEXT_COLUMNS = ("identification", "name", "phone", "wallet_address")
+# Columnas guardadas en bloques de arrays numpy
+BLOCK_COLUMNS = TEXT_COLUMNS + ("address_code", "last_subsidy")
+# Campos con índice {valor: filas}; pueden repetirse entre candidatos
+INDEXED_FIELDS = {"name": "by_name", "phone": "by_phone", "wallet_address": "by_wallet"}
+NAT = np.datetime64("NaT", "us")
+# Filas por bloque: una escritura copia como mucho un bloque por columna tocada
+BLOCK_ROWS = 65_536
+
+
+def _width(length: int) -> int:
+    return max(8, (length + 7) // 8 * 8)
+
+
+def _codes_dtype(categories: int) -> type:
+    """Mismo tipo de código que elige pandas, para que Categorical no copie"""
+    for dtype in (np.int8, np.int16, np.int32):
+        if categories < np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+
+def _empty_column(column: str) -> np.ndarray:
+    if column in TEXT_COLUMNS:
+        return np.zeros(0, dtype="S8")
+    if column == "address_code":
+        return np.zeros(0, dtype=np.int8)
+    return np.full(0, NAT)
+
+
+class CandidateColumns:
+    """
+    Versión publicada del almacén columnar del registro de candidatos.
+
+    - Textos fijos (identificación, nombre, teléfono, billetera): arrays
+      numpy de bytes UTF-8 de ancho fijo; un bloque se ensancha si le llega
+      un valor más largo.
+    - Dirección: categórica, un código entero por fila (int8 mientras haya
+      menos de 127 direcciones distintas) y cada dirección guardada una vez.
+    - last_subsidy: datetime64[us], NaT si nunca hubo subsidio.
+    - resumen: disperso, {fila: texto}, porque la mayoría no tiene.
+    - Índices de identificación, nombre, teléfono y billetera a filas, para
+      que las búsquedas puntuales no recorran las columnas.
+
+    Las columnas se guardan en bloques de `block_rows` filas que no cambian
+    después de publicarse: una escritura copia sólo los bloques que toca
+    (ver edit()) y la versión nueva comparte el resto con la anterior. Las
+    filas no se mueven nunca; las altas se añaden al final.
+
+    Lo que se calcula sobre el registro completo (columnas concatenadas,
+    orden por subsidio, DataFrame) se cachea en la propia versión, así que
+    nunca se mezcla con otra.
+    """
+
+    def __init__(self, version: int, changes_version: int, candidates_version: int, ranking_version: int,
+                 size: int, block_rows: int,
+                 blocks: Dict[str, Tuple[np.ndarray, ...]], addresses: List[str],
+                 address_index: Dict[str, int], resumen: ChunkedMap[int, str], rows: ChunkedMap[str, int],
+                 by_name: ChunkedMap[str, Tuple[int, ...]], by_phone: ChunkedMap[str, Tuple[int, ...]],
+                 by_wallet: ChunkedMap[str, Tuple[int, ...]]):
+        self.version = version
+        # Último cambio del change feed incluido en esta versión
+        self.changes_version = changes_version
+        self.candidates_version = candidates_version
+        self.ranking_version = ranking_version
+        self.size = size
+        self.block_rows = block_rows
+        self.blocks = blocks
+        # Sólo crecen: esta versión usa las `address_count` primeras
+        self.addresses = addresses
+        self.address_count = len(addresses)
+        self._address_index = address_index
+        self.resumen = resumen
+        # identificación -> fila; nombre, teléfono y billetera -> filas
+        self.rows = rows
+        self.by_name = by_name
+        self.by_phone = by_phone
+        self.by_wallet = by_wallet
+        self._cache_lock = threading.RLock()
+        self._cache: Dict[Any, Any] = {}
+
+    @classmethod
+    def empty(cls, block_rows: int = BLOCK_ROWS) -> "CandidateColumns":
+        return cls(
+            0, 0, 0, 0, 0, block_rows, {column: () for column in BLOCK_COLUMNS}, [], {},
+            ChunkedMap(), ChunkedMap(), ChunkedMap(), ChunkedMap(), ChunkedMap()
+        )
+
+    def edit(self) -> "CandidateColumnsEditor":
+        return CandidateColumnsEditor(self)
+
+    def _cached(self, key, build: Callable[[], Any]) -> Any:
+        """Calcula `key` una vez por versión, aunque lo pidan varios hilos a la vez"""
+        with self._cache_lock:
+            value = self._cache.get(key)
+            if value is None:
+                value = self._cache[key] = build()
+            return value
+
+    def column(self, column: str) -> np.ndarray:
+        """Columna completa, de sólo lectura; sin copia si cabe en un bloque"""
+        def build():
+            blocks = self.blocks[column]
+            if not blocks:
+                values = _empty_column(column)
+            elif len(blocks) == 1:
+                values = blocks[0].view()
+            else:
+                values = np.concatenate(blocks)
+            if column == "address_code":
+                values = values.astype(_codes_dtype(self.address_count), copy=False)
+            values.flags.writeable = False
+            return values
+        return self._cached(("column", column), build)
+
+    def get(self, row: int, field: str):
+        if field == "resumen":
+            return self.resumen.get(row)
+        if field not in TEXT_COLUMNS and field not in ("address", "last_subsidy"):
+            raise ValueError(f'"Candidate" object has no field "{field}"')
+        column = "address_code" if field == "address" else field
+        value = self.blocks[column][row // self.block_rows][row % self.block_rows]
+        if field in TEXT_COLUMNS:
+            return value.decode("utf-8")
+        if field == "address":
+            return self.addresses[value]
+        return value.astype(object)  # datetime o None
+
+    def candidate(self, row: int) -> Candidate:
+        """Materializa la fila como Candidate (copia, sin validar de nuevo)"""
+        return Candidate.model_construct(
+            name=self.get(row, "name"),
+            identification=self.get(row, "identification"),
+            address=self.get(row, "address"),
+            phone=self.get(row, "phone"),
+            last_subsidy=self.get(row, "last_subsidy"),
+            wallet_address=self.get(row, "wallet_address"),
+            resumen=self.resumen.get(row)
+        )
+
+    def candidates(self, rows: np.ndarray) -> List[Candidate]:
+        """Materializa varias filas, decodificando cada columna de una vez"""
+        text = {column: [value.decode("utf-8") for value in self.column(column)[rows].tolist()] for column in TEXT_COLUMNS}
+        addresses = [self.addresses[code] for code in self.column("address_code")[rows].tolist()]
+        last_subsidy = self.column("last_subsidy")[rows].astype(object).tolist()
+        resumen = [self.resumen.get(row) for row in rows.tolist()] if len(self.resumen) else [None] * len(rows)
+        return [
+            Candidate.model_construct(
+                name=name,
+                identification=identification,
+                address=address,
+                phone=phone,
+                last_subsidy=subsidy,
+                wallet_address=wallet_address,
+                resumen=summary
+            )
+            for name, identification, address, phone, subsidy, wallet_address, summary in zip(
+                text["name"], text["identification"], addresses, text["phone"],
+                last_subsidy, text["wallet_address"], resumen
+            )
+        ]
+
+    def decoded(self, column: str) -> np.ndarray:
+        """Columna de texto decodificada a un array de objetos str"""
+        return np.char.decode(self.column(column), "utf-8").astype(object)
+
+    def resumen_array(self) -> np.ndarray:
+        values = np.full(self.size, None, dtype=object)
+        for row, text in self.resumen.items():
+            values[row] = text
+        return values
+
+    def subsidy_order(self) -> np.ndarray:
+        """Filas ordenadas por (last_subsidy, identification), nunca subsidiados primero"""
+        def build():
+            order = np.lexsort((self.column("identification"), self.column("last_subsidy").view(np.int64)))
+            order.flags.writeable = False
+            return order
+        return self._cached("subsidy_order", build)
+
+    def subsidy_position(self, when: datetime) -> int:
+        """Posición en subsidy_order() del primer subsidio en `when` o después"""
+        sorted_subsidies = self._cached(
+            "sorted_subsidies", lambda: self.column("last_subsidy")[self.subsidy_order()].view(np.int64)
+        )
+        return int(np.searchsorted(sorted_subsidies, np.datetime64(when, "us").view(np.int64), side="left"))
+
+    def frame(self) -> pd.DataFrame:
+        """
+        Registro completo como DataFrame, construido una vez por versión.
+        last_subsidy y address comparten memoria con las columnas, que no
+        cambian después de publicarse.
+        """
+        def build():
+            return pd.DataFrame({
+                "name": self.decoded("name"),
+                "identification": self.decoded("identification"),
+                "address": pd.Categorical.from_codes(
+                    self.column("address_code"),
+                    categories=pd.Index(self.addresses[:self.address_count], dtype=object)
+                ),
+                "phone": self.decoded("phone"),
+                "last_subsidy": self.column("last_subsidy"),
+                "wallet_address": self.decoded("wallet_address"),
+                "resumen": self.resumen_array(),
+            }, copy=False)
+        return self._cached("frame", build)
+
+    def nbytes(self) -> int:
+        """Memoria aproximada de las columnas (sin contar los resúmenes ni los índices)"""
+        arrays = sum(block.nbytes for blocks in self.blocks.values() for block in blocks)
+        return arrays + sum(len(a) + 49 for a in self.addresses[:self.address_count])
+
+
+class CandidateColumnsEditor:
+    """
+    Cambios sobre una versión de CandidateColumns; un solo escritor a la vez.
+    Cada bloque se copia la primera vez que el editor lo modifica.
+    """
+
+    def __init__(self, base: CandidateColumns):
+        self.block_rows = base.block_rows
+        self.size = base.size
+        self.blocks: Dict[str, List[np.ndarray]] = {column: list(blocks) for column, blocks in base.blocks.items()}
+        self.addresses = base.addresses
+        self._address_index = base._address_index
+        self.resumen: ChunkedMapEditor[int, str] = base.resumen.edit()
+        self.rows: ChunkedMapEditor[str, int] = base.rows.edit()
+        self.by_name: ChunkedMapEditor[str, Tuple[int, ...]] = base.by_name.edit()
+        self.by_phone: ChunkedMapEditor[str, Tuple[int, ...]] = base.by_phone.edit()
+        self.by_wallet: ChunkedMapEditor[str, Tuple[int, ...]] = base.by_wallet.edit()
+        self._owned: Set[Tuple[str, int]] = set()
+
+    def _own(self, column: str, block: int) -> np.ndarray:
+        if (column, block) not in self._owned:
+            self.blocks[column][block] = self.blocks[column][block].copy()
+            self._owned.add((column, block))
+        return self.blocks[column][block]
+
+    def _address_code(self, address: str) -> int:
+        code = self._address_index.get(address)
+        if code is None:
+            # Se añade antes de publicar: las versiones anteriores no la ven
+            code = len(self.addresses)
+            self.addresses.append(address)
+            self._address_index[address] = code
+        return code
+
+    def get(self, row: int, field: str):
+        if field == "resumen":
+            return self.resumen.get(row)
+        if field not in TEXT_COLUMNS and field not in ("address", "last_subsidy"):
+            raise ValueError(f'"Candidate" object has no field "{field}"')
+        column = "address_code" if field == "address" else field
+        value = self.blocks[column][row // self.block_rows][row % self.block_rows]
+        if field in TEXT_COLUMNS:
+            return value.decode("utf-8")
+        if field == "address":
+            return self.addresses[value]
+        return value.astype(object)
+
+    def _index_add(self, field: str, value: str, row: int):
+        index = getattr(self, INDEXED_FIELDS[field])
+        index[value] = index.get(value, ()) + (row,)
+
+    def _index_remove(self, field: str, value: str, row: int):
+        index = getattr(self, INDEXED_FIELDS[field])
+        rows = tuple(r for r in index.get(value, ()) if r != row)
+        if rows:
+            index[value] = rows
+        else:
+            index.pop(value)
+
+    def set(self, row: int, field: str, value):
+        if field == "resumen":
+            if value is None:
+                self.resumen.pop(row)
+            else:
+                self.resumen[row] = value
+            return
+        block, offset = divmod(row, self.block_rows)
+        if field in INDEXED_FIELDS:
+            self._index_remove(field, self.get(row, field), row)
+            self._index_add(field, value, row)
+        elif field == "identification":
+            previous = self.get(row, field)
+            if self.rows.get(previous) == row:
+                self.rows.pop(previous)
+            self.rows[value] = row
+        if field in TEXT_COLUMNS:
+            encoded = value.encode("utf-8")
+            values = self._own(field, block)
+            if len(encoded) > values.dtype.itemsize:
+                values = self.blocks[field][block] = values.astype(f"S{_width(len(encoded))}")
+            values[offset] = encoded
+        elif field == "address":
+            code = self._address_code(value)
+            values = self._own("address_code", block)
+            if code > np.iinfo(values.dtype).max:
+                values = self.blocks["address_code"][block] = values.astype(_codes_dtype(code + 1))
+            values[offset] = code
+        elif field == "last_subsidy":
+            self._own("last_subsidy", block)[offset] = np.datetime64(value, "us") if value else NAT
+        else:
+            raise ValueError(f'"Candidate" object has no field "{field}"')
+
+    def append(self, candidates: List[Candidate]) -> int:
+        """Añade filas al final y devuelve la primera fila nueva"""
+        start, count = self.size, len(candidates)
+        new: Dict[str, np.ndarray] = {}
+        for column in TEXT_COLUMNS:
+            encoded = [getattr(c, column).encode("utf-8") for c in candidates]
+            new[column] = np.array(encoded, dtype=f"S{_width(max(map(len, encoded), default=0))}")
+        codes = [self._address_code(c.address) for c in candidates]
+        new["address_code"] = np.array(codes, dtype=_codes_dtype(len(self.addresses)))
+        new["last_subsidy"] = np.array(
+            [np.datetime64(c.last_subsidy, "us") if c.last_subsidy else NAT for c in candidates],
+            dtype="datetime64[us]"
+        )
+        for column, values in new.items():
+            blocks, done = self.blocks[column], 0
+            while done < count:
+                block, offset = divmod(start + done, self.block_rows)
+                take = min(self.block_rows - offset, count - done)
+                chunk = values[done:done + take]
+                if offset == 0:
+                    blocks.append(chunk.copy())
+                else:
+                    # El último bloque estaba a medias: se sustituye por uno nuevo
+                    blocks[block] = np.concatenate([blocks[block], chunk])
+                self._owned.add((column, block))
+                done += take
+        for offset, candidate in enumerate(candidates):
+            self.rows[candidate.identification] = start + offset
+            for field in INDEXED_FIELDS:
+                self._index_add(field, getattr(candidate, field), start + offset)
+            if candidate.resumen is not None:
+                self.resumen[start + offset] = candidate.resumen
+        self.size += count
+        return start
+
+    def freeze(self, version: int, changes_version: int, candidates_version: int,
+               ranking_version: int) -> CandidateColumns:
+        for column, block in self._owned:
+            self.blocks[column][block].flags.writeable = False
+        self._owned = set()
+        return CandidateColumns(
+            version, changes_version, candidates_version, ranking_version, self.size, self.block_rows,
+            {column: tuple(blocks) for column, blocks in self.blocks.items()},
+            self.addresses, self._address_index, self.resumen.freeze(), self.rows.freeze(),
+            self.by_name.freeze(), self.by_phone.freeze(), self.by_wallet.freeze()
+        )
+
+
+class ColumnarDB(InMemoryDB):
+    """
+    Backend en memoria con el registro de candidatos en columnas.
+
+    Misma interfaz que InMemoryDB (de la que hereda usuarios, transacciones
+    y el protocolo de escritura), pero cada candidato ocupa menos de 1 KB,
+    índices incluidos, en lugar de los 2.5 KB de un objeto pydantic. Los
+    Candidate se materializan sólo al pedirlos y son copias: los cambios se
+    hacen con update_candidate.
+
+    Como en InMemoryDB, cada escritura publica una versión nueva al
+    terminar (un CandidateColumns) y los lectores usan la última publicada
+    sin tomar locks. candidates_frame() se construye una vez por versión y
+    comparte memoria con las columnas de fecha y dirección.
+    """
+
+    def __init__(self, candidates: Optional[Iterable[Candidate]] = None, block_rows: int = BLOCK_ROWS):
+        self.block_rows = block_rows
+        super().__init__(candidates)
+
+    def _empty_snapshot(self) -> CandidateColumns:
+        return CandidateColumns.empty(self.block_rows)
+
+    def _load(self, candidates: Iterable[Candidate]):
+        self._append_new(candidates)
+
+    def _append_new(self, candidates: Iterable[Candidate]) -> List[Candidate]:
+        """Añade las identificaciones que aún no están; devuelve las añadidas"""
+        editor = self._editor
+        new, seen = [], set()
+        for candidate in candidates:
+            if candidate.identification not in seen and candidate.identification not in editor.rows:
+                seen.add(candidate.identification)
+                new.append(candidate)
+        if new:
+            editor.append(new)
+        return new
+
+    def _changed(self, ranking_changed: bool = True):
+        self._candidates_version += 1
+        if ranking_changed:
+            self._ranking_version += 1
+
+    @staticmethod
+    def _first_indexed(snapshot: CandidateColumns, index: ChunkedMap, key: str) -> Optional[Candidate]:
+        """Si varios candidatos comparten la clave, el de menor identificación"""
+        rows = index.get(key)
+        if not rows:
+            return None
+        return snapshot.candidate(min(rows, key=lambda row: snapshot.get(row, "identification")))
+
+    def subsidy_order(self) -> np.ndarray:
+        """Filas ordenadas por (last_subsidy, identification), nunca subsidiados primero"""
+        return self._snapshot.subsidy_order()
+
+    # Candidate management
+    def get_candidate(self, identification: str) -> Optional[Candidate]:
+        snapshot = self._snapshot
+        row = snapshot.rows.get(identification)
+        return snapshot.candidate(row) if row is not None else None
+
+    def get_all_candidates(self) -> List[Candidate]:
+        snapshot = self._snapshot
+        return snapshot.candidates(np.arange(snapshot.size))
+
+    def get_candidate_by_name(self, name: str) -> Optional[Candidate]:
+        snapshot = self._snapshot
+        return self._first_indexed(snapshot, snapshot.by_name, name)
+
+    def get_candidate_by_phone(self, phone: str) -> Optional[Candidate]:
+        snapshot = self._snapshot
+        return self._first_indexed(snapshot, snapshot.by_phone, phone)
+
+    def get_candidate_by_wallet(self, wallet_address: str) -> Optional[Candidate]:
+        snapshot = self._snapshot
+        return self._first_indexed(snapshot, snapshot.by_wallet, wallet_address)
+
+    @staticmethod
+    def _eligible_rows(snapshot: CandidateColumns, days: Optional[int], now: Optional[datetime]) -> np.ndarray:
+        cutoff = policy_for(days).cutoff(now or datetime.now())
+        return snapshot.subsidy_order()[:snapshot.subsidy_position(cutoff)]
+
+    @staticmethod
+    def _newly_eligible_rows(snapshot: CandidateColumns, since: datetime, now: Optional[datetime],
+                             days: Optional[int]) -> np.ndarray:
+        start, end = policy_for(days).newly_eligible_range(since, now or datetime.now())
+        return snapshot.subsidy_order()[snapshot.subsidy_position(start):snapshot.subsidy_position(end)]
+
+    def eligible_rows(self, days: Optional[int] = None, now: Optional[datetime] = None) -> np.ndarray:
+        """
+        Filas de los candidatos elegibles, del subsidio más antiguo al más
+        reciente. Es una vista del orden cacheado: no copia ni crea objetos.
+        """
+        return self._eligible_rows(self._snapshot, days, now)
+
+    def newly_eligible_rows(self, since: datetime, now: Optional[datetime] = None,
+                            days: Optional[int] = None) -> np.ndarray:
+        """Filas de quienes pasaron a ser elegibles después de `since` y hasta `now`"""
+        return self._newly_eligible_rows(self._snapshot, since, now, days)
+
+    def get_eligible_candidates(self, days: Optional[int] = None, now: Optional[datetime] = None) -> List[Candidate]:
+        """
+        Devuelve los candidatos sin subsidio en los últimos `days` días
+        (por defecto la ventana de DEFAULT_POLICY), ordenados del subsidio
+        más antiguo al más reciente.
+        """
+        snapshot = self._snapshot
+        return snapshot.candidates(self._eligible_rows(snapshot, days, now))
+
+    def get_newly_eligible_candidates(self, since: datetime, now: Optional[datetime] = None,
+                                      days: Optional[int] = None) -> List[Candidate]:
+        """Candidatos que pasaron a ser elegibles después de `since` y hasta `now`"""
+        snapshot = self._snapshot
+        return snapshot.candidates(self._newly_eligible_rows(snapshot, since, now, days))
+
+    def get_oldest_subsidy_candidate(self) -> Optional[Candidate]:
+        """Candidato sin subsidio o con el subsidio más antiguo"""
+        snapshot = self._snapshot
+        if not snapshot.size:
+            return None
+        return snapshot.candidate(int(snapshot.subsidy_order()[0]))
+
+    def add_candidates(self, candidates: Iterable[Candidate]) -> int:
+        """Carga masiva; omite identificaciones ya existentes y devuelve cuántas añadió"""
+        with self._writing_candidates():
+            new = self._append_new(candidates)
+            if new:
+                self._changed()
+                self.changes.extend(CANDIDATE_ADDED, [c.identification for c in new], new)
+            return len(new)
+
+    def add_candidate(self, candidate: Candidate) -> bool:
+        return self.add_candidates([candidate]) == 1
+
+    def _apply_update(self, identification: str, candidate_data: dict) -> Optional[bool]:
+        """Escribe la fila en las columnas; las versiones las sube InMemoryDB._apply_updates"""
+        editor = self._editor
+        row = editor.rows.get(identification)
+        if row is None:
+            return None
+        ranking_changed = any(
+            key in RANKING_FIELDS and editor.get(row, key) != value
+            for key, value in candidate_data.items()
+        )
+        for key, value in candidate_data.items():
+            editor.set(row, key, value)
+        self.changes.append(CANDIDATE_UPDATED, identification, dict(candidate_data))
+        return ranking_changed
+
+    def candidates_frame(self) -> pd.DataFrame:
+        """Registro completo como DataFrame de sólo lectura, de la última versión publicada"""
+        return self._snapshot.frame()
@@ -0,0 +1,156 @@
+import asyncio
+import functools
+import logging
+import time
+from collections import deque
+from typing import Any, Callable, Deque, NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+# ElevenLabs invalida las URLs firmadas a los 15 minutos; se descartan antes
+SIGNED_URL_TTL_SECONDS = 600
+
+
+class WarmSession(NamedTuple):
+    signed_url: str
+    created_at: float
+
+
+@functools.lru_cache(maxsize=None)
+def warm_conversation_class() -> type:
+    """WarmConversation; el SDK de ElevenLabs se importa la primera vez que se pide"""
+    from elevenlabs.conversational_ai.conversation import Conversation
+
+    class WarmConversation(Conversation):
+        """
+        Conversation que arranca con una URL firmada ya obtenida, evitando la
+        petición HTTPS a ElevenLabs en el inicio de la llamada.
+        """
+
+        def __init__(self, *args, signed_url: Optional[str] = None, **kwargs):
+            super().__init__(*args, **kwargs)
+            self._warm_signed_url = signed_url
+
+        def _get_signed_url(self):
+            signed_url, self._warm_signed_url = self._warm_signed_url, None
+            return signed_url or super()._get_signed_url()
+
+    return WarmConversation
+
+
+class AgentSessionPool:
+    """
+    Mantiene `size` URLs firmadas del agente listas para prestar a las
+    llamadas entrantes.
+
+    Un task en el event loop repone el pool en segundo plano y descarta
+    las URLs que superan `ttl_seconds`. Si ElevenLabs falla, el pool se marca
+    como no sano, espera con backoff y lease() devuelve None para que la
+    llamada pida su propia URL como antes.
+
+    Con `requires_auth=False` (agente público) no hay URL que firmar y el
+    pool no hace nada.
+
+    `client_factory` devuelve el cliente de ElevenLabs (p. ej.
+    clients.elevenlabs_client); se llama al usarlo, no al crear el pool.
+    """
+
+    def __init__(self, client_factory: Callable[[], Any], agent_id: str, requires_auth: bool = True, size: int = 4,
+                 ttl_seconds: float = SIGNED_URL_TTL_SECONDS, refill_interval: float = 5.0):
+        self.client_factory = client_factory
+        self.agent_id = agent_id
+        self.requires_auth = requires_auth
+        self.size = size
+        self.ttl_seconds = ttl_seconds
+        self.refill_interval = refill_interval
+        self._sessions: Deque[WarmSession] = deque()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self.healthy = True
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+    @property
+    def client(self):
+        return self.client_factory()
+
+    def start(self):
+        if self._task is None and self.requires_auth and self.size > 0:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._sessions.clear()
+
+    def lease(self) -> Optional[str]:
+        """Entrega una URL firmada vigente o None si no hay ninguna lista"""
+        self._evict_expired()
+        if self._sessions:
+            self.hits += 1
+            session = self._sessions.popleft()
+        else:
+            self.misses += 1
+            session = None
+        if self._wakeup is not None and self.healthy:
+            # Reponer ya; si ElevenLabs está fallando se respeta el backoff
+            self._wakeup.set()
+        return session.signed_url if session else None
+
+    def conversation(self, **kwargs):
+        """Crea la conversación del agente (WarmConversation) con una sesión del pool si la hay"""
+        return warm_conversation_class()(
+            self.client,
+            self.agent_id,
+            requires_auth=self.requires_auth,
+            signed_url=self.lease() if self.requires_auth else None,
+            **kwargs
+        )
+
+    def metrics(self) -> dict:
+        return {
+            "ready": len(self._sessions),
+            "healthy": self.healthy,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evicted": self.evicted,
+        }
+
+    def _evict_expired(self):
+        cutoff = time.monotonic() - self.ttl_seconds
+        while self._sessions and self._sessions[0].created_at < cutoff:
+            self._sessions.popleft()
+            self.evicted += 1
+
+    def _fetch(self) -> WarmSession:
+        response = self.client.conversational_ai.get_signed_url(agent_id=self.agent_id)
+        return WarmSession(response.signed_url, time.monotonic())
+
+    async def _run(self):
+        failures = 0
+        while True:
+            self._evict_expired()
+            try:
+                while len(self._sessions) < self.size:
+                    self._sessions.append(await asyncio.to_thread(self._fetch))
+                failures = 0
+                self.healthy = True
+                delay = self.refill_interval
+            except Exception as e:
+                failures += 1
+                self.healthy = False
+                delay = min(self.refill_interval * 2 ** failures, 300)
+                logger.warning("Could not pre-fetch ElevenLabs signed URL (%s), retrying in %.0fs", e, delay)
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
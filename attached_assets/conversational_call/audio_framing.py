@@ -0,0 +1,146 @@
+from dataclasses import asdict, dataclass
+from typing import Dict, List, Optional
+
+# Twilio transmite μ-law a 8 kHz: 160 bytes equivalen a 20 ms de audio
+FRAME_BYTES = 160
+# Byte de silencio en μ-law, usado para completar el último frame
+ULAW_SILENCE = b"\xff"
+
+
+@dataclass
+class AudioStreamStats:
+    """
+    Métricas del flujo de audio de una llamada
+    """
+    outbound_chunks: int = 0
+    outbound_packets: int = 0
+    outbound_bytes: int = 0
+    output_queue_depth: int = 0
+    max_output_queue_depth: int = 0
+    underruns: int = 0
+    inbound_frames: int = 0
+    inbound_deliveries: int = 0
+    jitter_depth: int = 0
+    max_jitter_depth: int = 0
+    late_frames: int = 0
+    lost_frames: int = 0
+
+    def as_dict(self) -> dict:
+        return asdict(self)
+
+
+class OutboundFramer:
+    """
+    Re-empaqueta el audio de ElevenLabs en frames fijos de `frame_bytes`
+    y agrupa hasta `packet_frames` frames por mensaje a Twilio.
+    """
+
+    def __init__(self, frame_bytes: int = FRAME_BYTES, packet_frames: int = 5):
+        self.frame_bytes = frame_bytes
+        self.packet_bytes = frame_bytes * packet_frames
+        self._pending = bytearray()
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def push(self, audio: bytes) -> List[bytes]:
+        """Añade audio y devuelve los paquetes completos que ya se pueden enviar"""
+        self._pending += audio
+        packets = []
+        while len(self._pending) >= self.packet_bytes:
+            packets.append(bytes(self._pending[:self.packet_bytes]))
+            del self._pending[:self.packet_bytes]
+        return packets
+
+    def drain(self) -> Optional[bytes]:
+        """
+        Devuelve los frames completos pendientes; si sólo queda un frame
+        parcial lo completa con silencio. None si no hay nada pendiente.
+        """
+        if not self._pending:
+            return None
+        whole = len(self._pending) - len(self._pending) % self.frame_bytes
+        if whole:
+            packet = bytes(self._pending[:whole])
+            del self._pending[:whole]
+            return packet
+        packet = bytes(self._pending) + ULAW_SILENCE * (self.frame_bytes - len(self._pending))
+        self._pending.clear()
+        return packet
+
+    def clear(self):
+        self._pending.clear()
+
+
+class JitterBuffer:
+    """
+    Buffer de entrada ordenado por sequenceNumber de Twilio.
+
+    Retiene frames hasta tener `target_depth` consecutivos y entonces los
+    entrega juntos, en orden. Si falta un frame y el buffer supera
+    `max_depth`, se da por perdido y se continúa con el siguiente.
+    """
+
+    def __init__(self, stats: AudioStreamStats, target_depth: int = 3, max_depth: int = 10):
+        self.stats = stats
+        self.target_depth = target_depth
+        self.max_depth = max_depth
+        self._frames: Dict[int, bytes] = {}
+        self._next_seq: Optional[int] = None
+        self._auto_seq = 0
+
+    def push(self, payload: bytes, sequence_number: Optional[int] = None) -> Optional[bytes]:
+        """Añade un frame; devuelve el audio listo para entregar o None"""
+        if sequence_number is None:
+            sequence_number = self._auto_seq
+        self._auto_seq = sequence_number + 1
+        self.stats.inbound_frames += 1
+
+        if self._next_seq is None:
+            self._next_seq = sequence_number
+        if sequence_number < self._next_seq:
+            self.stats.late_frames += 1
+            return None
+
+        self._frames[sequence_number] = payload
+        self._update_depth()
+
+        if len(self._frames) > self.max_depth and self._next_seq not in self._frames:
+            skipped_to = min(self._frames)
+            self.stats.lost_frames += skipped_to - self._next_seq
+            self._next_seq = skipped_to
+
+        if self._contiguous() >= self.target_depth:
+            return self._release()
+        return None
+
+    def drain(self) -> Optional[bytes]:
+        """Entrega todo lo retenido, en orden, al terminar el stream"""
+        if not self._frames:
+            return None
+        audio = b"".join(self._frames[seq] for seq in sorted(self._frames))
+        self._next_seq = max(self._frames) + 1
+        self._frames.clear()
+        self._update_depth()
+        self.stats.inbound_deliveries += 1
+        return audio
+
+    def _contiguous(self) -> int:
+        count = 0
+        while self._next_seq + count in self._frames:
+            count += 1
+        return count
+
+    def _release(self) -> bytes:
+        chunks = []
+        while self._next_seq in self._frames:
+            chunks.append(self._frames.pop(self._next_seq))
+            self._next_seq += 1
+        self._update_depth()
+        self.stats.inbound_deliveries += 1
+        return b"".join(chunks)
+
+    def _update_depth(self):
+        self.stats.jitter_depth = len(self._frames)
+        self.stats.max_jitter_depth = max(self.stats.max_jitter_depth, self.stats.jitter_depth)
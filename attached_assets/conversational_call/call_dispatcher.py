@@ -0,0 +1,297 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import logging
+import os
+import socket
+import sqlite3
+import threading
+from typing import List, Optional, Set
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Estados del trabajo; el estado de la llamada en Twilio va aparte, en call_status
+QUEUED = "queued"
+DISPATCHING = "dispatching"
+DIALED = "dialed"
+FAILED = "failed"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS call_jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    to_number TEXT NOT NULL,
+    message TEXT NOT NULL,
+    candidate_id TEXT,
+    status TEXT NOT NULL,
+    call_sid TEXT,
+    call_status TEXT,
+    error TEXT,
+    owner TEXT,
+    lease_until TEXT,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_call_jobs_status ON call_jobs(status, id);
+CREATE INDEX IF NOT EXISTS idx_call_jobs_call_sid ON call_jobs(call_sid);
+"""
+
+JOB_FIELDS = (
+    "id, to_number, message, candidate_id, status, call_sid, call_status, error, owner, lease_until, "
+    "created_at, updated_at"
+)
+
+# Tiempo que un despachador se reserva un trabajo reclamado; crear la llamada en Twilio tarda segundos
+DEFAULT_LEASE_SECONDS = 300
+
+
+class CallJobStore:
+    """
+    Cola persistente de llamadas salientes en SQLite.
+
+    La app de Streamlit encola y el servidor de llamadas consume; ambos
+    procesos comparten el archivo CALL_QUEUE_PATH, y los trabajos
+    sobreviven a reinicios de cualquiera de los dos.
+
+    Un trabajo reclamado guarda quién lo reclamó (`owner`) y hasta cuándo
+    (`lease_until`). Así, al arrancar, un servidor sólo recupera los
+    trabajos cuyo dueño dejó vencer la reserva, y no los que otro proceso
+    está llamando en ese momento.
+    """
+
+    def __init__(self, path: str = "call_jobs.db"):
+        self.path = path
+        self._local = threading.local()
+        conn = self._connection()
+        conn.executescript(SCHEMA)
+        self._migrate(conn)
+
+    @staticmethod
+    def _migrate(conn: sqlite3.Connection):
+        """Añade columnas nuevas a colas creadas con versiones anteriores"""
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(call_jobs)")}
+        for column in ("owner", "lease_until"):
+            if column not in columns:
+                conn.execute(f"ALTER TABLE call_jobs ADD COLUMN {column} TEXT")
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30.0, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def enqueue(self, to_number: str, message: str, candidate_id: Optional[str] = None) -> int:
+        now = datetime.now().isoformat()
+        cursor = self._connection().execute(
+            "INSERT INTO call_jobs (to_number, message, candidate_id, status, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (to_number, message, candidate_id, QUEUED, now, now)
+        )
+        return cursor.lastrowid
+
+    def claim(self, limit: int, owner: str, lease_seconds: float = DEFAULT_LEASE_SECONDS) -> List[sqlite3.Row]:
+        """
+        Marca como "dispatching" hasta `limit` trabajos en cola y los devuelve.
+
+        Args:
+            limit (int): Máximo de trabajos a reclamar.
+            owner (str): Identificador del despachador que los reclama.
+            lease_seconds (float): Duración de la reserva.
+        """
+        now = datetime.now()
+        lease_until = (now + timedelta(seconds=lease_seconds)).isoformat()
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            jobs = conn.execute(
+                f"SELECT {JOB_FIELDS} FROM call_jobs WHERE status = ? ORDER BY id LIMIT ?",
+                (QUEUED, limit)
+            ).fetchall()
+            conn.executemany(
+                "UPDATE call_jobs SET status = ?, owner = ?, lease_until = ?, updated_at = ? WHERE id = ?",
+                [(DISPATCHING, owner, lease_until, now.isoformat(), job["id"]) for job in jobs]
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return jobs
+
+    def requeue_expired(self) -> int:
+        """
+        Devuelve a la cola los trabajos reclamados cuya reserva venció (su
+        despachador se detuvo a medias). Los reclamados sin reserva vienen
+        de versiones anteriores y también se devuelven.
+        """
+        now = datetime.now().isoformat()
+        cursor = self._connection().execute(
+            "UPDATE call_jobs SET status = ?, owner = NULL, lease_until = NULL, updated_at = ? "
+            "WHERE status = ? AND (lease_until IS NULL OR lease_until < ?)",
+            (QUEUED, now, DISPATCHING, now)
+        )
+        return cursor.rowcount
+
+    def mark_dialed(self, job_id: int, call_sid: str, call_status: str):
+        self._connection().execute(
+            "UPDATE call_jobs SET status = ?, call_sid = ?, call_status = ?, owner = NULL, lease_until = NULL, "
+            "updated_at = ? WHERE id = ?",
+            (DIALED, call_sid, call_status, datetime.now().isoformat(), job_id)
+        )
+
+    def mark_failed(self, job_id: int, error: str):
+        self._connection().execute(
+            "UPDATE call_jobs SET status = ?, error = ?, owner = NULL, lease_until = NULL, updated_at = ? "
+            "WHERE id = ?",
+            (FAILED, error, datetime.now().isoformat(), job_id)
+        )
+
+    def update_status_by_sid(self, call_sid: str, call_status: str) -> bool:
+        """Registra el estado informado por Twilio (ringing, completed, ...)"""
+        cursor = self._connection().execute(
+            "UPDATE call_jobs SET call_status = ?, updated_at = ? WHERE call_sid = ?",
+            (call_status, datetime.now().isoformat(), call_sid)
+        )
+        return bool(cursor.rowcount)
+
+    def candidate_for_call(self, call_sid: Optional[str]) -> Optional[str]:
+        """Candidato al que se llamó con `call_sid`, si la llamada salió de esta cola"""
+        if not call_sid:
+            return None
+        row = self._connection().execute(
+            "SELECT candidate_id FROM call_jobs WHERE call_sid = ?", (call_sid,)
+        ).fetchone()
+        return row["candidate_id"] if row else None
+
+    def get(self, job_id: int) -> Optional[sqlite3.Row]:
+        return self._connection().execute(
+            f"SELECT {JOB_FIELDS} FROM call_jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+
+
+_store: Optional[CallJobStore] = None
+_store_lock = threading.Lock()
+
+
+def get_call_store() -> CallJobStore:
+    """Cola compartida del proceso, en CALL_QUEUE_PATH"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = CallJobStore(os.getenv("CALL_QUEUE_PATH", "call_jobs.db"))
+        return _store
+
+
+def enqueue_call(to_number: str, message: str, candidate_id: Optional[str] = None) -> int:
+    """Encola una llamada de notificación y vuelve de inmediato con el id del trabajo"""
+    return get_call_store().enqueue(to_number, message, candidate_id)
+
+
+class OutboundCallDispatcher:
+    """
+    Servicio de larga duración que realiza las llamadas encoladas.
+
+    Corre como tarea en el event loop del servidor FastAPI, reutiliza un
+    único cliente de Twilio y limita las llamadas simultáneas a
+    `concurrency`. El estado de cada llamada se actualiza desde la ruta
+    /status-callback.
+
+    Args:
+        lease_seconds (float): Reserva de cada trabajo reclamado; al
+            arrancar, otros despachadores sólo recuperan los vencidos.
+    """
+
+    def __init__(
+        self,
+        twilio_client,
+        from_number: str,
+        public_url: str,
+        store: Optional[CallJobStore] = None,
+        concurrency: int = 50,
+        poll_interval: float = 0.5,
+        lease_seconds: float = DEFAULT_LEASE_SECONDS
+    ):
+        self.twilio_client = twilio_client
+        self.from_number = from_number
+        self.public_url = public_url.rstrip("/")
+        self.store = store or get_call_store()
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        # Único por instancia: distingue a los servidores y workers que comparten la cola
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="twilio-call")
+        self._active = 0
+        self._task: Optional[asyncio.Task] = None
+        # Referencias a las llamadas en curso: el loop sólo guarda referencias débiles a sus tareas
+        self._dispatches: Set[asyncio.Task] = set()
+        self._stopping = asyncio.Event()
+
+    def start(self):
+        requeued = self.store.requeue_expired()
+        if requeued:
+            logger.info("Requeued %d call jobs with expired leases", requeued)
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """Deja de reclamar trabajos, espera a las llamadas en curso y cierra el executor"""
+        self._stopping.set()
+        if self._task:
+            await self._task
+        # Cada _dispatch termina de marcar su trabajo antes de que el executor se cierre;
+        # si no, el trabajo quedaría reclamado y se volvería a llamar al reiniciar
+        await asyncio.gather(*self._dispatches, return_exceptions=True)
+        await asyncio.to_thread(self._executor.shutdown, wait=True)
+
+    async def update_status(self, call_sid: str, call_status: str) -> bool:
+        """update_status_by_sid en el executor del despachador, fuera del event loop"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self.store.update_status_by_sid, call_sid, call_status)
+
+    async def candidate_for_call(self, call_sid: Optional[str]) -> Optional[str]:
+        """candidate_for_call de la cola en el executor del despachador, fuera del event loop"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self.store.candidate_for_call, call_sid)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while not self._stopping.is_set():
+            # Sólo se reclaman tantos trabajos como huecos libres haya
+            free_slots = self.concurrency - self._active
+            jobs = await loop.run_in_executor(
+                self._executor, self.store.claim, free_slots, self.owner, self.lease_seconds
+            ) if free_slots else []
+            for job in jobs:
+                self._active += 1
+                task = loop.create_task(self._dispatch(job))
+                self._dispatches.add(task)
+                task.add_done_callback(self._dispatches.discard)
+            if not jobs:
+                try:
+                    await asyncio.wait_for(self._stopping.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def _dispatch(self, job):
+        loop = asyncio.get_running_loop()
+        try:
+            call = await loop.run_in_executor(self._executor, self._create_call, job)
+            await loop.run_in_executor(self._executor, self.store.mark_dialed, job["id"], call.sid, call.status)
+            logger.info("Call job %s dialed with SID %s", job["id"], call.sid)
+        except Exception as e:
+            logger.error("Call job %s failed: %s", job["id"], e)
+            await loop.run_in_executor(self._executor, self.store.mark_failed, job["id"], str(e))
+        finally:
+            self._active -= 1
+
+    def _create_call(self, job):
+        return self.twilio_client.calls.create(
+            to=job["to_number"],
+            from_=self.from_number,
+            url=f"{self.public_url}/twilio/inbound_call?job_id={job['id']}",
+            status_callback=f"{self.public_url}/status-callback",
+            status_callback_event=['initiated', 'ringing', 'answered', 'completed'],
+        )
@@ -0,0 +1,212 @@
+"""
+Histogramas por llamada del camino caliente del servidor de llamadas.
+
+Cada llamada tiene su CallMetrics; observar un valor es un bisect sobre
+límites fijos y dos sumas, así que puede quedarse activo en producción.
+CallMetricsRegistry publica todo en formato de texto de Prometheus con la
+etiqueta call_sid: las llamadas en curso y las últimas `retained`
+terminadas tienen su propia serie, las más antiguas se acumulan en
+call_sid="other" para que los contadores nunca bajen y la cardinalidad
+quede acotada.
+
+Además publica los contadores del flujo de audio de cada llamada
+(AudioStreamStats: jitter buffer, underruns, framing): los contadores como
+counter por call_sid y las profundidades actuales como gauge, éstas sólo
+mientras la llamada sigue en curso.
+"""
+from bisect import bisect_left
+from collections import OrderedDict
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+INBOUND_FRAME = "call_inbound_frame_seconds"
+OUTPUT_QUEUE_DEPTH = "call_output_queue_depth"
+FIRST_AUDIO = "call_first_audio_seconds"
+WS_SEND = "call_ws_send_seconds"
+SUMMARY = "call_summary_seconds"
+
+# nombre -> (ayuda, límites superiores de los buckets)
+METRICS: Dict[str, Tuple[str, Tuple[float, ...]]] = {
+    INBOUND_FRAME: (
+        "Time to handle one inbound media frame (jitter buffer and agent callback)",
+        (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01),
+    ),
+    OUTPUT_QUEUE_DEPTH: (
+        "Audio chunks waiting in the output queue each time the pump drains it",
+        (1, 2, 4, 8, 16, 32, 64, 128),
+    ),
+    FIRST_AUDIO: (
+        "Time from the end of the user's turn to the first agent audio sent to Twilio",
+        (0.1, 0.25, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 5.0, 10.0),
+    ),
+    WS_SEND: (
+        "Time to send one message on the Twilio websocket",
+        (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.05, 0.25),
+    ),
+    SUMMARY: (
+        "Time to generate or condense the call summary",
+        (0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 20.0, 60.0),
+    ),
+}
+
+# Campos de AudioStreamStats publicados como counter (acumulados) o gauge (estado actual)
+STREAM_COUNTERS: Dict[str, str] = {
+    "outbound_chunks": "Agent audio chunks received for the call",
+    "outbound_packets": "Media messages sent to Twilio",
+    "outbound_bytes": "Audio bytes sent to Twilio",
+    "underruns": "Times the output pump padded a partial frame waiting for agent audio",
+    "inbound_frames": "Media frames received from Twilio",
+    "inbound_deliveries": "Audio blocks delivered by the jitter buffer to the agent",
+    "late_frames": "Inbound frames dropped because they arrived after their turn",
+    "lost_frames": "Inbound frames skipped as lost by the jitter buffer",
+}
+STREAM_GAUGES: Dict[str, str] = {
+    "output_queue_depth": "Agent audio chunks waiting in the output queue",
+    "max_output_queue_depth": "Largest output queue drain seen in the call",
+    "jitter_depth": "Frames currently held by the jitter buffer",
+    "max_jitter_depth": "Largest jitter buffer depth seen in the call",
+}
+
+
+class Histogram:
+    """Buckets fijos; counts[i] cuenta los valores <= bounds[i] y > bounds[i-1]"""
+
+    __slots__ = ("bounds", "counts", "sum")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    def merge(self, other: "Histogram"):
+        for i, count in enumerate(other.counts):
+            self.counts[i] += count
+        self.sum += other.sum
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts)
+
+
+class CallMetrics:
+    """Histogramas de una llamada; call_sid se conoce con el evento "start" de Twilio"""
+
+    def __init__(self, call_sid: Optional[str] = None):
+        self.call_sid = call_sid
+        self.histograms = {name: Histogram(bounds) for name, (_, bounds) in METRICS.items()}
+        # Lee AudioStreamStats de la llamada en curso (TwilioAudioInterface.metrics)
+        self.stream_source: Optional[Callable[[], dict]] = None
+        self.stream: Dict[str, int] = {}
+
+    def observe(self, name: str, value: float):
+        self.histograms[name].observe(value)
+
+    def stream_stats(self) -> Dict[str, int]:
+        if self.stream_source is not None:
+            try:
+                return self.stream_source()
+            except Exception as e:
+                print(f"Error reading audio stream stats: {str(e)}")
+        return self.stream
+
+    def freeze_stream(self):
+        """Guarda los últimos valores del flujo y suelta la interfaz de audio"""
+        self.stream = self.stream_stats()
+        self.stream_source = None
+
+
+def _label(call_sid: str) -> str:
+    return call_sid.replace("\\", "\\\\").replace('"', '\\"')
+
+
+def _render_histogram(lines: List[str], name: str, call_sid: str, histogram: Histogram):
+    label = _label(call_sid)
+    cumulative = 0
+    for bound, count in zip(histogram.bounds, histogram.counts):
+        cumulative += count
+        lines.append(f'{name}_bucket{{call_sid="{label}",le="{bound}"}} {cumulative}')
+    cumulative += histogram.counts[-1]
+    lines.append(f'{name}_bucket{{call_sid="{label}",le="+Inf"}} {cumulative}')
+    lines.append(f'{name}_sum{{call_sid="{label}"}} {histogram.sum}')
+    lines.append(f'{name}_count{{call_sid="{label}"}} {cumulative}')
+
+
+class CallMetricsRegistry:
+    """
+    Args:
+        retained (int): Llamadas terminadas que conservan su propia serie.
+    """
+
+    def __init__(self, retained: int = 50):
+        self.retained = retained
+        self._lock = threading.Lock()
+        self._active: Dict[int, CallMetrics] = {}
+        self._ended: "OrderedDict[int, CallMetrics]" = OrderedDict()
+        self._other = CallMetrics("other")
+
+    def call(self) -> CallMetrics:
+        """Métricas de una llamada nueva, publicadas desde ya"""
+        metrics = CallMetrics()
+        with self._lock:
+            self._active[id(metrics)] = metrics
+        return metrics
+
+    def end(self, metrics: CallMetrics):
+        """
+        La llamada terminó. Sus métricas se siguen publicando (el resumen
+        llega después) hasta que salen de las `retained` más recientes.
+        """
+        with self._lock:
+            if self._active.pop(id(metrics), None) is None:
+                return
+            metrics.freeze_stream()
+            self._ended[id(metrics)] = metrics
+            while len(self._ended) > self.retained:
+                _, old = self._ended.popitem(last=False)
+                for name, histogram in old.histograms.items():
+                    self._other.histograms[name].merge(histogram)
+                for name in STREAM_COUNTERS:
+                    self._other.stream[name] = self._other.stream.get(name, 0) + old.stream.get(name, 0)
+
+    @property
+    def active_calls(self) -> int:
+        return len(self._active)
+
+    def _series(self) -> Iterable[CallMetrics]:
+        with self._lock:
+            return [*self._active.values(), *self._ended.values(), self._other]
+
+    def _active_series(self) -> Iterable[CallMetrics]:
+        with self._lock:
+            return list(self._active.values())
+
+    def render(self, gauges: Optional[Dict[str, float]] = None, counters: Optional[Dict[str, float]] = None) -> str:
+        """Texto de exposición de Prometheus (versión 0.0.4) con métricas extra del proceso"""
+        series = self._series()
+        lines: List[str] = []
+        for name, (help_text, _) in METRICS.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} histogram")
+            for metrics in series:
+                # Hasta el evento "start" la llamada no tiene etiqueta
+                if metrics.call_sid:
+                    _render_histogram(lines, name, metrics.call_sid, metrics.histograms[name])
+        streams = [(metrics.call_sid, metrics.stream_stats()) for metrics in series if metrics.call_sid]
+        active = [(metrics.call_sid, metrics.stream_stats()) for metrics in self._active_series() if metrics.call_sid]
+        for fields, kind, suffix, values in ((STREAM_COUNTERS, "counter", "_total", streams),
+                                             (STREAM_GAUGES, "gauge", "", active)):
+            for field, help_text in fields.items():
+                name = f"call_stream_{field}{suffix}"
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for call_sid, stats in values:
+                    lines.append(f'{name}{{call_sid="{_label(call_sid)}"}} {stats.get(field, 0)}')
+        for kind, values in (("gauge", {"calls_active": self.active_calls, **(gauges or {})}), ("counter", counters or {})):
+            for name, value in values.items():
+                lines.append(f"# TYPE {name} {kind}")
+                lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
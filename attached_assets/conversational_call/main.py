@@ -1,43 +1,155 @@
+"""
+Servidor de llamadas: media streams de Twilio con el agente de ElevenLabs.
+
+create_app() construye la aplicación y sus servicios. Importar este módulo
+no crea clientes, no abre la base de datos y no hace peticiones. ElevenLabs,
+OpenAI y el audio local se importan la primera vez que se usan; al arrancar
+se precargan en un hilo para que la primera llamada no pague la importación.
+
+    python -m conversational_call.main [--call +1234567890]
+    uvicorn --factory conversational_call.main:create_app
+"""
+import argparse
+import asyncio
+import base64
+import importlib
 import json
-import traceback
+import logging
 import os
+import time
+import traceback
+from typing import Optional
 from dotenv import load_dotenv
-from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi import APIRouter, FastAPI, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse, StreamingResponse
 from twilio.twiml.voice_response import VoiceResponse, Connect
-from elevenlabs import ElevenLabs
-from elevenlabs.conversational_ai.conversation import Conversation
-from elevenlabs.conversational_ai.default_audio_interface import DefaultAudioInterface
-from conversational_call.twilio_audio_interface import TwilioAudioInterface
-from twilio.rest import Client
-import base64
-import asyncio
-import websockets
-import sys  # Asegúrate de importar sys para manejar argumentos
-import openai  # Importar la biblioteca de OpenAI
-from datetime import datetime
-import logging
-from database import db_manager  # Importar usando la ruta absoluta
-# Load environment variables
-load_dotenv()
+from conversational_call.call_dispatcher import OutboundCallDispatcher, enqueue_call
+from conversational_call.summarizer import RollingSummarizer, SummaryWorker
+from conversational_call.transcript_hub import TranscriptHub
+from conversational_call.agent_sessions import AgentSessionPool
+from conversational_call.call_metrics import CallMetricsRegistry
+from tts_cache import get_tts_cache
+from clients import aclose_clients, async_openai_client, close_clients, elevenlabs_client, twilio_client
+
+logger = logging.getLogger(__name__)
+
+# Módulos que se importan en segundo plano al arrancar
+HEAVY_MODULES = (
+    "conversational_call.twilio_audio_interface",
+    "elevenlabs.conversational_ai.conversation",
+    "openai",
+)
 
-# Configuration
-PORT = int(os.getenv('PORT', 5050))
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")  # Asegúrate de tener la API key de OpenAI
+router = APIRouter()
 
-# Initialize FastAPI app
-app = FastAPI()
 
-# Initialize ElevenLabs client
-eleven_labs_client = ElevenLabs(api_key=os.getenv("ELEVENLABS_API_KEY"))
-ELEVEN_LABS_AGENT_ID = os.getenv("AGENT_ID")
+class CallServices:
+    """
+    Clientes, pools y trabajadores en segundo plano de una aplicación.
+
+    Args:
+        db: Base de datos; por defecto la de DB_BACKEND.
+        twilio: Cliente REST de Twilio; por defecto el compartido.
+        agent_sessions: Pool de sesiones del agente; por defecto AgentSessionPool.
+    """
+
+    def __init__(self, db=None, twilio=None, agent_sessions=None):
+        if db is None:
+            from database import init_db
+            db = init_db()
+        self.db = db
+        self.notification_voice = os.getenv("NOTIFICATION_VOICE", "en")  # Idioma de gTTS de las notificaciones
+        self.agent_id = os.getenv("AGENT_ID")
+        # Cliente REST compartido con pool de conexiones keep-alive
+        self.twilio = twilio or twilio_client()
+
+        # URLs firmadas del agente pre-obtenidas para no pedirlas al inicio de cada llamada
+        self.agent_sessions = agent_sessions or AgentSessionPool(
+            elevenlabs_client,
+            self.agent_id,
+            requires_auth=bool(os.getenv("ELEVENLABS_API_KEY")),
+            size=int(os.getenv("AGENT_WARM_SESSIONS", 4))
+        )
+
+        # Despachador de llamadas salientes (reutiliza el mismo cliente de Twilio)
+        self.call_dispatcher = OutboundCallDispatcher(
+            self.twilio,
+            from_number=os.getenv("TWILIO_FROM_NUMBER"),
+            public_url=os.getenv("PUBLIC_URL", "https://e7af-138-84-41-184.ngrok-free.app"),
+            concurrency=int(os.getenv("CALL_CONCURRENCY", 50)),
+            lease_seconds=float(os.getenv("CALL_LEASE_SECONDS", 300))
+        )
+
+        # Resúmenes de llamadas en segundo plano (no bloquean el event loop)
+        self.summary_worker = SummaryWorker(
+            db,
+            async_openai_client,
+            concurrency=int(os.getenv("SUMMARY_CONCURRENCY", 4))
+        )
 
-# Inicializar el cliente de Twilio
-account_sid = os.getenv("TWILIO_ACCOUNT_SID")
-auth_token = os.getenv("TWILIO_AUTH_TOKEN")
-client = Client(account_sid, auth_token)
+        # Difusión de transcripciones en vivo a los visores del panel
+        self.transcript_hub = TranscriptHub(queue_size=int(os.getenv("TRANSCRIPT_QUEUE_SIZE", 100)))
 
-@app.get("/")
+        # Histogramas por llamada publicados en /metrics
+        self.call_metrics = CallMetricsRegistry(retained=int(os.getenv("CALL_METRICS_RETAINED", 50)))
+
+    async def start(self):
+        self.call_dispatcher.start()
+        self.summary_worker.start()
+        self.agent_sessions.start()
+
+    async def stop(self):
+        await self.call_dispatcher.stop()
+        await self.summary_worker.stop()
+        await self.agent_sessions.stop()
+        await aclose_clients()
+        close_clients()
+
+
+def preload_heavy_modules() -> float:
+    """Importa HEAVY_MODULES; devuelve los segundos que tardó"""
+    started = time.perf_counter()
+    for name in HEAVY_MODULES:
+        try:
+            importlib.import_module(name)
+        except ImportError as e:
+            logger.warning("Could not preload %s: %s", name, e)
+    return time.perf_counter() - started
+
+
+def create_app(services: Optional[CallServices] = None) -> FastAPI:
+    """
+    Crea la aplicación del servidor de llamadas.
+
+    Args:
+        services (CallServices): Servicios a usar; por defecto se crean a
+            partir de las variables de entorno.
+
+    Returns:
+        FastAPI: La aplicación, lista para uvicorn.
+    """
+    load_dotenv()
+    app = FastAPI()
+    app.state.services = services or CallServices()
+    app.include_router(router)
+
+    @app.on_event("startup")
+    async def start_background_workers():
+        await app.state.services.start()
+        loop = asyncio.get_running_loop()
+        preload = loop.run_in_executor(None, preload_heavy_modules)
+        preload.add_done_callback(
+            lambda future: logger.info("Heavy modules preloaded in %.0f ms", 1000 * future.result())
+        )
+
+    @app.on_event("shutdown")
+    async def stop_background_workers():
+        await app.state.services.stop()
+
+    return app
+
+
+@router.get("/")
 async def get():
     """Render the transcription interface"""
     return HTMLResponse("""
@@ -66,15 +178,17 @@ async def get():
                 <div id="messages"></div>
             </div>
             <script>
-                const ws = new WebSocket(`ws://${window.location.host}/media-stream-eleven`);
+                // ?call_sid=CA1,CA2 filtra llamadas; sin parámetro se ven todas
+                const scheme = window.location.protocol === 'https:' ? 'wss' : 'ws';
+                const ws = new WebSocket(`${scheme}://${window.location.host}/transcripts${window.location.search}`);
                 const messagesDiv = document.getElementById('messages');
 
-                function addMessage(text, isAgent) {
+                function addMessage(text, isAgent, callSid) {
                     const messageElement = document.createElement('p');
                     const timestamp = new Date().toLocaleTimeString();
                     messageElement.className = isAgent ? 'agent-message' : 'user-message';
                     messageElement.innerHTML = `
-                        <span class="timestamp">[${timestamp}]</span> 
+                        <span class="timestamp">[${timestamp}]${callSid ? ' ' + callSid : ''}</span> 
                         <strong>${isAgent ? 'Agent' : 'User'}:</strong> ${text}
                     `;
                     messagesDiv.appendChild(messageElement);
@@ -84,7 +198,9 @@ async def get():
                 ws.onmessage = function(event) {
                     const data = JSON.parse(event.data);
                     if (data.type === 'transcript') {
-                        addMessage(data.text, data.isAgent);
+                        addMessage(data.text, data.isAgent, data.callSid);
+                    } else if (data.type === 'call_ended') {
+                        addMessage('Call ended', true, data.callSid);
                     }
                 };
 
@@ -93,31 +209,33 @@ async def get():
                 };
 
                 ws.onclose = function() {
-                    addMessage('Call ended', true);
+                    addMessage('Disconnected', true);
                 };
             </script>
         </body>
     </html>
     """)
 
-@app.websocket("/chat")
+@router.websocket("/chat")
 async def chat_endpoint(websocket: WebSocket):
+    from elevenlabs.conversational_ai.default_audio_interface import DefaultAudioInterface
+
     await websocket.accept()
-    
-    # Obtener el ID del candidato desde los argumentos
-    candidate_id = sys.argv[1]  # Tomar el ID del candidato del argumento
+    services = websocket.app.state.services
+    eleven_labs_client = elevenlabs_client()
+
+    # ID del candidato: /chat?candidate_id=ID001
+    candidate_id = websocket.query_params.get("candidate_id")
 
     # Inicializar la conversación con el agente
-    conversation = Conversation(
-        client=eleven_labs_client,
-        agent_id=ELEVEN_LABS_AGENT_ID,
+    conversation = services.agent_sessions.conversation(
         audio_interface=DefaultAudioInterface(),
         callback_agent_response=lambda text: print(f"Agent said: {text}"),
         callback_user_transcript=lambda text: print(f"User said: {text}"),
     )
     
-    # Lista para almacenar la transcripción
-    messages = []
+    # Resumen incremental de la transcripción
+    rolling_summary = RollingSummarizer(services.summary_worker, candidate_id)
 
     try:
         # Iniciar la sesión
@@ -134,7 +252,7 @@ async def chat_endpoint(websocket: WebSocket):
             # Generar audio para la respuesta
             audio = await eleven_labs_client.generate_audio(
                 text=response,
-                voice=ELEVEN_LABS_AGENT_ID
+                voice=services.agent_id
             )
             
             # Enviar respuesta al cliente
@@ -143,8 +261,8 @@ async def chat_endpoint(websocket: WebSocket):
                 "audio": base64.b64encode(audio).decode('utf-8')
             })
 
-            # Agregar los mensajes a la lista
-            messages.append({"user": message['text'], "agent": response})
+            # Agregar el intercambio al resumen en curso
+            rolling_summary.add_exchange(message['text'], response)
 
     except WebSocketDisconnect:
         print("Client disconnected")
@@ -154,105 +272,78 @@ async def chat_endpoint(websocket: WebSocket):
         # Terminar la sesión
         conversation.end_session()
 
-        # Generar un resumen de la conversación
-        summary = await generate_summary(messages)
-
-        # Guardar el resumen en la base de datos usando el ID del candidato
-        db_manager.update_candidate(candidate_id, {
-            "resumen": summary  # Guarda el resumen como comentario
-        })
+        # El resumen se cierra y se guarda en el candidato en segundo plano
+        rolling_summary.finalize()
 
-async def generate_summary(messages: list) -> str:
-    """
-    Genera un resumen inteligente de la conversación usando OpenAI.
-    
-    Args:
-        messages (list): Lista de mensajes de la conversación.
-    
-    Returns:
-        str: Resumen conciso de la conversación.
-    """
-    try:
-        # Crear el prompt para el resumen
-        conversation_text = "\n".join([
-            f"Usuario: {msg['user']}\nAgente: {msg['agent']}\n"
-            for msg in messages
-        ])
-
-        prompt = f"""
-        Genera un resumen conciso y estructurado de la siguiente conversación:
-        {conversation_text}
-        
-        El resumen debe incluir:
-        1. Puntos principales discutidos
-        2. Acuerdos o decisiones alcanzadas
-        3. Próximos pasos o acciones a tomar (si los hay)
-        4. Estado emocional general del beneficiario
-        """
-
-        # Llamar a la API de OpenAI para generar el resumen
-        response = openai.ChatCompletion.create(
-            model="gpt-4o-mini",  # O el modelo que prefieras
-            messages=[{"role": "user", "content": prompt}],
-            api_key=OPENAI_API_KEY
-        )
-
-        # Obtener el contenido del resumen
-        summary = response['choices'][0]['message']['content']
-        
-        # Formatear el resumen final
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        formatted_summary = f"""
-        Resumen de la llamada ({timestamp}):
-        --------------------------------
-        {summary}
-        """
-
-        return formatted_summary.strip()
-
-    except Exception as e:
-        logger.error(f"Error generando el resumen: {str(e)}")
-        # En caso de error, devolver un resumen básico
-        return f"""
-        Resumen básico de la llamada ({datetime.now().strftime("%Y-%m-%d %H:%M:%S")}):
-        --------------------------------
-        No se pudo generar un resumen detallado. 
-        La conversación consistió en {len(messages)} intercambios entre el usuario y el agente.
-        """
-
-@app.api_route("/twilio/inbound_call", methods=["GET", "POST"])
+@router.api_route("/twilio/inbound_call", methods=["GET", "POST"])
 async def handle_incoming_call(request: Request):
     """Handle incoming call and return TwiML response."""
     response = VoiceResponse()
     host = request.url.hostname
+    # Las llamadas del despachador reproducen primero su notificación
+    job_id = request.query_params.get("job_id")
+    if job_id:
+        response.play(f"https://{host}/tts/notification/{job_id}")
     connect = Connect()
     connect.stream(url=f"wss://{host}/media-stream-eleven")
     response.append(connect)
     return HTMLResponse(content=str(response), media_type="application/xml")
 
-@app.websocket("/media-stream-eleven")
+@router.get("/tts/notification/{job_id}")
+async def notification_audio(request: Request, job_id: int):
+    """
+    Audio del mensaje de un trabajo de llamada. Los segmentos en caché salen
+    de inmediato y el resto se envía según se sintetiza (Starlette recorre
+    el generador en su pool de hilos).
+    """
+    services = request.app.state.services
+    job = await asyncio.to_thread(services.call_dispatcher.store.get, job_id)
+    if job is None:
+        return JSONResponse({"error": "job not found"}, status_code=404)
+    return StreamingResponse(
+        get_tts_cache().render_stream(job["message"], services.notification_voice),
+        media_type="audio/mpeg"
+    )
+
+@router.websocket("/media-stream-eleven")
 async def handle_media_stream(websocket: WebSocket):
+    # Precargado al arrancar; sólo cuesta la primera vez si la llamada llega antes
+    from conversational_call.twilio_audio_interface import TwilioAudioInterface
+
     await websocket.accept()
     print("WebSocket connection established")
 
-    audio_interface = TwilioAudioInterface(websocket)
+    services = websocket.app.state.services
+    call_dispatcher = services.call_dispatcher
+    transcript_hub = services.transcript_hub
+    metrics = services.call_metrics.call()
+    audio_interface = TwilioAudioInterface(websocket, metrics=metrics)
     conversation = None
+    loop = asyncio.get_running_loop()
+    # El candidato se conoce por el callSid del evento "start" de Twilio
+    rolling_summary = RollingSummarizer(
+        services.summary_worker,
+        resolve_candidate=lambda: call_dispatcher.candidate_for_call(audio_interface.call_sid),
+        metrics=metrics
+    )
+
+    def on_transcript(text: str, is_agent: bool):
+        if not is_agent:
+            # La transcripción del usuario marca el fin de su turno
+            audio_interface.mark_user_turn_end()
+        # ElevenLabs llama desde su hilo; el resumen vive en el event loop
+        loop.call_soon_threadsafe(rolling_summary.add_line, "Agente" if is_agent else "Usuario", text)
+        loop.call_soon_threadsafe(transcript_hub.publish, audio_interface.call_sid, {
+            "type": "transcript",
+            "text": text,
+            "isAgent": is_agent
+        })
 
     try:
-        conversation = Conversation(
-            client=eleven_labs_client,
-            agent_id=ELEVEN_LABS_AGENT_ID,
+        conversation = services.agent_sessions.conversation(
             audio_interface=audio_interface,
-            callback_agent_response=lambda text: websocket.send_json({
-                "type": "transcript",
-                "text": text,
-                "isAgent": True
-            }),
-            callback_user_transcript=lambda text: websocket.send_json({
-                "type": "transcript",
-                "text": text,
-                "isAgent": False
-            })
+            callback_agent_response=lambda text: on_transcript(text, True),
+            callback_user_transcript=lambda text: on_transcript(text, False)
         )
 
         conversation.start_session()
@@ -263,8 +354,7 @@ async def handle_media_stream(websocket: WebSocket):
                 continue
 
             try:
-                data = json.loads(message)
-                await audio_interface.handle_twilio_message(data)
+                await audio_interface.handle_raw_message(message)
             except Exception as e:
                 print(f"Error processing message: {str(e)}")
                 traceback.print_exc()
@@ -275,9 +365,39 @@ async def handle_media_stream(websocket: WebSocket):
         if conversation:
             print("Ending conversation session...")
             conversation.end_session()
-            conversation.wait_for_session_end()
+            # El hilo de la conversación tarda hasta 0.5 s en salir; no bloquear el loop
+            await asyncio.to_thread(conversation.wait_for_session_end)
+        transcript_hub.publish(audio_interface.call_sid, {"type": "call_ended"})
+        rolling_summary.finalize()
+        services.call_metrics.end(metrics)
+
+@router.websocket("/transcripts")
+async def transcripts_stream(websocket: WebSocket):
+    """
+    Transcripciones en vivo para el panel de supervisión.
 
-@app.post("/status-callback")
+    `?call_sid=CA1,CA2` limita la suscripción a esas llamadas; sin el
+    parámetro se reciben todas. Un visor que no lee a tiempo se desconecta
+    en lugar de frenar el audio de las llamadas.
+    """
+    await websocket.accept()
+    transcript_hub = websocket.app.state.services.transcript_hub
+    call_sids = [sid for sid in websocket.query_params.get("call_sid", "").split(",") if sid]
+    subscription = transcript_hub.subscribe(call_sids or None)
+    try:
+        while True:
+            message = await subscription.get()
+            if message is None:
+                # 1013: "try again later", el visor se quedó atrás
+                await websocket.close(code=1013)
+                break
+            await websocket.send_text(message)
+    except (WebSocketDisconnect, RuntimeError):
+        pass
+    finally:
+        transcript_hub.unsubscribe(subscription)
+
+@router.post("/status-callback")
 async def status_callback(request: Request):
     """Handle call status callbacks"""
     form_data = await request.form()
@@ -285,21 +405,45 @@ async def status_callback(request: Request):
     call_sid = form_data.get('CallSid')
     
     print(f"Call Status Update - SID: {call_sid}, Status: {call_status}")
+    if call_sid and call_status:
+        # Escritura en SQLite: en el executor del despachador, no en el event loop de los websockets
+        await request.app.state.services.call_dispatcher.update_status(call_sid, call_status)
     return {"status": "received"}
 
-# Realizar la llamada
-try:
-    call = client.calls.create(
-        to=os.getenv("TWILIO_NUMBER_TO_CALL"),
-        from_=os.getenv("TWILIO_FROM_NUMBER"),
-        url="https://e7af-138-84-41-184.ngrok-free.app/incoming-call",
-        status_callback="https://e7af-138-84-41-184.ngrok-free.app/status-callback",
-        status_callback_event=['initiated', 'ringing', 'answered', 'completed'],
+@router.get("/metrics")
+async def metrics_endpoint(request: Request):
+    """Histogramas por llamada y estado de los pools, en formato de Prometheus"""
+    services = request.app.state.services
+    transcript_hub = services.transcript_hub
+    sessions = services.agent_sessions.metrics()
+    return PlainTextResponse(
+        services.call_metrics.render(
+            gauges={
+                "agent_sessions_ready": sessions["ready"],
+                "transcript_subscribers": transcript_hub.subscriber_count,
+            },
+            counters={
+                "agent_sessions_hits_total": sessions["hits"],
+                "agent_sessions_misses_total": sessions["misses"],
+                "transcript_dropped_subscribers_total": transcript_hub.dropped_subscribers,
+            }
+        ),
+        media_type="text/plain; version=0.0.4"
     )
-    print(f"Llamada iniciada con SID: {call.sid}")
-except Exception as e:
-    print(f"Error al crear la llamada: {str(e)}")
 
-if __name__ == "__main__":
+def main():
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=PORT)
+
+    parser = argparse.ArgumentParser(description="Servidor de llamadas")
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", 5050)))
+    parser.add_argument("--call", metavar="NUMBER", help="Encola una llamada de prueba a este número al arrancar")
+    args = parser.parse_args()
+
+    load_dotenv()
+    if args.call:
+        job_id = enqueue_call(args.call, "This is a test call from the subsidy system.")
+        print(f"Llamada de prueba encolada (trabajo {job_id})")
+    uvicorn.run(create_app(), host="0.0.0.0", port=args.port)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,383 @@
+import asyncio
+from dataclasses import dataclass
+from datetime import datetime
+import json
+import logging
+import random
+import time
+from typing import Any, Awaitable, Callable, List, Optional, Set
+from conversational_call.call_metrics import SUMMARY, CallMetrics
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_MODEL = "gpt-4o-mini"
+
+SUMMARY_INSTRUCTIONS = """
+El resumen debe incluir:
+1. Puntos principales discutidos
+2. Acuerdos o decisiones alcanzadas
+3. Próximos pasos o acciones a tomar (si los hay)
+4. Estado emocional general del beneficiario
+"""
+
+
+@dataclass
+class SummaryJob:
+    """
+    Transcripción pendiente de resumir para un candidato
+    """
+    candidate_id: str
+    text: str
+    exchanges: int
+    # Métricas de la llamada que originó la transcripción, si se conocen
+    metrics: Optional[CallMetrics] = None
+
+
+def transcript_text(messages: List[dict]) -> str:
+    return "\n".join([
+        f"Usuario: {msg['user']}\nAgente: {msg['agent']}\n"
+        for msg in messages
+    ])
+
+
+def format_summary(summary: str) -> str:
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    return f"Resumen de la llamada ({timestamp}):\n--------------------------------\n{summary.strip()}"
+
+
+def basic_summary(exchanges: int) -> str:
+    """Resumen mínimo cuando no se pudo usar el modelo"""
+    return format_summary(
+        "No se pudo generar un resumen detallado.\n"
+        f"La conversación consistió en {exchanges} intercambios entre el usuario y el agente."
+    )
+
+
+async def generate_summary(client, conversation_text: str, model: str = SUMMARY_MODEL) -> str:
+    """
+    Genera un resumen inteligente de la conversación usando OpenAI.
+
+    Args:
+        client: Cliente AsyncOpenAI.
+        conversation_text (str): Transcripción de la conversación.
+        model (str): Modelo a usar.
+
+    Returns:
+        str: Resumen conciso de la conversación (sin formatear).
+    """
+    prompt = (
+        "Genera un resumen conciso y estructurado de la siguiente conversación:\n"
+        f"{conversation_text}\n{SUMMARY_INSTRUCTIONS}"
+    )
+    response = await client.chat.completions.create(
+        model=model,
+        messages=[{"role": "user", "content": prompt}]
+    )
+    return response.choices[0].message.content
+
+
+async def generate_summaries(client, conversation_texts: List[str], model: str = SUMMARY_MODEL) -> List[str]:
+    """
+    Resume varias conversaciones cortas en una sola petición.
+
+    Raises:
+        ValueError: Si la respuesta no trae exactamente un resumen por conversación.
+    """
+    numbered = "\n".join(
+        f"### Conversación {i}\n{text}" for i, text in enumerate(conversation_texts, start=1)
+    )
+    prompt = (
+        f"Genera un resumen conciso y estructurado de cada una de las siguientes {len(conversation_texts)} conversaciones.\n"
+        f"{numbered}\n{SUMMARY_INSTRUCTIONS}\n"
+        'Responde sólo con JSON: {"summaries": ["resumen 1", "resumen 2", ...]} en el mismo orden.'
+    )
+    response = await client.chat.completions.create(
+        model=model,
+        messages=[{"role": "user", "content": prompt}],
+        response_format={"type": "json_object"}
+    )
+    summaries = json.loads(response.choices[0].message.content).get("summaries")
+    if not isinstance(summaries, list) or len(summaries) != len(conversation_texts):
+        raise ValueError("La respuesta no trae un resumen por conversación")
+    return [str(summary) for summary in summaries]
+
+
+async def condense_summary(
+    client,
+    running_summary: Optional[str],
+    conversation_text: str,
+    max_chars: int,
+    model: str = SUMMARY_MODEL
+) -> str:
+    """
+    Incorpora un nuevo tramo de la conversación al resumen acumulado.
+
+    Returns:
+        str: Resumen actualizado, de como mucho `max_chars` caracteres.
+    """
+    prompt = (
+        f"Resumen de la conversación hasta ahora:\n{running_summary or '(vacío)'}\n\n"
+        f"Nuevo tramo de la conversación:\n{conversation_text}\n\n"
+        f"Actualiza el resumen incorporando el nuevo tramo, en menos de {max_chars} caracteres.\n"
+        f"{SUMMARY_INSTRUCTIONS}"
+    )
+    response = await client.chat.completions.create(
+        model=model,
+        messages=[{"role": "user", "content": prompt}]
+    )
+    return response.choices[0].message.content.strip()[:max_chars]
+
+
+class SummaryWorker:
+    """
+    Cola de resúmenes de llamadas procesada en segundo plano.
+
+    submit() vuelve de inmediato; `concurrency` tareas del event loop
+    llaman a OpenAI con el cliente asíncrono, reintentan con backoff
+    exponencial y agrupan transcripciones cortas en una sola petición.
+    Al terminar cada trabajo se guarda el resumen en el candidato.
+
+    `client_factory` devuelve el cliente AsyncOpenAI (p. ej.
+    clients.async_openai_client); se llama con el primer resumen.
+    """
+
+    def __init__(
+        self,
+        db,
+        client_factory: Callable[[], Any],
+        concurrency: int = 4,
+        max_retries: int = 3,
+        base_delay: float = 1.0,
+        short_transcript_chars: int = 1500,
+        max_batch_size: int = 5,
+        model: str = SUMMARY_MODEL
+    ):
+        self.db = db
+        self.client_factory = client_factory
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.short_transcript_chars = short_transcript_chars
+        self.max_batch_size = max_batch_size
+        self.model = model
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self._workers: List[asyncio.Task] = []
+        # Limita también las peticiones de los resúmenes incrementales
+        self._slots = asyncio.Semaphore(concurrency)
+        self._tracked: Set[asyncio.Task] = set()
+
+    @property
+    def client(self):
+        return self.client_factory()
+
+    def start(self):
+        loop = asyncio.get_running_loop()
+        self._workers = [loop.create_task(self._worker()) for _ in range(self.concurrency)]
+
+    async def stop(self, timeout: Optional[float] = 30.0):
+        """Espera a que se vacíe la cola (hasta `timeout`) y detiene los workers"""
+        try:
+            if self._tracked:
+                await asyncio.wait_for(asyncio.gather(*self._tracked, return_exceptions=True), timeout)
+            await asyncio.wait_for(self.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Stopping summary worker with %d pending jobs", self.queue.qsize())
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+
+    def submit(self, candidate_id: str, messages: List[dict]):
+        """Encola el resumen de una conversación; no bloquea"""
+        if messages:
+            self.submit_text(candidate_id, transcript_text(messages), len(messages))
+
+    def submit_text(self, candidate_id: str, text: str, exchanges: int, metrics: Optional[CallMetrics] = None):
+        if candidate_id and text:
+            self.queue.put_nowait(SummaryJob(candidate_id, text, exchanges, metrics))
+
+    def track(self, task: asyncio.Task):
+        """Registra una tarea que stop() debe esperar"""
+        self._tracked.add(task)
+        task.add_done_callback(self._tracked.discard)
+
+    async def condense(self, running_summary: Optional[str], conversation_text: str, max_chars: int) -> str:
+        async with self._slots:
+            return await self._with_retry(
+                lambda: condense_summary(self.client, running_summary, conversation_text, max_chars, self.model)
+            )
+
+    async def save(self, candidate_id: str, summary: str):
+        await asyncio.to_thread(self.db.update_candidate, candidate_id, {"resumen": summary})
+
+    def _is_short(self, job: SummaryJob) -> bool:
+        return len(job.text) <= self.short_transcript_chars
+
+    def _take_batch(self, first: SummaryJob) -> List[SummaryJob]:
+        """Junta con `first` otras transcripciones cortas que ya estén en cola"""
+        batch = [first]
+        if not self._is_short(first):
+            return batch
+        deferred = []
+        while len(batch) < self.max_batch_size and not self.queue.empty():
+            job = self.queue.get_nowait()
+            (batch if self._is_short(job) else deferred).append(job)
+        for job in deferred:
+            # Vuelven a la cola; task_done compensa el get de arriba
+            self.queue.put_nowait(job)
+            self.queue.task_done()
+        return batch
+
+    async def _worker(self):
+        while True:
+            first = await self.queue.get()
+            batch = self._take_batch(first)
+            try:
+                started = time.perf_counter()
+                summaries = await self._summarize(batch)
+                elapsed = time.perf_counter() - started
+                for job in batch:
+                    if job.metrics is not None:
+                        job.metrics.observe(SUMMARY, elapsed)
+                for job, summary in zip(batch, summaries):
+                    await self.save(job.candidate_id, summary)
+            except Exception as e:
+                logger.error(f"Error guardando resúmenes: {str(e)}")
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    async def _summarize(self, batch: List[SummaryJob]) -> List[str]:
+        if len(batch) > 1:
+            try:
+                async with self._slots:
+                    summaries = await self._with_retry(
+                        lambda: generate_summaries(self.client, [job.text for job in batch], self.model)
+                    )
+                return [format_summary(summary) for summary in summaries]
+            except Exception as e:
+                logger.warning(f"Resumen por lotes falló, se resumen por separado: {str(e)}")
+        return list(await asyncio.gather(*(self._summarize_one(job) for job in batch)))
+
+    async def _summarize_one(self, job: SummaryJob) -> str:
+        try:
+            async with self._slots:
+                summary = await self._with_retry(lambda: generate_summary(self.client, job.text, self.model))
+            return format_summary(summary)
+        except Exception as e:
+            logger.error(f"Error generando el resumen: {str(e)}")
+            return basic_summary(job.exchanges)
+
+    async def _with_retry(self, request):
+        for attempt in range(self.max_retries + 1):
+            try:
+                return await request()
+            except Exception:
+                if attempt == self.max_retries:
+                    raise
+                delay = self.base_delay * 2 ** attempt + random.uniform(0, self.base_delay)
+                await asyncio.sleep(delay)
+
+
+class RollingSummarizer:
+    """
+    Resumen incremental de una llamada en curso.
+
+    La transcripción se acumula por tramos; cada vez que el tramo pendiente
+    supera `chunk_chars` se condensa en el resumen acumulado (acotado a
+    `max_summary_chars`) y se guarda en el candidato, así que la memoria
+    por llamada no crece con la duración y un corte del proceso no pierde
+    lo ya resumido. Las llamadas cortas, que nunca llegan a condensarse,
+    pasan al final por la cola normal del SummaryWorker (con lotes).
+
+    Todos los métodos deben llamarse desde el event loop del servidor, y
+    `resolve_candidate` devuelve un awaitable: la búsqueda del candidato
+    (una consulta a SQLite) no debe bloquear el loop.
+    """
+
+    def __init__(
+        self,
+        worker: SummaryWorker,
+        candidate_id: Optional[str] = None,
+        resolve_candidate: Optional[Callable[[], Awaitable[Optional[str]]]] = None,
+        chunk_chars: int = 4000,
+        max_summary_chars: int = 2000,
+        metrics: Optional[CallMetrics] = None
+    ):
+        self.worker = worker
+        self.candidate_id = candidate_id
+        self.resolve_candidate = resolve_candidate
+        self.chunk_chars = chunk_chars
+        self.max_summary_chars = max_summary_chars
+        self.metrics = metrics
+        self.summary: Optional[str] = None
+        self.exchanges = 0
+        self._pending: List[str] = []
+        self._pending_chars = 0
+        self._task: Optional[asyncio.Task] = None
+
+    async def _candidate(self) -> Optional[str]:
+        if self.candidate_id is None and self.resolve_candidate is not None:
+            self.candidate_id = await self.resolve_candidate()
+        return self.candidate_id
+
+    def add_line(self, speaker: str, text: str):
+        line = f"{speaker}: {text}"
+        self._pending.append(line)
+        self._pending_chars += len(line) + 1
+        if speaker == "Agente":
+            self.exchanges += 1
+        if self._pending_chars >= self.chunk_chars and (self._task is None or self._task.done()):
+            self._task = asyncio.get_running_loop().create_task(self._condense_pending(final=False))
+            self.worker.track(self._task)
+
+    def add_exchange(self, user: str, agent: str):
+        self.add_line("Usuario", user)
+        self.add_line("Agente", agent)
+
+    def _take_pending(self) -> str:
+        text = "\n".join(self._pending)
+        self._pending = []
+        self._pending_chars = 0
+        return text
+
+    async def _condense_pending(self, final: bool) -> bool:
+        """Condensa el tramo pendiente; False si falló y el tramo sigue en _pending"""
+        while self._pending and (final or self._pending_chars >= self.chunk_chars):
+            text = self._take_pending()
+            try:
+                started = time.perf_counter()
+                self.summary = await self.worker.condense(self.summary, text, self.max_summary_chars)
+                if self.metrics is not None:
+                    self.metrics.observe(SUMMARY, time.perf_counter() - started)
+            except Exception as e:
+                logger.error(f"Error condensando el resumen: {str(e)}")
+                # Se conserva el tramo para el siguiente intento
+                self._pending.insert(0, text)
+                self._pending_chars += len(text) + 1
+                return False
+            candidate_id = await self._candidate()
+            if candidate_id and not final:
+                await self.worker.save(candidate_id, format_summary(self.summary + "\n(llamada en curso)"))
+        return True
+
+    def finalize(self):
+        """Cierra el resumen al colgar; no bloquea, el trabajo sigue en segundo plano"""
+        task = asyncio.get_running_loop().create_task(self._finalize())
+        self.worker.track(task)
+
+    async def _finalize(self):
+        if self._task is not None:
+            await asyncio.gather(self._task, return_exceptions=True)
+        candidate_id = await self._candidate()
+        if not candidate_id:
+            return
+        if self.summary is None:
+            self.worker.submit_text(candidate_id, self._take_pending(), self.exchanges, self.metrics)
+            return
+        if await self._condense_pending(final=True):
+            await self.worker.save(candidate_id, format_summary(self.summary))
+            return
+        # condense ya agotó sus reintentos: el final de la llamada va a la cola normal junto
+        # con lo ya resumido, que genera el resumen completo (o basic_summary si también falla)
+        text = f"Resumen de la primera parte de la llamada:\n{self.summary}\n\nResto de la conversación:\n{self._take_pending()}"
+        self.worker.submit_text(candidate_id, text, self.exchanges, self.metrics)
@@ -0,0 +1,94 @@
+import asyncio
+import json
+import logging
+from typing import Dict, Iterable, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+
+class Subscription:
+    """
+    Suscripción de un visor a una o varias llamadas (o a todas).
+
+    Los mensajes llegan ya serializados a JSON. get() devuelve None cuando
+    la suscripción se cerró, incluido el caso de un consumidor lento que
+    el hub descartó por llenar su cola.
+    """
+
+    def __init__(self, call_sids: Optional[Set[str]], maxsize: int):
+        self.call_sids = call_sids
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize)
+        self.closed = False
+        self.dropped = False
+
+    def _close(self):
+        self.closed = True
+        # Vaciar para que quepa la marca de fin aunque la cola estuviera llena
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(None)
+
+    async def get(self) -> Optional[str]:
+        return await self.queue.get()
+
+
+class TranscriptHub:
+    """
+    Difusión de transcripciones en vivo por call SID.
+
+    Cada visor tiene una cola acotada; publish() nunca espera: si la cola
+    de un visor está llena, ese visor se descarta en lugar de frenar al
+    productor, que es el camino del audio de la llamada.
+
+    Todos los métodos deben llamarse desde el event loop del servidor.
+    """
+
+    def __init__(self, queue_size: int = 100):
+        self.queue_size = queue_size
+        self._by_call: Dict[str, Set[Subscription]] = {}
+        self._all_calls: Set[Subscription] = set()
+        self.dropped_subscribers = 0
+
+    def subscribe(self, call_sids: Optional[Iterable[str]] = None) -> Subscription:
+        """Suscribe a las llamadas indicadas, o a todas si `call_sids` es None"""
+        call_sids = set(call_sids) if call_sids else None
+        subscription = Subscription(call_sids, self.queue_size)
+        if call_sids is None:
+            self._all_calls.add(subscription)
+        else:
+            for call_sid in call_sids:
+                self._by_call.setdefault(call_sid, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        if subscription.call_sids is None:
+            self._all_calls.discard(subscription)
+        else:
+            for call_sid in subscription.call_sids:
+                subscribers = self._by_call.get(call_sid)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._by_call[call_sid]
+        if not subscription.closed:
+            subscription._close()
+
+    def publish(self, call_sid: Optional[str], event: dict):
+        subscribers = list(self._all_calls)
+        if call_sid in self._by_call:
+            subscribers.extend(self._by_call[call_sid])
+        if not subscribers:
+            return
+        message = json.dumps({**event, "callSid": call_sid})
+        for subscription in subscribers:
+            try:
+                subscription.queue.put_nowait(message)
+            except asyncio.QueueFull:
+                logger.warning("Dropping slow transcript subscriber")
+                subscription.dropped = True
+                self.dropped_subscribers += 1
+                self.unsubscribe(subscription)
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._all_calls) + len({s for subs in self._by_call.values() for s in subs})
@@ -1,76 +1,205 @@
 import asyncio
-from typing import Callable
-import queue
-import threading
+import time
+from typing import Callable, Optional
 import base64
 from elevenlabs.conversational_ai.conversation import AudioInterface
-import websockets
+from conversational_call.audio_framing import AudioStreamStats, JitterBuffer, OutboundFramer
+from conversational_call.call_metrics import FIRST_AUDIO, INBOUND_FRAME, OUTPUT_QUEUE_DEPTH, WS_SEND, CallMetrics
+from conversational_call.twilio_codec import MediaEncoder, decode_message
+
+# Marca en la cola de salida: enviar "clear" a Twilio respetando el orden
+_CLEAR = object()
 
 class TwilioAudioInterface(AudioInterface):
-    def __init__(self, websocket):
+    """
+    Puente entre la conversación de ElevenLabs y el media stream de Twilio.
+
+    ElevenLabs llama a output/interrupt/stop desde su propio hilo; esos
+    métodos sólo encolan trabajo en el event loop del servidor con
+    call_soon_threadsafe. El envío al websocket lo hace una única tarea
+    de ese mismo loop, así no se crea un event loop por cada fragmento.
+
+    El audio de salida se re-empaqueta en frames de 20 ms agrupados hasta
+    `packet_frames` por mensaje, y el de entrada pasa por un jitter buffer
+    que lo entrega en bloques de `jitter_target_depth` frames.
+
+    Los tiempos del camino caliente se registran en `call_metrics`
+    (CallMetrics), que también publica los valores de metrics().
+    """
+
+    def __init__(
+        self,
+        websocket,
+        loop: Optional[asyncio.AbstractEventLoop] = None,
+        packet_frames: int = 5,
+        jitter_target_depth: int = 3,
+        jitter_max_depth: int = 10,
+        flush_interval: float = 0.02,
+        metrics: Optional[CallMetrics] = None
+    ):
         self.websocket = websocket
-        self.output_queue = queue.Queue()
-        self.should_stop = threading.Event()
+        # Se construye dentro del handler del websocket, así que hay un loop corriendo
+        self.loop = loop or asyncio.get_running_loop()
+        self.output_queue: asyncio.Queue = asyncio.Queue()
         self.stream_sid = None
+        self.call_sid = None
         self.input_callback = None
-        self.output_thread = None
+        self.output_task: Optional[asyncio.Task] = None
+        self._stopped = False
+        self.stats = AudioStreamStats()
+        self.framer = OutboundFramer(packet_frames=packet_frames)
+        self.jitter_buffer = JitterBuffer(self.stats, jitter_target_depth, jitter_max_depth)
+        self.flush_interval = flush_interval
+        self.encoder = MediaEncoder(None)
+        self.call_metrics = metrics or CallMetrics()
+        self.call_metrics.stream_source = self.metrics
+        # Fin del último turno del usuario, pendiente del primer audio del agente
+        self._turn_ended_at: Optional[float] = None
+
+    def _call_soon(self, callback, *args):
+        try:
+            self.loop.call_soon_threadsafe(callback, *args)
+        except RuntimeError:
+            # El loop ya se cerró: la llamada terminó
+            pass
 
     def start(self, input_callback: Callable[[bytes], None]):
         self.input_callback = input_callback
-        self.output_thread = threading.Thread(target=self._output_thread)
-        self.output_thread.start()
+        self._call_soon(self._start_output_task)
+
+    def _start_output_task(self):
+        if self.output_task is None and not self._stopped:
+            self.output_task = self.loop.create_task(self._output_pump())
 
     def stop(self):
-        self.should_stop.set()
-        if self.output_thread:
-            self.output_thread.join(timeout=5.0)
+        self._call_soon(self._stop)
+
+    def _stop(self):
+        self._stopped = True
+        if self.output_task:
+            self.output_task.cancel()
         self.stream_sid = None
 
+    def mark_user_turn_end(self):
+        """El usuario terminó de hablar (llega su transcripción); se puede llamar desde cualquier hilo"""
+        self._turn_ended_at = time.perf_counter()
+
     def output(self, audio: bytes):
-        self.output_queue.put(audio)
+        self._call_soon(self.output_queue.put_nowait, audio)
 
     def interrupt(self):
+        self._call_soon(self._interrupt)
+
+    def _interrupt(self):
+        while not self.output_queue.empty():
+            self.output_queue.get_nowait()
+        self.output_queue.put_nowait(_CLEAR)
+
+    async def handle_raw_message(self, raw: str):
+        """Procesa el texto recibido del websocket de Twilio (camino rápido para "media")"""
         try:
-            while True:
-                _ = self.output_queue.get(block=False)
-        except queue.Empty:
-            pass
-        asyncio.run(self._send_clear_message_to_twilio())
+            message = decode_message(raw)
+        except Exception as e:
+            print(f"Error decoding Twilio message: {e}")
+            return
+        if message.event == "media":
+            self._handle_media(message.payload, message.sequence_number)
+        else:
+            await self.handle_twilio_message(message.data)
+
+    def _handle_media(self, payload: bytes, sequence_number: Optional[int]):
+        started = time.perf_counter()
+        try:
+            audio_data = self.jitter_buffer.push(payload, sequence_number)
+            if audio_data and self.input_callback:
+                self.input_callback(audio_data)
+        except Exception as e:
+            print(f"Error in input_callback: {e}")
+        self.call_metrics.observe(INBOUND_FRAME, time.perf_counter() - started)
 
     async def handle_twilio_message(self, data):
         try:
             if data["event"] == "start":
                 self.stream_sid = data["start"]["streamSid"]
+                self.call_sid = data["start"].get("callSid")
+                self.call_metrics.call_sid = self.call_sid
+                self.encoder = MediaEncoder(self.stream_sid)
                 print(f"Started stream with stream_sid: {self.stream_sid}")
             if data["event"] == "media":
-                audio_data = base64.b64decode(data["media"]["payload"])
-                if self.input_callback:
+                sequence_number = data.get("sequenceNumber")
+                self._handle_media(
+                    base64.b64decode(data["media"]["payload"]),
+                    int(sequence_number) if sequence_number is not None else None
+                )
+            if data["event"] == "stop":
+                audio_data = self.jitter_buffer.drain()
+                if audio_data and self.input_callback:
                     self.input_callback(audio_data)
         except Exception as e:
             print(f"Error in input_callback: {e}")
 
-    def _output_thread(self):
-        while not self.should_stop.is_set():
-            asyncio.run(self._send_audio_to_twilio())
+    def metrics(self) -> dict:
+        """Métricas de buffers y paquetes de esta llamada"""
+        self.stats.output_queue_depth = self.output_queue.qsize()
+        return self.stats.as_dict()
+
+    async def _output_pump(self):
+        while True:
+            if self.framer.pending:
+                # Hay un frame incompleto: esperar un poco más de audio antes de rellenarlo
+                try:
+                    async with asyncio.timeout(self.flush_interval):
+                        item = await self.output_queue.get()
+                except TimeoutError:
+                    self.stats.underruns += 1
+                    await self._send_pending()
+                    continue
+            else:
+                item = await self.output_queue.get()
+
+            # Agrupar todo lo que ya esté en cola en el menor número de mensajes
+            items = [item]
+            while not self.output_queue.empty():
+                items.append(self.output_queue.get_nowait())
+            self.stats.max_output_queue_depth = max(self.stats.max_output_queue_depth, len(items))
+            self.call_metrics.observe(OUTPUT_QUEUE_DEPTH, len(items))
 
-    async def _send_audio_to_twilio(self):
+            for item in items:
+                if item is _CLEAR:
+                    self.framer.clear()
+                    await self._send_clear_message_to_twilio()
+                    continue
+                self.stats.outbound_chunks += 1
+                for packet in self.framer.push(item):
+                    await self._send_audio_to_twilio(packet)
+            # Enviar los frames completos que quedan; el parcial espera al siguiente fragmento
+            if self.framer.pending >= self.framer.frame_bytes:
+                await self._send_audio_to_twilio(self.framer.drain())
+
+    async def _send_pending(self):
+        packet = self.framer.drain()
+        while packet is not None:
+            await self._send_audio_to_twilio(packet)
+            packet = self.framer.drain()
+
+    async def _send_audio_to_twilio(self, audio: bytes):
+        self.stats.outbound_packets += 1
+        self.stats.outbound_bytes += len(audio)
+        started = time.perf_counter()
+        turn_ended_at = self._turn_ended_at
+        if turn_ended_at is not None:
+            self._turn_ended_at = None
+            self.call_metrics.observe(FIRST_AUDIO, started - turn_ended_at)
         try:
-            audio = self.output_queue.get(timeout=0.2)
-            audio_payload = base64.b64encode(audio).decode("utf-8")
-            audio_delta = {
-                "event": "media",
-                "streamSid": self.stream_sid,
-                "media": {"payload": audio_payload},
-            }
-            await self.websocket.send_json(audio_delta)
-        except queue.Empty:
-            pass
+            await self.websocket.send_text(self.encoder.media(audio))
+            self.call_metrics.observe(WS_SEND, time.perf_counter() - started)
         except Exception as e:
             print(f"Error sending audio: {e}")
 
     async def _send_clear_message_to_twilio(self):
         try:
-            clear_message = {"event": "clear", "streamSid": self.stream_sid}
-            await self.websocket.send_json(clear_message)
+            started = time.perf_counter()
+            await self.websocket.send_text(self.encoder.clear_message)
+            self.call_metrics.observe(WS_SEND, time.perf_counter() - started)
         except Exception as e:
             print(f"Error sending clear message to Twilio: {e}")
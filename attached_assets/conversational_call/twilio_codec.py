@@ -0,0 +1,68 @@
+import binascii
+import json
+from typing import NamedTuple, Optional
+
+# Twilio serializa los mensajes "media" siempre con el mismo orden de claves:
+# {"event":"media","sequenceNumber":"4","media":{...,"payload":"..."},"streamSid":"MZ..."}
+MEDIA_PREFIX = '{"event":"media"'
+PAYLOAD_MARKER = '"payload":"'
+SEQUENCE_MARKER = '"sequenceNumber":"'
+
+
+class TwilioMessage(NamedTuple):
+    """
+    Mensaje entrante del media stream ya decodificado
+    """
+    event: str
+    payload: Optional[bytes] = None
+    sequence_number: Optional[int] = None
+    data: Optional[dict] = None  # Sólo para eventos que no son "media"
+
+
+def decode_message(raw: str) -> TwilioMessage:
+    """
+    Decodifica un mensaje del media stream de Twilio.
+
+    Los eventos "media" (unos 50 por segundo) se resuelven buscando el
+    payload y el sequenceNumber en el texto, sin json.loads; el resto de
+    eventos, o un "media" con otro formato, pasa por el parser JSON.
+    """
+    if raw.startswith(MEDIA_PREFIX):
+        start = raw.find(PAYLOAD_MARKER)
+        if start != -1:
+            start += len(PAYLOAD_MARKER)
+            end = raw.find('"', start)
+            if end != -1:
+                sequence_number = None
+                seq_start = raw.find(SEQUENCE_MARKER, 0, start)
+                if seq_start != -1:
+                    seq_start += len(SEQUENCE_MARKER)
+                    sequence_number = int(raw[seq_start:raw.find('"', seq_start)])
+                return TwilioMessage("media", binascii.a2b_base64(raw[start:end]), sequence_number)
+
+    data = json.loads(raw)
+    event = data.get("event", "")
+    if event == "media":
+        sequence_number = data.get("sequenceNumber")
+        return TwilioMessage(
+            "media",
+            binascii.a2b_base64(data["media"]["payload"]),
+            int(sequence_number) if sequence_number is not None else None
+        )
+    return TwilioMessage(event, data=data)
+
+
+class MediaEncoder:
+    """
+    Serializa mensajes salientes a partir de plantillas pre-construidas
+    para un streamSid, sin crear un dict ni pasar por json.dumps.
+    """
+
+    def __init__(self, stream_sid: Optional[str]):
+        sid = json.dumps(stream_sid)
+        self._media_prefix = '{"event":"media","streamSid":' + sid + ',"media":{"payload":"'
+        self._media_suffix = '"}}'
+        self.clear_message = '{"event":"clear","streamSid":' + sid + '}'
+
+    def media(self, audio: bytes) -> str:
+        return self._media_prefix + binascii.b2a_base64(audio, newline=False).decode("ascii") + self._media_suffix
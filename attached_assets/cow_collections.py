@@ -0,0 +1,241 @@
+"""
+Colecciones copy-on-write por bloques para los snapshots de InMemoryDB.
+
+Una versión publicada no cambia nunca. Para no copiar todo el registro en
+cada escritura, los datos se reparten en bloques de tamaño acotado y una
+versión nueva comparte con la anterior todos los bloques que no tocó: una
+escritura cuesta O(bloque + número de bloques), no O(registro).
+
+Las escrituras se hacen con un editor (edit()), que copia cada bloque la
+primera vez que lo modifica y con freeze() devuelve la versión nueva.
+"""
+from bisect import bisect_left, bisect_right, insort
+from typing import Any, Dict, Generic, Hashable, Iterator, List, Optional, Set, Tuple, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+CHUNK_SIZE = 512
+
+
+class ChunkedMap(Generic[K, V]):
+    """
+    Diccionario inmutable repartido en bloques por orden de alta.
+
+    Recorrerlo devuelve las claves en el orden en que se añadieron, como un
+    dict. El bloque de cada clave se guarda en `slots`, compartido por todas
+    las versiones: sólo crece, y una versión anterior a la clave simplemente
+    no la tiene en su bloque.
+    """
+
+    __slots__ = ("_chunks", "_slots", "_size", "_chunk_size")
+
+    def __init__(self, chunk_size: int = CHUNK_SIZE, _chunks: Tuple[Dict[K, V], ...] = (),
+                 _slots: Optional[Dict[K, int]] = None, _size: int = 0):
+        self._chunk_size = chunk_size
+        self._chunks = _chunks
+        self._slots = {} if _slots is None else _slots
+        self._size = _size
+
+    def get(self, key: K, default: Any = None) -> Any:
+        slot = self._slots.get(key)
+        if slot is None or slot >= len(self._chunks):
+            return default
+        return self._chunks[slot].get(key, default)
+
+    def __getitem__(self, key: K) -> V:
+        slot = self._slots.get(key)
+        if slot is None or slot >= len(self._chunks):
+            raise KeyError(key)
+        return self._chunks[slot][key]
+
+    def __contains__(self, key: K) -> bool:
+        slot = self._slots.get(key)
+        return slot is not None and slot < len(self._chunks) and key in self._chunks[slot]
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __iter__(self) -> Iterator[K]:
+        for chunk in self._chunks:
+            yield from chunk
+
+    def values(self) -> Iterator[V]:
+        for chunk in self._chunks:
+            yield from chunk.values()
+
+    def items(self) -> Iterator[Tuple[K, V]]:
+        for chunk in self._chunks:
+            yield from chunk.items()
+
+    def edit(self) -> "ChunkedMapEditor[K, V]":
+        return ChunkedMapEditor(self)
+
+
+class ChunkedMapEditor(Generic[K, V]):
+    """Cambios sobre un ChunkedMap; un solo escritor a la vez"""
+
+    def __init__(self, base: ChunkedMap[K, V]):
+        self._chunk_size = base._chunk_size
+        self._chunks: List[Dict[K, V]] = list(base._chunks)
+        self._slots = base._slots
+        self._size = base._size
+        self._owned: Set[int] = set()
+
+    def _own(self, slot: int) -> Dict[K, V]:
+        if slot not in self._owned:
+            self._chunks[slot] = dict(self._chunks[slot])
+            self._owned.add(slot)
+        return self._chunks[slot]
+
+    def get(self, key: K, default: Any = None) -> Any:
+        slot = self._slots.get(key)
+        if slot is None or slot >= len(self._chunks):
+            return default
+        return self._chunks[slot].get(key, default)
+
+    def __contains__(self, key: K) -> bool:
+        slot = self._slots.get(key)
+        return slot is not None and slot < len(self._chunks) and key in self._chunks[slot]
+
+    def __setitem__(self, key: K, value: V):
+        slot = self._slots.get(key)
+        if slot is None:
+            slot = len(self._slots) // self._chunk_size
+            self._slots[key] = slot
+        while slot >= len(self._chunks):
+            self._owned.add(len(self._chunks))
+            self._chunks.append({})
+        chunk = self._own(slot)
+        if key not in chunk:
+            self._size += 1
+        chunk[key] = value
+
+    def pop(self, key: K, default: Any = None) -> Any:
+        slot = self._slots.get(key)
+        if slot is None or slot >= len(self._chunks) or key not in self._chunks[slot]:
+            return default
+        self._size -= 1
+        return self._own(slot).pop(key)
+
+    def freeze(self) -> ChunkedMap[K, V]:
+        self._owned = set()
+        return ChunkedMap(self._chunk_size, tuple(self._chunks), self._slots, self._size)
+
+
+class SortedChunks:
+    """
+    Lista ordenada inmutable en bloques ordenados de hasta 2 * `chunk_size`
+    elementos (como sortedcontainers.SortedList, pero persistente).
+    """
+
+    __slots__ = ("_chunks", "_maxes", "_size", "_chunk_size")
+
+    def __init__(self, chunk_size: int = CHUNK_SIZE, _chunks: Tuple[List, ...] = (),
+                 _maxes: Tuple = (), _size: int = 0):
+        self._chunk_size = chunk_size
+        self._chunks = _chunks
+        self._maxes = _maxes
+        self._size = _size
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __iter__(self) -> Iterator:
+        for chunk in self._chunks:
+            yield from chunk
+
+    def __contains__(self, item) -> bool:
+        i = bisect_left(self._maxes, item)
+        if i == len(self._chunks):
+            return False
+        chunk = self._chunks[i]
+        pos = bisect_left(chunk, item)
+        return pos < len(chunk) and chunk[pos] == item
+
+    def first(self):
+        """Primer elemento; IndexError si está vacía"""
+        if not self._chunks:
+            raise IndexError("first() on empty SortedChunks")
+        return self._chunks[0][0]
+
+    def bisect_right(self, item) -> int:
+        i = bisect_right(self._maxes, item)
+        if i == len(self._chunks):
+            return self._size
+        return sum(len(chunk) for chunk in self._chunks[:i]) + bisect_right(self._chunks[i], item)
+
+    def slice(self, start: int, stop: int) -> List:
+        """Elementos en las posiciones [start, stop)"""
+        result: List = []
+        offset = 0
+        for chunk in self._chunks:
+            if offset >= stop:
+                break
+            end = offset + len(chunk)
+            if end > start:
+                result.extend(chunk[max(0, start - offset):stop - offset])
+            offset = end
+        return result
+
+    def edit(self) -> "SortedChunksEditor":
+        return SortedChunksEditor(self)
+
+
+class SortedChunksEditor:
+    """Cambios sobre un SortedChunks; un solo escritor a la vez"""
+
+    def __init__(self, base: SortedChunks):
+        self._chunk_size = base._chunk_size
+        self._chunks: List[List] = list(base._chunks)
+        self._maxes: List = list(base._maxes)
+        self._size = base._size
+        # Identidad de los bloques ya copiados por este editor
+        self._owned: Set[int] = set()
+
+    def _own(self, i: int) -> List:
+        chunk = self._chunks[i]
+        if id(chunk) not in self._owned:
+            chunk = self._chunks[i] = list(chunk)
+            self._owned.add(id(chunk))
+        return chunk
+
+    def add(self, item):
+        if not self._chunks:
+            chunk = [item]
+            self._owned.add(id(chunk))
+            self._chunks.append(chunk)
+            self._maxes.append(item)
+            self._size = 1
+            return
+        i = min(bisect_left(self._maxes, item), len(self._chunks) - 1)
+        chunk = self._own(i)
+        insort(chunk, item)
+        self._size += 1
+        if len(chunk) > 2 * self._chunk_size:
+            tail = chunk[self._chunk_size:]
+            del chunk[self._chunk_size:]
+            self._owned.add(id(tail))
+            self._chunks.insert(i + 1, tail)
+            self._maxes.insert(i + 1, tail[-1])
+        self._maxes[i] = chunk[-1]
+
+    def discard(self, item):
+        i = bisect_left(self._maxes, item)
+        if i == len(self._chunks):
+            return
+        pos = bisect_left(self._chunks[i], item)
+        if pos == len(self._chunks[i]) or self._chunks[i][pos] != item:
+            return
+        chunk = self._own(i)
+        del chunk[pos]
+        self._size -= 1
+        if chunk:
+            self._maxes[i] = chunk[-1]
+        else:
+            del self._chunks[i]
+            del self._maxes[i]
+
+    def freeze(self) -> SortedChunks:
+        self._owned = set()
+        return SortedChunks(self._chunk_size, tuple(self._chunks), tuple(self._maxes), self._size)
@@ -1,49 +1,254 @@
+from contextlib import contextmanager
 from datetime import datetime, timedelta
+import os
 import secrets
-from typing import Dict, List, Optional, Tuple
-from models import User, Candidate, Transaction
+import threading
+from typing import TYPE_CHECKING, Callable, Dict, FrozenSet, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+from models import User, Candidate, Transaction, RANKING_FIELDS
+from change_feed import CANDIDATE_ADDED, CANDIDATE_UPDATED, TRANSACTION_ADDED, Change, ChangeFeed
+from cow_collections import ChunkedMap, ChunkedMapEditor, SortedChunks, SortedChunksEditor
+from eligibility import policy_for
+from resources import process_resources
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Fecha usada en el índice de elegibilidad para candidatos sin subsidio previo
+NEVER_SUBSIDIZED = datetime.min
+
+
+def default_candidates() -> List[Candidate]:
+    """Candidatos de ejemplo con los que arranca una base de datos vacía"""
+    return [
+        Candidate(
+            name="John Smith",
+            identification="ID001",
+            address="123 Main St",
+            phone="+1234567890",
+            wallet_address="0x742d35Cc6634C0532925a3b844Bc454e4438f44e",
+            last_subsidy=None
+        ),
+        Candidate(
+            name="Alice Johnson",
+            identification="ID002",
+            address="456 Oak Ave",
+            phone="+1987654321",
+            wallet_address="0x941C3C374f856C6e86c44F929491338B",
+            last_subsidy=datetime.now() - timedelta(days=70)
+        ),
+        Candidate(
+            name="Bob Wilson",
+            identification="ID003",
+            address="789 Pine Rd",
+            phone="+1122334455",
+            wallet_address="0xA1B2C3D4E5F6G7H8I9J0K1L2M3N4O5P6",
+            last_subsidy=datetime.now() - timedelta(days=30)
+        )
+    ]
+
+
+def candidates_to_frame(candidates: Sequence[Candidate]) -> "pd.DataFrame":
+    """Candidatos como DataFrame, una columna por campo de Candidate"""
+    # pandas sólo hace falta para las vistas tabulares; el servidor de llamadas no lo importa
+    import pandas as pd
+
+    frame = pd.DataFrame(
+        {field: [getattr(c, field) for c in candidates] for field in Candidate.model_fields},
+        columns=list(Candidate.model_fields)
+    )
+    frame["last_subsidy"] = pd.to_datetime(frame["last_subsidy"])
+    return frame
+
+
+class CandidateSnapshot(NamedTuple):
+    """
+    Estado del registro en una versión. Ni las colecciones ni los
+    Candidate de un snapshot cambian después de publicarlo.
+    """
+    version: int
+    # Último cambio del change feed incluido en el snapshot
+    changes_version: int
+    # Contadores publicados junto con los datos que cuentan
+    candidates_version: int
+    ranking_version: int
+    candidates: ChunkedMap[str, Candidate]
+    by_name: ChunkedMap[str, FrozenSet[str]]
+    by_phone: ChunkedMap[str, FrozenSet[str]]
+    by_wallet: ChunkedMap[str, FrozenSet[str]]
+    eligibility: SortedChunks
+
+    def edit(self) -> "_CandidateEditor":
+        return _CandidateEditor(
+            self.candidates.edit(), self.by_name.edit(), self.by_phone.edit(),
+            self.by_wallet.edit(), self.eligibility.edit()
+        )
+
+
+class _CandidateEditor(NamedTuple):
+    """Versión en preparación durante una escritura de candidatos"""
+    candidates: ChunkedMapEditor[str, Candidate]
+    by_name: ChunkedMapEditor[str, FrozenSet[str]]
+    by_phone: ChunkedMapEditor[str, FrozenSet[str]]
+    by_wallet: ChunkedMapEditor[str, FrozenSet[str]]
+    eligibility: SortedChunksEditor
+
+    def freeze(self, version: int, changes_version: int, candidates_version: int,
+               ranking_version: int) -> CandidateSnapshot:
+        return CandidateSnapshot(
+            version,
+            changes_version,
+            candidates_version,
+            ranking_version,
+            self.candidates.freeze(),
+            self.by_name.freeze(),
+            self.by_phone.freeze(),
+            self.by_wallet.freeze(),
+            self.eligibility.freeze()
+        )
+
+
+def _index_add(index: ChunkedMapEditor, key: str, identification: str):
+    index[key] = index.get(key, frozenset()) | {identification}
+
+
+def _index_remove(index: ChunkedMapEditor, key: str, identification: str):
+    ids = index.get(key)
+    if ids is None:
+        return
+    ids = ids - {identification}
+    if ids:
+        index[key] = ids
+    else:
+        index.pop(key)
 
 
 class InMemoryDB:
-    def __init__(self):
+    """
+    Base de datos en memoria compartida por las sesiones de Streamlit y los
+    handlers del servidor de llamadas.
+
+    Escrituras: un lock por colección (usuarios, candidatos, transacciones)
+    y copy-on-write de los registros, que se reemplazan en lugar de
+    modificarse en sitio. Lecturas: las que recorren el registro usan el
+    último snapshot publicado sin tomar ningún lock, nunca una escritura a
+    medio aplicar.
+
+    Cada escritura de candidatos publica un snapshot nuevo al terminar. Las
+    colecciones del snapshot son copy-on-write por bloques (ver
+    cow_collections): la versión nueva comparte con la anterior todo lo que
+    la escritura no tocó, así que publicarla no copia el registro.
+
+    Cada alta, modificación o transacción se publica además en `changes`
+    (ver change_feed), dentro del mismo lock que la escritura.
+    """
+
+    def __init__(self, candidates: Optional[Iterable[Candidate]] = None):
+        self._users_lock = threading.Lock()
+        self._candidates_lock = threading.Lock()
+        self._transactions_lock = threading.Lock()
         self.users: Dict[str, User] = {}
-        # Initialize with dummy candidates
-        self.candidates: Dict[str, Candidate] = {
-            "ID001": Candidate(
-                name="John Smith",
-                identification="ID001",
-                address="123 Main St",
-                phone="+1234567890",
-                wallet_address="0x742d35Cc6634C0532925a3b844Bc454e4438f44e",
-                last_subsidy=None
-            ),
-            "ID002": Candidate(
-                name="Alice Johnson",
-                identification="ID002",
-                address="456 Oak Ave",
-                phone="+1987654321",
-                wallet_address="0x941C3C374f856C6e86c44F929491338B",
-                last_subsidy=datetime.now() - timedelta(days=70)
-            ),
-            "ID003": Candidate(
-                name="Bob Wilson",
-                identification="ID003",
-                address="789 Pine Rd",
-                phone="+1122334455",
-                wallet_address="0xA1B2C3D4E5F6G7H8I9J0K1L2M3N4O5P6",
-                last_subsidy=datetime.now() - timedelta(days=30)
-            )
-        }
         self.transactions: List[Transaction] = []
 
+        # Índices secundarios (se mantienen en add_user / update_candidate)
+        self.users_by_email: Dict[str, str] = {}
+        # Candidatos, índices por nombre, teléfono y billetera (conjuntos
+        # inmutables de identificaciones) y lista ordenada de
+        # (last_subsidy, identification) para elegibilidad
+        self._snapshot = self._empty_snapshot()
+        self._editor = None
+        self.changes = ChangeFeed()
+        # Contadores del escritor; los lectores ven los del último snapshot
+        self._ranking_version = 0
+        self._candidates_version = 0
+        # Sin `candidates`, los de ejemplo; la carga inicial no pasa por el change feed
+        with self._writing_candidates():
+            self._load(default_candidates() if candidates is None else candidates)
+
+    def _empty_snapshot(self) -> CandidateSnapshot:
+        return CandidateSnapshot(0, 0, 0, 0, ChunkedMap(), ChunkedMap(), ChunkedMap(), ChunkedMap(), SortedChunks())
+
+    def _load(self, candidates: Iterable[Candidate]):
+        for candidate in candidates:
+            if candidate.identification not in self._editor.candidates:
+                self._editor.candidates[candidate.identification] = candidate
+                self._index_candidate(candidate)
+
+    def _index_candidate(self, candidate: Candidate):
+        editor = self._editor
+        _index_add(editor.by_name, candidate.name, candidate.identification)
+        _index_add(editor.by_phone, candidate.phone, candidate.identification)
+        _index_add(editor.by_wallet, candidate.wallet_address, candidate.identification)
+        editor.eligibility.add((candidate.last_subsidy or NEVER_SUBSIDIZED, candidate.identification))
+
+    def _unindex_candidate(self, candidate: Candidate):
+        editor = self._editor
+        _index_remove(editor.by_name, candidate.name, candidate.identification)
+        _index_remove(editor.by_phone, candidate.phone, candidate.identification)
+        _index_remove(editor.by_wallet, candidate.wallet_address, candidate.identification)
+        editor.eligibility.discard((candidate.last_subsidy or NEVER_SUBSIDIZED, candidate.identification))
+
+    @contextmanager
+    def _writing_candidates(self) -> Iterator[None]:
+        """
+        Escritura de candidatos: serializada con otras escrituras. Los
+        cambios se hacen sobre self._editor y se publican juntos al terminar.
+        """
+        with self._candidates_lock:
+            snapshot = self._snapshot
+            self._editor = snapshot.edit()
+            try:
+                yield
+            finally:
+                # También si falló a medias: lo aplicado ya está en el change feed
+                editor, self._editor = self._editor, None
+                self._snapshot = editor.freeze(
+                    snapshot.version + 1, self.changes.version, self._candidates_version, self._ranking_version
+                )
+
+    def snapshot(self) -> CandidateSnapshot:
+        """Snapshot de la última escritura terminada, sin bloquear ni copiar"""
+        return self._snapshot
+
+    @property
+    def ranking_version(self) -> int:
+        """Cambia sólo cuando cambian campos usados en el ranking (RANKING_FIELDS)"""
+        return self._snapshot.ranking_version
+
+    @property
+    def candidates_version(self) -> int:
+        """Cambia con cualquier alta o modificación de candidatos"""
+        return self._snapshot.candidates_version
+
+    @property
+    def changes_version(self) -> int:
+        """
+        Versión del último cambio de candidatos ya visible para los lectores.
+
+        Se toma del snapshot, no del change feed: durante una escritura el
+        feed va por delante de lo que devuelven las lecturas, y quien lea
+        esta versión y después el registro no debe darlo por incluido.
+        """
+        return self._snapshot.changes_version
+
+    def changes_since(self, version: int) -> Optional[List[Change]]:
+        """Cambios posteriores a `version`; None si ya no se conservan y hay que releer todo"""
+        return self.changes.since(version)
+
+    def subscribe(self, subscriber: Callable[[Change], None]) -> Callable[[], None]:
+        """Llama a `subscriber` con cada cambio siguiente; devuelve la función para darlo de baja"""
+        return self.changes.subscribe(subscriber)
+
     # Keep existing user management methods
     def add_user(self, username: str, password: str, email: str) -> Tuple[bool, str]:
+        with self._users_lock:
+            return self._add_user(username, password, email)
+
+    def _add_user(self, username: str, password: str, email: str) -> Tuple[bool, str]:
         if username in self.users:
             return False, "Username already exists"
 
-        for user in self.users.values():
-            if user.email == email:
-                return False, "Email is already registered"
+        if email in self.users_by_email:
+            return False, "Email is already registered"
 
         if len(password) < 6:
             return False, "Password must be at least 6 characters long"
@@ -51,6 +256,7 @@ class InMemoryDB:
         try:
             new_user = User(username=username, password=password, email=email)
             self.users[username] = new_user
+            self.users_by_email[email] = username
             return True, "User registered successfully"
         except Exception as e:
             return False, f"Error registering user: {str(e)}"
@@ -65,49 +271,195 @@ class InMemoryDB:
 
         return True, "Authentication successful"
 
+    def get_user_by_email(self, email: str) -> Optional[User]:
+        username = self.users_by_email.get(email)
+        return self.users.get(username) if username is not None else None
+
     def generate_recovery_code(self, email: str) -> Optional[str]:
-        for user in self.users.values():
-            if user.email == email:
-                recovery_code = secrets.token_hex(3)
-                user.recovery_code = recovery_code
-                user.recovery_code_expiry = datetime.now() + timedelta(minutes=30)
-                return recovery_code
-        return None
+        recovery_code = secrets.token_hex(3)
+        with self._users_lock:
+            user = self.get_user_by_email(email)
+            if user is None:
+                return None
+            self.users[user.username] = user.model_copy(update={
+                "recovery_code": recovery_code,
+                "recovery_code_expiry": datetime.now() + timedelta(minutes=30)
+            })
+        return recovery_code
 
     def reset_password(self, email: str, recovery_code: str, new_password: str) -> Tuple[bool, str]:
         if len(new_password) < 6:
             return False, "New password must be at least 6 characters long"
 
-        for user in self.users.values():
-            if (user.email == email and 
-                user.recovery_code == recovery_code and 
-                user.recovery_code_expiry and 
+        with self._users_lock:
+            user = self.get_user_by_email(email)
+            if (user is not None and
+                user.recovery_code == recovery_code and
+                user.recovery_code_expiry and
                 user.recovery_code_expiry > datetime.now()):
-                user.password = new_password
-                user.recovery_code = None
-                user.recovery_code_expiry = None
+                self.users[user.username] = user.model_copy(update={
+                    "password": new_password,
+                    "recovery_code": None,
+                    "recovery_code_expiry": None
+                })
                 return True, "Password updated successfully"
         return False, "Invalid or expired recovery code"
 
     # Simplified candidate management (read-only)
     def get_candidate(self, identification: str) -> Optional[Candidate]:
-        return self.candidates.get(identification)
+        return self._snapshot.candidates.get(identification)
 
     def get_all_candidates(self) -> List[Candidate]:
-        return list(self.candidates.values())
+        return list(self.snapshot().candidates.values())
+
+    @staticmethod
+    def _first_indexed(snapshot: CandidateSnapshot, index: ChunkedMap, key: str) -> Optional[Candidate]:
+        """Si varios candidatos comparten la clave, el de menor identificación"""
+        ids = index.get(key)
+        if not ids:
+            return None
+        return snapshot.candidates[min(ids)]
+
+    def get_candidate_by_name(self, name: str) -> Optional[Candidate]:
+        snapshot = self.snapshot()
+        return self._first_indexed(snapshot, snapshot.by_name, name)
+
+    def get_candidate_by_phone(self, phone: str) -> Optional[Candidate]:
+        snapshot = self.snapshot()
+        return self._first_indexed(snapshot, snapshot.by_phone, phone)
+
+    def get_candidate_by_wallet(self, wallet_address: str) -> Optional[Candidate]:
+        snapshot = self.snapshot()
+        return self._first_indexed(snapshot, snapshot.by_wallet, wallet_address)
+
+    def candidates_frame(self) -> "pd.DataFrame":
+        return candidates_to_frame(self.get_all_candidates())
+
+    def get_eligible_candidates(self, days: Optional[int] = None, now: Optional[datetime] = None) -> List[Candidate]:
+        """
+        Devuelve los candidatos sin subsidio en los últimos `days` días
+        (por defecto la ventana de DEFAULT_POLICY), ordenados del subsidio
+        más antiguo al más reciente.
+        """
+        cutoff = policy_for(days).cutoff(now or datetime.now())
+        snapshot = self.snapshot()
+        # (cutoff, "") precede a cualquier entrada con fecha == cutoff, igual que is_eligible
+        end = snapshot.eligibility.bisect_right((cutoff, ""))
+        return [snapshot.candidates[identification] for _, identification in snapshot.eligibility.slice(0, end)]
+
+    def get_newly_eligible_candidates(self, since: datetime, now: Optional[datetime] = None,
+                                      days: Optional[int] = None) -> List[Candidate]:
+        """Candidatos que pasaron a ser elegibles después de `since` y hasta `now`"""
+        start, end = policy_for(days).newly_eligible_range(since, now or datetime.now())
+        snapshot = self.snapshot()
+        lo = snapshot.eligibility.bisect_right((start, ""))
+        hi = snapshot.eligibility.bisect_right((end, ""))
+        return [snapshot.candidates[identification] for _, identification in snapshot.eligibility.slice(lo, hi)]
+
+    def get_oldest_subsidy_candidate(self) -> Optional[Candidate]:
+        """Candidato sin subsidio o con el subsidio más antiguo"""
+        snapshot = self.snapshot()
+        if not snapshot.eligibility:
+            return None
+        return snapshot.candidates[snapshot.eligibility.first()[1]]
+
+    def add_candidate(self, candidate: Candidate) -> bool:
+        with self._writing_candidates():
+            if candidate.identification in self._editor.candidates:
+                return False
+            self._editor.candidates[candidate.identification] = candidate
+            self._index_candidate(candidate)
+            self._ranking_version += 1
+            self._candidates_version += 1
+            self.changes.append(CANDIDATE_ADDED, candidate.identification, dict(candidate))
+        return True
+
+    def _apply_update(self, identification: str, candidate_data: dict) -> Optional[bool]:
+        """
+        Reemplaza el candidato y publica el cambio, sin tocar las versiones.
+        Se llama dentro de _writing_candidates(); devuelve si cambió el
+        ranking, o None si el candidato no existe.
+        """
+        current_candidate = self._editor.candidates.get(identification)
+        if current_candidate is None:
+            return None
+        ranking_changed = any(
+            key in RANKING_FIELDS and getattr(current_candidate, key) != value
+            for key, value in candidate_data.items()
+        )
+        # Copy-on-write: quien ya tenga el Candidate anterior lo sigue viendo entero
+        updated_candidate = current_candidate.model_copy(update=candidate_data)
+        self._unindex_candidate(current_candidate)
+        self._editor.candidates[identification] = updated_candidate
+        self._index_candidate(updated_candidate)
+        self.changes.append(CANDIDATE_UPDATED, identification, dict(candidate_data))
+        return ranking_changed
+
+    def _apply_updates(self, updates: Dict[str, dict]):
+        """Varias actualizaciones con una sola subida de versión; dentro de _writing_candidates()"""
+        applied = [self._apply_update(identification, data) for identification, data in updates.items()]
+        if any(changed is not None for changed in applied):
+            self._candidates_version += 1
+        if any(applied):
+            self._ranking_version += 1
 
     def update_candidate(self, identification: str, candidate_data: dict):
-        if identification in self.candidates:
-            current_candidate = self.candidates[identification]
-            for key, value in candidate_data.items():
-                setattr(current_candidate, key, value)
+        self.update_candidates({identification: candidate_data})
+
+    def update_candidates(self, updates: Dict[str, dict]):
+        """Aplica varias actualizaciones {identification: candidate_data} en una sola escritura"""
+        with self._writing_candidates():
+            self._apply_updates(updates)
+
+    def record_disbursement(self, updates: Dict[str, dict], transactions: List[Transaction]):
+        """
+        Actualizaciones de candidatos y transacciones de un lote de pagos,
+        visibles a la vez: ningún lector ve un last_subsidy sin su Transaction.
+        """
+        # Orden fijo de locks: candidatos y luego transacciones
+        with self._writing_candidates(), self._transactions_lock:
+            self._apply_updates(updates)
+            self.transactions.extend(transactions)
+            self.changes.extend(TRANSACTION_ADDED, [t.to_address for t in transactions], transactions)
 
     def add_transaction(self, transaction: Transaction):
-        self.transactions.append(transaction)
+        with self._transactions_lock:
+            self.transactions.append(transaction)
+            self.changes.append(TRANSACTION_ADDED, transaction.to_address, dict(transaction))
+
+    def add_transactions(self, transactions: List[Transaction]):
+        with self._transactions_lock:
+            self.transactions.extend(transactions)
+            self.changes.extend(TRANSACTION_ADDED, [t.to_address for t in transactions], transactions)
+
+    def get_transactions(self) -> List[Transaction]:
+        return list(self.transactions)
 
-# Create a singleton instance of the database
-db_manager = InMemoryDB()
+
+def create_db():
+    """
+    Crea el backend de almacenamiento configurado en DB_BACKEND.
+
+    "memory" (por defecto) usa InMemoryDB; "sqlite" usa SQLiteDB sobre el
+    archivo DB_PATH, compartido entre la app de Streamlit y el servidor de llamadas;
+    "columnar" usa ColumnarDB, en memoria y pensado para registros muy grandes.
+    """
+    backend = os.getenv("DB_BACKEND", "memory").lower()
+    if backend == "sqlite":
+        from sqlite_db import SQLiteDB
+        return SQLiteDB(os.getenv("DB_PATH", "subsidies.db"))
+    if backend == "columnar":
+        from columnar_db import ColumnarDB
+        return ColumnarDB()
+    if backend != "memory":
+        raise ValueError(f"Unknown DB_BACKEND: {backend}")
+    return InMemoryDB()
 
 def init_db():
-    """Initialize the database with required configuration"""
-    return db_manager
\ No newline at end of file
+    """
+    Base de datos del proceso, creada en la primera llamada.
+
+    No se crea al importar el módulo: DB_BACKEND y DB_PATH se leen cuando
+    quien llama ya cargó el .env.
+    """
+    return process_resources.get("db", create_db)
@@ -0,0 +1,202 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+import json
+import os
+import threading
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+from pydantic import BaseModel
+from models import Candidate, Transaction
+
+# Estados registrados en el diario por cada clave de idempotencia
+PENDING = "pending"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+
+class DisbursementResult(BaseModel):
+    """
+    Resultado de la transferencia a un candidato dentro de un lote
+    """
+    identification: str
+    idempotency_key: str
+    status: str
+    message: str
+
+
+class TransactionJournal:
+    """
+    Diario de transferencias de sólo escritura al final (JSON Lines).
+
+    Cada transferencia se registra como "pending" antes de ejecutarse y
+    como "succeeded" o "failed" al terminar. Al abrir el diario se
+    reconstruye el último estado de cada clave, de modo que repetir un
+    lote no vuelve a pagar lo ya pagado ni lo que quedó a medias.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._status: Dict[str, str] = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as journal_file:
+                for line in journal_file:
+                    line = line.strip()
+                    if line:
+                        entry = json.loads(line)
+                        self._status[entry["idempotency_key"]] = entry["status"]
+        self._file = open(path, "a", encoding="utf-8")
+
+    def status(self, idempotency_key: str) -> Optional[str]:
+        return self._status.get(idempotency_key)
+
+    def _write(self, idempotency_key: str, status: str, fields: dict):
+        entry = {
+            "idempotency_key": idempotency_key,
+            "status": status,
+            "timestamp": datetime.now().isoformat(),
+            **fields
+        }
+        self._file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self._file.flush()
+        self._status[idempotency_key] = status
+
+    def append(self, idempotency_key: str, status: str, **fields):
+        with self._lock:
+            self._write(idempotency_key, status, fields)
+
+    def reserve(self, idempotency_key: str, **fields) -> Optional[str]:
+        """
+        Registra la clave como "pending" si nadie la ha pagado ni la está pagando.
+
+        Comprobar y escribir ocurren bajo el mismo lock, así dos lotes
+        simultáneos con el mismo run_id no pagan dos veces.
+
+        Returns:
+            Optional[str]: None si la clave quedó reservada; si no, su estado actual.
+        """
+        with self._lock:
+            status = self._status.get(idempotency_key)
+            if status in (SUCCEEDED, PENDING):
+                return status
+            self._write(idempotency_key, PENDING, fields)
+            return None
+
+    def sync(self):
+        """Fuerza a disco lo escrito (una vez por lote, no por transferencia)"""
+        with self._lock:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+_journal: Optional[TransactionJournal] = None
+_journal_lock = threading.Lock()
+
+
+def get_journal() -> TransactionJournal:
+    """Diario compartido del proceso, en TRANSACTION_JOURNAL_PATH"""
+    global _journal
+    with _journal_lock:
+        if _journal is None:
+            _journal = TransactionJournal(os.getenv("TRANSACTION_JOURNAL_PATH", "transactions_journal.jsonl"))
+        return _journal
+
+
+def idempotency_key(run_id: str, identification: str) -> str:
+    return f"{run_id}:{identification}"
+
+
+def disburse_batch(
+    db,
+    candidates: Sequence[Candidate],
+    from_phone: str,
+    amount: float,
+    transfer: Callable[[str, str, float], Tuple[bool, str]],
+    run_id: str,
+    journal: Optional[TransactionJournal] = None,
+    max_workers: int = 16
+) -> List[DisbursementResult]:
+    """
+    Paga un subsidio a varios candidatos en paralelo.
+
+    Args:
+        db: Base de datos (InMemoryDB, ColumnarDB o SQLiteDB).
+        candidates (Sequence[Candidate]): Candidatos seleccionados.
+        from_phone (str): Teléfono de origen de las transferencias.
+        amount (float): Monto por candidato.
+        transfer (Callable): Función de transferencia, p. ej. simple_phone_transfer.
+        run_id (str): Identificador del lote (p. ej. "2025-03"); junto con la
+            identificación del candidato forma la clave de idempotencia.
+        journal (TransactionJournal): Diario a usar; por defecto get_journal().
+        max_workers (int): Transferencias simultáneas como máximo.
+
+    Returns:
+        List[DisbursementResult]: Un resultado por candidato (sin repetidos), en el orden recibido.
+    """
+    journal = journal or get_journal()
+    results: Dict[str, DisbursementResult] = {}
+    to_transfer: List[Tuple[Candidate, str]] = []
+    # Una identificación repetida en la selección se paga una sola vez
+    unique: Dict[str, Candidate] = {}
+    for candidate in candidates:
+        unique.setdefault(candidate.identification, candidate)
+    candidates = list(unique.values())
+
+    for candidate in candidates:
+        key = idempotency_key(run_id, candidate.identification)
+        # La reserva se hace aquí, antes de encolar la transferencia
+        status = journal.reserve(key, identification=candidate.identification, to_phone=candidate.phone, amount=amount)
+        if status is not None:
+            results[candidate.identification] = DisbursementResult(
+                identification=candidate.identification,
+                idempotency_key=key,
+                status="skipped",
+                message=f"Already {status} in run {run_id}"
+            )
+        else:
+            to_transfer.append((candidate, key))
+
+    def run_transfer(candidate: Candidate, key: str) -> Tuple[bool, str]:
+        try:
+            success, message = transfer(from_phone, candidate.phone, amount)
+        except Exception as e:
+            success, message = False, f"Transfer failed: {str(e)}"
+        journal.append(key, SUCCEEDED if success else FAILED, identification=candidate.identification, message=message)
+        return success, message
+
+    now = datetime.now()
+    updates: Dict[str, dict] = {}
+    transactions: List[Transaction] = []
+    if to_transfer:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            futures = {
+                pool.submit(run_transfer, candidate, key): (candidate, key)
+                for candidate, key in to_transfer
+            }
+            for future in as_completed(futures):
+                candidate, key = futures[future]
+                success, message = future.result()
+                results[candidate.identification] = DisbursementResult(
+                    identification=candidate.identification,
+                    idempotency_key=key,
+                    status=SUCCEEDED if success else FAILED,
+                    message=message
+                )
+                if success:
+                    updates[candidate.identification] = {"last_subsidy": now}
+                    transactions.append(Transaction(
+                        from_address=from_phone,
+                        to_address=candidate.phone,
+                        amount=amount,
+                        timestamp=now,
+                        idempotency_key=key
+                    ))
+        journal.sync()
+
+    # Candidatos y transacciones del lote en una sola escritura
+    db.record_disbursement(updates, transactions)
+
+    return [results[candidate.identification] for candidate in candidates]
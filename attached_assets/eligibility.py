@@ -0,0 +1,75 @@
+"""
+Política de elegibilidad para recibir un subsidio.
+
+Un candidato es elegible si nunca recibió subsidio o si el último fue hace
+más de `window_days` días. Dicho de otro modo, vuelve a ser elegible en
+`last_subsidy + window_days`: como ese instante crece con last_subsidy, los
+índices ordenados por last_subsidy de las bases de datos sirven también de
+índice "elegible desde" para cualquier ventana.
+"""
+import os
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import TYPE_CHECKING, Optional, Tuple, Union
+
+import numpy as np
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+@dataclass(frozen=True)
+class EligibilityPolicy:
+    """
+    Args:
+        window_days (int): Días sin subsidio necesarios para volver a ser elegible.
+    """
+    window_days: int = 60
+
+    @property
+    def window(self) -> timedelta:
+        return timedelta(days=self.window_days)
+
+    def cutoff(self, now: datetime) -> datetime:
+        """Es elegible quien recibió su último subsidio antes de este instante"""
+        return now - self.window
+
+    def eligible_at(self, last_subsidy: Optional[datetime]) -> Optional[datetime]:
+        """Instante en que vuelve a ser elegible; None si ya lo es desde siempre"""
+        return last_subsidy + self.window if last_subsidy else None
+
+    def is_eligible(self, last_subsidy: Optional[datetime], now: Optional[datetime] = None) -> bool:
+        if not last_subsidy:
+            return True
+        return last_subsidy < self.cutoff(now or datetime.now())
+
+    def mask(self, last_subsidy: Union[np.ndarray, "pd.Series"], now: Optional[datetime] = None) -> np.ndarray:
+        """
+        Elegibilidad de todo el registro en una sola pasada vectorizada.
+
+        Args:
+            last_subsidy: Fechas datetime64 del último subsidio (NaT si nunca).
+            now (datetime): Instante de referencia común a todas las filas.
+
+        Returns:
+            np.ndarray: Array booleano, una posición por candidato.
+        """
+        dates = np.asarray(last_subsidy, dtype="datetime64[us]")
+        cutoff = np.datetime64(self.cutoff(now or datetime.now()), "us")
+        return np.isnat(dates) | (dates < cutoff)
+
+    def newly_eligible_range(self, since: datetime, now: datetime) -> Tuple[datetime, datetime]:
+        """
+        Rango [desde, hasta) de last_subsidy de quienes pasaron a ser
+        elegibles entre `since` (excluido) y `now` (incluido).
+        """
+        return self.cutoff(since), self.cutoff(now)
+
+
+# Ventana configurable con ELIGIBILITY_DAYS
+DEFAULT_POLICY = EligibilityPolicy(int(os.getenv("ELIGIBILITY_DAYS", 60)))
+
+
+def policy_for(days: Optional[int] = None) -> EligibilityPolicy:
+    """Política con otra ventana, o la configurada si `days` es None"""
+    return DEFAULT_POLICY if days is None else EligibilityPolicy(days)
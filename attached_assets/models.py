@@ -1,6 +1,7 @@
-from datetime import datetime, timedelta
+from datetime import datetime
 from pydantic import BaseModel, validator
 from typing import Optional
+from eligibility import DEFAULT_POLICY, EligibilityPolicy
 
 class User(BaseModel):
     """
@@ -12,6 +13,9 @@ class User(BaseModel):
     recovery_code: Optional[str] = None
     recovery_code_expiry: Optional[datetime] = None
 
+# Campos de Candidate que intervienen en la selección del mejor candidato
+RANKING_FIELDS = ("name", "identification", "last_subsidy", "resumen")
+
 class Candidate(BaseModel):
     """
     Modelo de candidato para el sistema de subsidios
@@ -26,10 +30,12 @@ class Candidate(BaseModel):
     
     
     @property
-    def is_eligible(self):
-        if not self.last_subsidy:
-            return True
-        return datetime.now() - self.last_subsidy > timedelta(days=60) or None
+    def is_eligible(self) -> bool:
+        return DEFAULT_POLICY.is_eligible(self.last_subsidy)
+
+    def is_eligible_at(self, now: datetime, policy: EligibilityPolicy = DEFAULT_POLICY) -> bool:
+        """Elegibilidad respecto a un instante de referencia común"""
+        return policy.is_eligible(self.last_subsidy, now)
 
     def update_resumen(self, new_resumen: str):
         """
@@ -56,4 +62,5 @@ class Transaction(BaseModel):
     from_address: str
     to_address: str
     amount: float
-    timestamp: datetime
\ No newline at end of file
+    timestamp: datetime
+    idempotency_key: Optional[str] = None  # Clave del lote de pagos que la generó
\ No newline at end of file
@@ -0,0 +1,92 @@
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence
+import numpy as np
+import pandas as pd
+from models import Candidate
+from eligibility import DEFAULT_POLICY
+
+# Días sin subsidio a partir de los cuales un candidato vuelve a ser elegible
+ELIGIBILITY_DAYS = DEFAULT_POLICY.window_days
+# Antigüedad máxima considerada; quien nunca recibió subsidio la obtiene completa
+MAX_AGE_DAYS = 365.0
+
+AGE_WEIGHT = 1.0
+ELIGIBLE_WEIGHT = 2.0
+# Señales en el resumen de la llamada que indican mayor necesidad
+RESUMEN_SIGNALS: Dict[str, float] = {
+    r"urgen": 1.0,
+    r"enferm": 0.75,
+    r"sin ingresos": 0.75,
+    r"desemplead": 0.5,
+    r"discapacidad": 0.5,
+    r"vive sol[oa]": 0.25,
+    r"deuda": 0.25,
+}
+
+
+def score_arrays(last_subsidy: np.ndarray, resumen: pd.Series, now: Optional[datetime] = None) -> np.ndarray:
+    """
+    Puntuación local de necesidad para toda la población en una sola pasada.
+
+    Args:
+        last_subsidy (np.ndarray): Fechas datetime64 del último subsidio (NaT si nunca).
+        resumen (pd.Series): Resúmenes de llamadas (None si no hay).
+        now (datetime): Instante de referencia común para todos los candidatos.
+
+    Returns:
+        np.ndarray: Puntuación por candidato; mayor es más prioritario.
+    """
+    now64 = np.datetime64(now or datetime.now(), "s")
+    age_days = (now64 - last_subsidy.astype("datetime64[s]")) / np.timedelta64(1, "D")
+    age_days = np.where(np.isnan(age_days), MAX_AGE_DAYS, np.minimum(age_days, MAX_AGE_DAYS))
+
+    scores = AGE_WEIGHT * age_days / ELIGIBILITY_DAYS
+    scores += ELIGIBLE_WEIGHT * (age_days > ELIGIBILITY_DAYS)
+
+    text = resumen.fillna("").str.lower()
+    for pattern, weight in RESUMEN_SIGNALS.items():
+        scores += weight * text.str.contains(pattern, regex=True).to_numpy(dtype=bool)
+    return scores
+
+
+def candidates_frame(candidates: Sequence[Candidate]) -> pd.DataFrame:
+    """Columnas de Candidate necesarias para el pre-ranking"""
+    return pd.DataFrame({
+        "identification": [c.identification for c in candidates],
+        "last_subsidy": pd.to_datetime([c.last_subsidy for c in candidates]),
+        "resumen": [c.resumen for c in candidates],
+    })
+
+
+def score_candidates(candidates: Sequence[Candidate], now: Optional[datetime] = None) -> np.ndarray:
+    frame = candidates_frame(candidates)
+    return score_arrays(frame["last_subsidy"].to_numpy(dtype="datetime64[ns]"), frame["resumen"], now)
+
+
+def shortlist(candidates: Sequence[Candidate], k: int, now: Optional[datetime] = None) -> List[Candidate]:
+    """
+    Los `k` candidatos con mayor puntuación local, de mayor a menor.
+
+    Usa np.argpartition (O(n)) y sólo ordena los k seleccionados.
+    """
+    if k <= 0 or not candidates:
+        return []
+    scores = score_candidates(candidates, now)
+    if k < len(candidates):
+        top = np.argpartition(-scores, k - 1)[:k]
+    else:
+        top = np.arange(len(candidates))
+    top = top[np.argsort(-scores[top], kind="stable")]
+    return [candidates[i] for i in top]
+
+
+def select_oldest_subsidy(candidates: Sequence[Candidate]) -> Optional[Candidate]:
+    """
+    Selección sin LLM: el primer candidato sin subsidio o, si todos lo
+    recibieron, el de subsidio más antiguo. Una sola pasada O(n).
+    """
+    return min(
+        candidates,
+        key=lambda c: (c.last_subsidy is not None, c.last_subsidy or datetime.min),
+        default=None
+    )
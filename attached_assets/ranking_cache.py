@@ -0,0 +1,98 @@
+from collections import OrderedDict
+from concurrent.futures import Future
+import hashlib
+import threading
+import time
+from typing import Any, Callable, Dict, Tuple
+from models import Candidate, RANKING_FIELDS
+
+# Los hashes por candidato se suman módulo 2**256: el total no depende del orden
+# y se actualiza restando el hash anterior y sumando el nuevo
+HASH_MODULUS = 1 << 256
+
+
+def candidate_digest(candidate: Candidate) -> int:
+    """Hash de los RANKING_FIELDS de un candidato"""
+    digest = hashlib.sha256()
+    for field in RANKING_FIELDS:
+        digest.update(repr(getattr(candidate, field)).encode("utf-8"))
+        digest.update(b"\x1f")
+    return int.from_bytes(digest.digest(), "big")
+
+
+def combined_hash(total: int) -> str:
+    """Hash del registro a partir de la suma de candidate_digest"""
+    return f"{total % HASH_MODULUS:064x}"
+
+
+class RankingCache:
+    """
+    Caché del resultado del ranking de candidatos con el LLM.
+
+    Las entradas expiran a los `ttl_seconds` y se descartan por LRU al
+    superar `maxsize`. Si varias sesiones piden la misma clave a la vez,
+    sólo una llama al modelo y el resto espera ese mismo resultado.
+    """
+
+    def __init__(self, maxsize: int = 128, ttl_seconds: float = 600.0):
+        self.maxsize = maxsize
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._inflight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    @staticmethod
+    def make_key(snapshot_hash: str, prompt: str, model: str) -> str:
+        return hashlib.sha256(f"{model}\x1f{prompt}\x1f{snapshot_hash}".encode("utf-8")).hexdigest()
+
+    def get_or_compute(self, key: str, compute: Callable[[], Any]) -> Any:
+        """Devuelve el valor en caché o lo calcula una sola vez por clave"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._inflight[key] = future
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if not owner:
+            return future.result()
+
+        try:
+            value = compute()
+        except BaseException as e:
+            with self._lock:
+                del self._inflight[key]
+            future.set_exception(e)
+            raise
+
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+            del self._inflight[key]
+        future.set_result(value)
+        return value
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# Instancia compartida entre todas las sesiones de Streamlit del proceso
+ranking_cache = RankingCache()
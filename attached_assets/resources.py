@@ -0,0 +1,119 @@
+"""
+Caché de recursos para las re-ejecuciones de Streamlit.
+
+Streamlit ejecuta app.py de arriba abajo en cada interacción. Lo que es caro
+de construir se guarda en dos niveles:
+  - ResourceCache: objetos de proceso (clientes de API, base de datos),
+    compartidos por todas las sesiones.
+  - SessionCache: datos derivados de una sesión (ranking, páginas de la
+    tabla) guardados en st.session_state junto con la clave de la que
+    dependen; si la clave cambia, se recalculan.
+Ambos cuentan aciertos y fallos y se invalidan de forma explícita.
+"""
+import threading
+from typing import Any, Callable, Dict, Hashable, MutableMapping, Optional, Tuple, TypeVar
+
+from dotenv import load_dotenv
+
+T = TypeVar("T")
+
+DOTENV_PATH = "./conversational_call/.env"
+SESSION_KEY = "_session_cache"
+
+
+class ResourceCache:
+    """Un objeto por nombre y por proceso, creado la primera vez que se pide"""
+
+    def __init__(self):
+        # Reentrante: la factoría de un recurso puede pedir otro (p. ej. el pool HTTP)
+        self._lock = threading.RLock()
+        self._values: Dict[str, Any] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, name: str, factory: Callable[[], T]) -> T:
+        value = self._values.get(name)
+        if value is not None:
+            self.hits += 1
+            return value
+        with self._lock:
+            value = self._values.get(name)
+            if value is None:
+                self.misses += 1
+                value = self._values[name] = factory()
+            else:
+                self.hits += 1
+        return value
+
+    def pop(self, name: str) -> Optional[Any]:
+        """Saca el recurso de la caché para que quien llama lo cierre"""
+        with self._lock:
+            return self._values.pop(name, None)
+
+    def invalidate(self, name: Optional[str] = None):
+        """Olvida un recurso (o todos); se vuelve a crear en el siguiente get"""
+        with self._lock:
+            if name is None:
+                self._values.clear()
+            else:
+                self._values.pop(name, None)
+
+    def stats(self) -> dict:
+        return {"entries": len(self._values), "hits": self.hits, "misses": self.misses}
+
+
+class SessionCache:
+    """Valores derivados de una sesión, cada uno ligado a la clave con que se calculó"""
+
+    def __init__(self):
+        self._values: Dict[str, Tuple[Hashable, Any]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, name: str, key: Hashable, compute: Callable[[], T]) -> T:
+        """
+        Args:
+            name (str): Nombre del valor (p. ej. "ranking").
+            key (Hashable): Todo aquello de lo que depende el valor, p. ej.
+                la versión de la base de datos; si cambia, se recalcula.
+            compute (Callable): Calcula el valor cuando no está en caché.
+        """
+        entry = self._values.get(name)
+        if entry is not None and entry[0] == key:
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        value = compute()
+        self._values[name] = (key, value)
+        return value
+
+    def invalidate(self, name: Optional[str] = None):
+        if name is None:
+            self._values.clear()
+        else:
+            self._values.pop(name, None)
+
+    def stats(self) -> dict:
+        return {"entries": len(self._values), "hits": self.hits, "misses": self.misses}
+
+
+# Recursos compartidos por todas las sesiones del proceso
+process_resources = ResourceCache()
+
+_env_lock = threading.Lock()
+_loaded_env = set()
+
+
+def load_env(path: str = DOTENV_PATH):
+    """Carga el archivo .env una sola vez por proceso"""
+    with _env_lock:
+        if path not in _loaded_env:
+            load_dotenv(path)
+            _loaded_env.add(path)
+
+
+def session_cache(state: MutableMapping) -> SessionCache:
+    """La caché de la sesión, guardada en `state` (st.session_state)"""
+    if SESSION_KEY not in state:
+        state[SESSION_KEY] = SessionCache()
+    return state[SESSION_KEY]
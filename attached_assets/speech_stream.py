@@ -0,0 +1,155 @@
+"""
+Reconocimiento de voz en streaming.
+
+El audio del micrófono se entrega al reconocedor frame a frame mientras se
+captura, y el reconocedor va devolviendo hipótesis parciales; el
+reconocimiento avanza mientras la persona habla en lugar de empezar cuando
+termina.
+
+Los reconocedores implementan StreamingRecognizer; el incluido es
+VoskRecognizer, con un modelo local (paquete opcional `vosk`) y sin red.
+Sin Vosk, voice_interface sigue usando recognize_google sobre el audio completo.
+"""
+from abc import ABC, abstractmethod
+import json
+import threading
+import time
+import wave
+from typing import Callable, Dict, Iterable, Iterator, NamedTuple, Optional
+
+try:
+    import vosk
+except ImportError:  # pragma: no cover - dependencia opcional
+    vosk = None
+
+SAMPLE_WIDTH = 2  # PCM de 16 bits
+
+
+class Hypothesis(NamedTuple):
+    text: str
+    final: bool
+
+
+class StreamingRecognizer(ABC):
+    """
+    Interfaz de los reconocedores: accept() recibe PCM de 16 bits mono y
+    puede devolver una hipótesis; finish() cierra el enunciado y devuelve
+    el texto final.
+    """
+
+    @abstractmethod
+    def accept(self, frame: bytes) -> Optional[Hypothesis]:
+        ...
+
+    @abstractmethod
+    def finish(self) -> str:
+        ...
+
+
+_vosk_models: Dict[str, "vosk.Model"] = {}
+_vosk_models_lock = threading.Lock()
+
+
+def load_vosk_model(model_path: str):
+    """Carga (una vez por proceso) un modelo de Vosk descargado en disco"""
+    if vosk is None:
+        raise RuntimeError("Vosk no está instalado: pip install vosk")
+    with _vosk_models_lock:
+        model = _vosk_models.get(model_path)
+        if model is None:
+            vosk.SetLogLevel(-1)
+            model = _vosk_models[model_path] = vosk.Model(model_path)
+        return model
+
+
+class VoskRecognizer(StreamingRecognizer):
+    """
+    Reconocedor local con Vosk (https://alphacephei.com/vosk/models).
+
+    Args:
+        model_path (str): Directorio del modelo, p. ej. vosk-model-small-es-0.42.
+        sample_rate (int): Frecuencia del audio que se va a entregar.
+    """
+
+    def __init__(self, model_path: str, sample_rate: int = 16000):
+        self._recognizer = vosk.KaldiRecognizer(load_vosk_model(model_path), sample_rate)
+        self._last_partial = ""
+        self._finals = []
+
+    def accept(self, frame: bytes) -> Optional[Hypothesis]:
+        if self._recognizer.AcceptWaveform(frame):
+            # Vosk detectó el fin de un enunciado
+            text = json.loads(self._recognizer.Result()).get("text", "")
+            self._last_partial = ""
+            if text:
+                self._finals.append(text)
+                return Hypothesis(text, True)
+            return None
+        partial = json.loads(self._recognizer.PartialResult()).get("partial", "")
+        if partial and partial != self._last_partial:
+            self._last_partial = partial
+            return Hypothesis(partial, False)
+        return None
+
+    def finish(self) -> str:
+        text = json.loads(self._recognizer.FinalResult()).get("text", "")
+        if text:
+            self._finals.append(text)
+        return " ".join(self._finals)
+
+
+def recognize_stream(
+    frames: Iterable[bytes],
+    recognizer: StreamingRecognizer,
+    on_partial: Optional[Callable[[str], None]] = None,
+    stop_on_final: bool = True
+) -> str:
+    """
+    Entrega los frames al reconocedor según llegan.
+
+    Args:
+        frames (Iterable[bytes]): Audio PCM de 16 bits mono, en orden.
+        recognizer (StreamingRecognizer): Reconocedor a usar.
+        on_partial (Callable): Recibe el texto de cada hipótesis, parcial o final.
+        stop_on_final (bool): Dejar de leer en el primer enunciado completo.
+
+    Returns:
+        str: Texto reconocido.
+    """
+    for frame in frames:
+        hypothesis = recognizer.accept(frame)
+        if hypothesis is None:
+            continue
+        if on_partial:
+            on_partial(hypothesis.text)
+        if hypothesis.final and stop_on_final:
+            break
+    return recognizer.finish()
+
+
+def microphone_frames(source, max_seconds: float = 10.0) -> Iterator[bytes]:
+    """
+    Frames de un sr.Microphone abierto, tal como los entrega PyAudio, hasta
+    `max_seconds` o hasta que el consumidor deje de pedirlos.
+    """
+    deadline = time.monotonic() + max_seconds
+    while time.monotonic() < deadline:
+        yield source.stream.read(source.CHUNK)
+
+
+def wav_frames(path: str, frame_ms: int = 20, realtime: bool = False) -> Iterator[bytes]:
+    """
+    Frames de un WAV PCM de 16 bits mono, para probar sin micrófono. Con
+    `realtime` se entregan al ritmo en que se habrían capturado.
+    """
+    with wave.open(path, "rb") as wav:
+        if wav.getsampwidth() != SAMPLE_WIDTH or wav.getnchannels() != 1:
+            raise ValueError("Se necesita un WAV PCM de 16 bits mono")
+        frames_per_chunk = wav.getframerate() * frame_ms // 1000
+        while True:
+            frame = wav.readframes(frames_per_chunk)
+            if not frame:
+                return
+            if realtime:
+                time.sleep(frame_ms / 1000)
+            yield frame
@@ -0,0 +1,512 @@
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+import json
+import secrets
+import sqlite3
+import threading
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterator, List, Optional, Tuple
+from models import User, Candidate, Transaction, RANKING_FIELDS
+from change_feed import CANDIDATE_ADDED, CANDIDATE_UPDATED, TRANSACTION_ADDED, Change
+from eligibility import policy_for
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Formato fijo para que el orden lexicográfico coincida con el cronológico
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+CANDIDATE_COLUMNS = ("identification", "name", "address", "phone", "wallet_address", "last_subsidy", "resumen")
+CANDIDATE_FIELDS = ", ".join(CANDIDATE_COLUMNS)
+# Campos de fecha dentro del JSON de un cambio (last_subsidy de Candidate, timestamp de Transaction)
+CHANGE_DATETIME_FIELDS = ("last_subsidy", "timestamp")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    username TEXT PRIMARY KEY,
+    password TEXT NOT NULL,
+    email TEXT NOT NULL UNIQUE,
+    recovery_code TEXT,
+    recovery_code_expiry TEXT
+);
+CREATE TABLE IF NOT EXISTS candidates (
+    identification TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    address TEXT NOT NULL,
+    phone TEXT NOT NULL,
+    wallet_address TEXT NOT NULL,
+    last_subsidy TEXT,
+    resumen TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_candidates_name ON candidates(name);
+CREATE INDEX IF NOT EXISTS idx_candidates_phone ON candidates(phone);
+CREATE INDEX IF NOT EXISTS idx_candidates_wallet ON candidates(wallet_address);
+CREATE INDEX IF NOT EXISTS idx_candidates_last_subsidy ON candidates(last_subsidy, identification);
+CREATE TABLE IF NOT EXISTS transactions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    from_address TEXT NOT NULL,
+    to_address TEXT NOT NULL,
+    amount REAL NOT NULL,
+    timestamp TEXT NOT NULL,
+    idempotency_key TEXT UNIQUE
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS changes (
+    version INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+INSERT OR IGNORE INTO meta (key, value) VALUES ('ranking_version', 0);
+INSERT OR IGNORE INTO meta (key, value) VALUES ('candidates_version', 0);
+"""
+
+# Sentencias fijas: sqlite3 mantiene un caché de sentencias preparadas por conexión
+INSERT_USER = "INSERT INTO users (username, password, email) VALUES (?, ?, ?)"
+SELECT_USER = "SELECT username, password, email, recovery_code, recovery_code_expiry FROM users WHERE username = ?"
+SELECT_USER_BY_EMAIL = "SELECT username, password, email, recovery_code, recovery_code_expiry FROM users WHERE email = ?"
+SELECT_USERNAME = "SELECT 1 FROM users WHERE username = ?"
+SELECT_EMAIL = "SELECT 1 FROM users WHERE email = ?"
+SET_RECOVERY_CODE = "UPDATE users SET recovery_code = ?, recovery_code_expiry = ? WHERE email = ?"
+RESET_PASSWORD = "UPDATE users SET password = ?, recovery_code = NULL, recovery_code_expiry = NULL WHERE email = ?"
+INSERT_CANDIDATE = f"INSERT OR IGNORE INTO candidates ({CANDIDATE_FIELDS}) VALUES (?, ?, ?, ?, ?, ?, ?)"
+SELECT_CANDIDATE = f"SELECT {CANDIDATE_FIELDS} FROM candidates WHERE identification = ?"
+SELECT_ALL_CANDIDATES = f"SELECT {CANDIDATE_FIELDS} FROM candidates ORDER BY identification"
+SELECT_CANDIDATE_BY_NAME = f"SELECT {CANDIDATE_FIELDS} FROM candidates WHERE name = ? ORDER BY identification LIMIT 1"
+SELECT_CANDIDATE_BY_PHONE = f"SELECT {CANDIDATE_FIELDS} FROM candidates WHERE phone = ? LIMIT 1"
+SELECT_CANDIDATE_BY_WALLET = f"SELECT {CANDIDATE_FIELDS} FROM candidates WHERE wallet_address = ? LIMIT 1"
+SELECT_ELIGIBLE_CANDIDATES = (
+    f"SELECT {CANDIDATE_FIELDS} FROM candidates "
+    "WHERE last_subsidy IS NULL OR last_subsidy < ? ORDER BY last_subsidy, identification"
+)
+SELECT_NEWLY_ELIGIBLE_CANDIDATES = (
+    f"SELECT {CANDIDATE_FIELDS} FROM candidates "
+    "WHERE last_subsidy >= ? AND last_subsidy < ? ORDER BY last_subsidy, identification"
+)
+SELECT_OLDEST_SUBSIDY_CANDIDATE = f"SELECT {CANDIDATE_FIELDS} FROM candidates ORDER BY last_subsidy, identification LIMIT 1"
+INSERT_TRANSACTION = (
+    "INSERT OR IGNORE INTO transactions (from_address, to_address, amount, timestamp, idempotency_key) "
+    "VALUES (?, ?, ?, ?, ?)"
+)
+SELECT_TRANSACTIONS = "SELECT from_address, to_address, amount, timestamp, idempotency_key FROM transactions ORDER BY id"
+SELECT_RANKING_VERSION = "SELECT value FROM meta WHERE key = 'ranking_version'"
+BUMP_RANKING_VERSION = "UPDATE meta SET value = value + 1 WHERE key = 'ranking_version'"
+SELECT_CANDIDATES_VERSION = "SELECT value FROM meta WHERE key = 'candidates_version'"
+BUMP_CANDIDATES_VERSION = "UPDATE meta SET value = value + 1 WHERE key = 'candidates_version'"
+INSERT_CHANGE = "INSERT INTO changes (kind, key, data) VALUES (?, ?, ?)"
+PRUNE_CHANGES = "DELETE FROM changes WHERE version <= ?"
+SELECT_CHANGES_SINCE = "SELECT version, kind, key, data FROM changes WHERE version > ? ORDER BY version"
+# AUTOINCREMENT guarda la última versión asignada aunque las filas ya se hayan podado
+SELECT_CHANGES_VERSION = "SELECT seq FROM sqlite_sequence WHERE name = 'changes'"
+
+
+def _to_db(value: Optional[datetime]) -> Optional[str]:
+    return value.strftime(TIMESTAMP_FORMAT) if value is not None else None
+
+
+def _from_db(value: Optional[str]) -> Optional[datetime]:
+    return datetime.strptime(value, TIMESTAMP_FORMAT) if value is not None else None
+
+
+def _change_to_db(data: Dict[str, Any]) -> str:
+    return json.dumps({
+        key: _to_db(value) if key in CHANGE_DATETIME_FIELDS else value
+        for key, value in data.items()
+    })
+
+
+def _row_to_change(row) -> Change:
+    data = json.loads(row[3])
+    for key in CHANGE_DATETIME_FIELDS:
+        if key in data:
+            data[key] = _from_db(data[key])
+    return Change(row[0], row[1], row[2], data)
+
+
+def _row_to_user(row) -> User:
+    return User(
+        username=row[0],
+        password=row[1],
+        email=row[2],
+        recovery_code=row[3],
+        recovery_code_expiry=_from_db(row[4])
+    )
+
+
+def _row_to_candidate(row) -> Candidate:
+    return Candidate(
+        identification=row[0],
+        name=row[1],
+        address=row[2],
+        phone=row[3],
+        wallet_address=row[4],
+        last_subsidy=_from_db(row[5]),
+        resumen=row[6]
+    )
+
+
+def _candidate_to_row(candidate: Candidate) -> tuple:
+    return (
+        candidate.identification,
+        candidate.name,
+        candidate.address,
+        candidate.phone,
+        candidate.wallet_address,
+        _to_db(candidate.last_subsidy),
+        candidate.resumen
+    )
+
+
+def _transaction_to_row(transaction: Transaction) -> tuple:
+    return (
+        transaction.from_address,
+        transaction.to_address,
+        transaction.amount,
+        _to_db(transaction.timestamp),
+        transaction.idempotency_key
+    )
+
+
+class SQLiteDB:
+    """
+    Backend persistente con la misma interfaz que InMemoryDB.
+
+    Usa SQLite en modo WAL para que la app de Streamlit y el servidor de
+    llamadas compartan el mismo archivo: varios lectores concurrentes y un
+    escritor. Cada hilo tiene su propia conexión y las consultas sólo
+    materializan las filas pedidas, así la memoria no crece con el registro.
+
+    Los cambios se guardan en la tabla `changes` en la misma transacción que
+    la escritura, así changes_since() sirve a cualquier proceso que abra el
+    archivo. Los suscriptores, en cambio, sólo reciben los cambios escritos
+    por este proceso, después del commit.
+
+    Args:
+        path (str): Archivo de la base de datos.
+        seed (bool): Cargar los candidatos de ejemplo si no existen.
+        changes_retained (int): Cambios que se conservan en la tabla `changes`.
+    """
+
+    def __init__(self, path: str = "subsidies.db", seed: bool = True, changes_retained: int = 10_000):
+        self.path = path
+        self.changes_retained = changes_retained
+        self._local = threading.local()
+        self._subscribers_lock = threading.Lock()
+        self._subscribers: List[Callable[[Change], None]] = []
+        conn = self._connection()
+        with conn:
+            conn.executescript(SCHEMA)
+            self._migrate(conn)
+        if seed:
+            from database import default_candidates
+            with self.batch():
+                for candidate in default_candidates():
+                    self.add_candidate(candidate)
+
+    @staticmethod
+    def _migrate(conn: sqlite3.Connection):
+        """Añade columnas nuevas a bases de datos creadas con versiones anteriores"""
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(transactions)")}
+        if "idempotency_key" not in columns:
+            conn.execute("ALTER TABLE transactions ADD COLUMN idempotency_key TEXT")
+            conn.execute(
+                "CREATE UNIQUE INDEX IF NOT EXISTS idx_transactions_idempotency_key "
+                "ON transactions(idempotency_key)"
+            )
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30.0, isolation_level=None, cached_statements=256)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+            self._local.batch_depth = 0
+            # Cambios de la transacción en curso, para los suscriptores tras el commit
+            self._local.pending_changes = []
+        return conn
+
+    @contextmanager
+    def batch(self):
+        """
+        Agrupa varias escrituras en una sola transacción (un único commit).
+
+        Se puede anidar; el commit ocurre al salir del bloque más externo.
+        """
+        conn = self._connection()
+        if self._local.batch_depth == 0:
+            conn.execute("BEGIN IMMEDIATE")
+        self._local.batch_depth += 1
+        try:
+            yield self
+        except BaseException:
+            self._local.batch_depth -= 1
+            if self._local.batch_depth == 0:
+                conn.execute("ROLLBACK")
+                self._local.pending_changes = []
+            raise
+        else:
+            self._local.batch_depth -= 1
+            if self._local.batch_depth == 0:
+                conn.execute("COMMIT")
+                self._notify()
+
+    def _write(self, sql: str, params: tuple = ()) -> sqlite3.Cursor:
+        with self.batch():
+            return self._connection().execute(sql, params)
+
+    def _fetchone(self, sql: str, params: tuple = ()):
+        return self._connection().execute(sql, params).fetchone()
+
+    def _record_change(self, kind: str, key: str, data: Dict[str, Any]):
+        """Guarda un cambio; debe llamarse dentro de batch()"""
+        cursor = self._connection().execute(INSERT_CHANGE, (kind, key, _change_to_db(data)))
+        version = cursor.lastrowid
+        if version > self.changes_retained:
+            self._connection().execute(PRUNE_CHANGES, (version - self.changes_retained,))
+        self._local.pending_changes.append(Change(version, kind, key, data))
+
+    def _notify(self):
+        changes, self._local.pending_changes = self._local.pending_changes, []
+        if not changes:
+            return
+        with self._subscribers_lock:
+            subscribers = list(self._subscribers)
+        for change in changes:
+            for subscriber in subscribers:
+                try:
+                    subscriber(change)
+                except Exception as e:
+                    print(f"Error in change feed subscriber: {str(e)}")
+
+    @property
+    def changes_version(self) -> int:
+        """Versión del último cambio guardado por cualquier proceso"""
+        row = self._fetchone(SELECT_CHANGES_VERSION)
+        return row[0] if row else 0
+
+    def changes_since(self, version: int) -> Optional[List[Change]]:
+        """Cambios posteriores a `version`; None si ya se podaron y hay que releer todo"""
+        rows = self._connection().execute(SELECT_CHANGES_SINCE, (version,)).fetchall()
+        if rows:
+            # Las versiones son consecutivas: un hueco al principio es un tramo ya podado
+            return [_row_to_change(row) for row in rows] if rows[0][0] == version + 1 else None
+        return [] if version == self.changes_version else None
+
+    def subscribe(self, subscriber: Callable[[Change], None]) -> Callable[[], None]:
+        """Llama a `subscriber` con cada cambio que este proceso confirme; devuelve la función para darlo de baja"""
+        with self._subscribers_lock:
+            self._subscribers.append(subscriber)
+
+        def unsubscribe():
+            with self._subscribers_lock:
+                if subscriber in self._subscribers:
+                    self._subscribers.remove(subscriber)
+        return unsubscribe
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    # User management
+    def add_user(self, username: str, password: str, email: str) -> Tuple[bool, str]:
+        if self._fetchone(SELECT_USERNAME, (username,)):
+            return False, "Username already exists"
+
+        if self._fetchone(SELECT_EMAIL, (email,)):
+            return False, "Email is already registered"
+
+        if len(password) < 6:
+            return False, "Password must be at least 6 characters long"
+
+        try:
+            new_user = User(username=username, password=password, email=email)
+            self._write(INSERT_USER, (new_user.username, new_user.password, new_user.email))
+            return True, "User registered successfully"
+        except Exception as e:
+            return False, f"Error registering user: {str(e)}"
+
+    def authenticate_user(self, username: str, password: str) -> Tuple[bool, str]:
+        row = self._fetchone(SELECT_USER, (username,))
+        if row is None:
+            return False, "User not found"
+
+        if row[1] != password:
+            return False, "Incorrect password"
+
+        return True, "Authentication successful"
+
+    def get_user_by_email(self, email: str) -> Optional[User]:
+        row = self._fetchone(SELECT_USER_BY_EMAIL, (email,))
+        return _row_to_user(row) if row else None
+
+    def generate_recovery_code(self, email: str) -> Optional[str]:
+        recovery_code = secrets.token_hex(3)
+        expiry = datetime.now() + timedelta(minutes=30)
+        cursor = self._write(SET_RECOVERY_CODE, (recovery_code, _to_db(expiry), email))
+        return recovery_code if cursor.rowcount else None
+
+    def reset_password(self, email: str, recovery_code: str, new_password: str) -> Tuple[bool, str]:
+        if len(new_password) < 6:
+            return False, "New password must be at least 6 characters long"
+
+        with self.batch():
+            user = self.get_user_by_email(email)
+            if (user is not None and
+                user.recovery_code == recovery_code and
+                user.recovery_code_expiry and
+                user.recovery_code_expiry > datetime.now()):
+                self._write(RESET_PASSWORD, (new_password, email))
+                return True, "Password updated successfully"
+        return False, "Invalid or expired recovery code"
+
+    # Candidate management
+    def get_candidate(self, identification: str) -> Optional[Candidate]:
+        row = self._fetchone(SELECT_CANDIDATE, (identification,))
+        return _row_to_candidate(row) if row else None
+
+    def iter_candidates(self, batch_size: int = 1000) -> Iterator[Candidate]:
+        """Recorre el registro por lotes sin cargarlo entero en memoria"""
+        cursor = self._connection().execute(SELECT_ALL_CANDIDATES)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                yield _row_to_candidate(row)
+
+    def get_all_candidates(self) -> List[Candidate]:
+        return list(self.iter_candidates())
+
+    def candidates_frame(self) -> "pd.DataFrame":
+        """Registro como DataFrame, leído por columnas sin crear un Candidate por fila"""
+        import pandas as pd
+
+        frame = pd.read_sql_query(SELECT_ALL_CANDIDATES, self._connection())
+        frame["last_subsidy"] = pd.to_datetime(frame["last_subsidy"], format=TIMESTAMP_FORMAT)
+        return frame[list(Candidate.model_fields)]
+
+    def get_candidate_by_name(self, name: str) -> Optional[Candidate]:
+        row = self._fetchone(SELECT_CANDIDATE_BY_NAME, (name,))
+        return _row_to_candidate(row) if row else None
+
+    def get_candidate_by_phone(self, phone: str) -> Optional[Candidate]:
+        row = self._fetchone(SELECT_CANDIDATE_BY_PHONE, (phone,))
+        return _row_to_candidate(row) if row else None
+
+    def get_candidate_by_wallet(self, wallet_address: str) -> Optional[Candidate]:
+        row = self._fetchone(SELECT_CANDIDATE_BY_WALLET, (wallet_address,))
+        return _row_to_candidate(row) if row else None
+
+    def get_eligible_candidates(self, days: Optional[int] = None, now: Optional[datetime] = None) -> List[Candidate]:
+        """
+        Devuelve los candidatos sin subsidio en los últimos `days` días
+        (por defecto la ventana de DEFAULT_POLICY), ordenados del subsidio
+        más antiguo al más reciente.
+        """
+        cutoff = policy_for(days).cutoff(now or datetime.now())
+        rows = self._connection().execute(SELECT_ELIGIBLE_CANDIDATES, (_to_db(cutoff),)).fetchall()
+        return [_row_to_candidate(row) for row in rows]
+
+    def get_newly_eligible_candidates(self, since: datetime, now: Optional[datetime] = None,
+                                      days: Optional[int] = None) -> List[Candidate]:
+        """Candidatos que pasaron a ser elegibles después de `since` y hasta `now`"""
+        start, end = policy_for(days).newly_eligible_range(since, now or datetime.now())
+        rows = self._connection().execute(SELECT_NEWLY_ELIGIBLE_CANDIDATES, (_to_db(start), _to_db(end))).fetchall()
+        return [_row_to_candidate(row) for row in rows]
+
+    def get_oldest_subsidy_candidate(self) -> Optional[Candidate]:
+        """Candidato sin subsidio o con el subsidio más antiguo"""
+        row = self._fetchone(SELECT_OLDEST_SUBSIDY_CANDIDATE)
+        return _row_to_candidate(row) if row else None
+
+    @property
+    def ranking_version(self) -> int:
+        """Contador compartido entre procesos; cambia sólo con RANKING_FIELDS"""
+        return self._fetchone(SELECT_RANKING_VERSION)[0]
+
+    @property
+    def candidates_version(self) -> int:
+        """Contador compartido entre procesos; cambia con cualquier alta o modificación"""
+        return self._fetchone(SELECT_CANDIDATES_VERSION)[0]
+
+    def add_candidate(self, candidate: Candidate) -> bool:
+        with self.batch():
+            cursor = self._write(INSERT_CANDIDATE, _candidate_to_row(candidate))
+            if cursor.rowcount:
+                self._write(BUMP_RANKING_VERSION)
+                self._write(BUMP_CANDIDATES_VERSION)
+                self._record_change(CANDIDATE_ADDED, candidate.identification, dict(candidate))
+        return bool(cursor.rowcount)
+
+    def _apply_update(self, identification: str, candidate_data: dict) -> Optional[bool]:
+        """UPDATE de un candidato sin subir versiones; None si no existe o no hay columnas válidas"""
+        columns = [key for key in candidate_data if key in CANDIDATE_COLUMNS and key != "identification"]
+        if not columns:
+            return None
+        current_candidate = self.get_candidate(identification)
+        if current_candidate is None:
+            return None
+        ranking_changed = any(
+            key in RANKING_FIELDS and getattr(current_candidate, key) != candidate_data[key]
+            for key in columns
+        )
+        values = [
+            _to_db(candidate_data[key]) if key == "last_subsidy" else candidate_data[key]
+            for key in columns
+        ]
+        assignments = ", ".join(f"{key} = ?" for key in columns)
+        self._write(
+            f"UPDATE candidates SET {assignments} WHERE identification = ?",
+            (*values, identification)
+        )
+        self._record_change(CANDIDATE_UPDATED, identification, {key: candidate_data[key] for key in columns})
+        return ranking_changed
+
+    def update_candidate(self, identification: str, candidate_data: dict):
+        self.update_candidates({identification: candidate_data})
+
+    def update_candidates(self, updates: Dict[str, dict]):
+        """Aplica varias actualizaciones {identification: candidate_data} en un solo commit y una sola versión"""
+        with self.batch():
+            applied = [self._apply_update(identification, data) for identification, data in updates.items()]
+            if any(changed is not None for changed in applied):
+                self._write(BUMP_CANDIDATES_VERSION)
+            if any(applied):
+                self._write(BUMP_RANKING_VERSION)
+
+    def record_disbursement(self, updates: Dict[str, dict], transactions: List[Transaction]):
+        """Actualizaciones de candidatos y transacciones de un lote de pagos en un solo commit"""
+        with self.batch():
+            self.update_candidates(updates)
+            self.add_transactions(transactions)
+
+    def add_transaction(self, transaction: Transaction):
+        with self.batch():
+            cursor = self._write(INSERT_TRANSACTION, _transaction_to_row(transaction))
+            # Una clave de idempotencia repetida no inserta nada: no hay cambio que publicar
+            if cursor.rowcount:
+                self._record_change(TRANSACTION_ADDED, transaction.to_address, dict(transaction))
+
+    def add_transactions(self, transactions: List[Transaction]):
+        with self.batch():
+            for transaction in transactions:
+                self.add_transaction(transaction)
+
+    def get_transactions(self) -> List[Transaction]:
+        rows = self._connection().execute(SELECT_TRANSACTIONS).fetchall()
+        return [
+            Transaction(
+                from_address=row[0],
+                to_address=row[1],
+                amount=row[2],
+                timestamp=_from_db(row[3]),
+                idempotency_key=row[4]
+            )
+            for row in rows
+        ]
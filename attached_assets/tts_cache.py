@@ -0,0 +1,330 @@
+"""
+Caché de audio sintetizado (TTS) direccionada por contenido.
+
+El audio se identifica por el hash de (texto, voz, formato) y se guarda en
+dos niveles: un LRU en memoria acotado en bytes y un directorio en disco
+que sobrevive a los reinicios, también acotado. Los mensajes con plantilla
+se dividen en segmentos fijos, que se sintetizan una sola vez, y segmentos
+variables cortos; los MP3 de cada segmento se concatenan, igual que hace
+gTTS con los textos largos.
+
+Al disco sólo van los segmentos fijos de las plantillas. Los variables
+(nombres, montos, lo que dijo el usuario) y los textos libres se quedan en
+el LRU en memoria: no se persiste voz sintetizada con datos personales.
+
+render_stream() entrega el audio por trozos a medida que se sintetiza, de
+modo que el reproductor puede empezar antes de que termine la síntesis.
+"""
+import hashlib
+import os
+import re
+import string
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+DEFAULT_VOICE = "es"
+DEFAULT_FORMAT = "mp3"
+
+
+def gtts_stream(text: str, voice: str = DEFAULT_VOICE, fmt: str = DEFAULT_FORMAT) -> Iterator[bytes]:
+    """
+    Sintetiza con gTTS en memoria (`voice` es el idioma). gTTS parte el
+    texto en tramos de unos 100 caracteres; cada tramo se entrega en cuanto
+    llega, sin esperar al resto.
+    """
+    from gtts import gTTS
+
+    if fmt != "mp3":
+        raise ValueError(f"gTTS sólo genera mp3, no {fmt}")
+    yield from gTTS(text, lang=voice).stream()
+
+
+def audio_key(text: str, voice: str = DEFAULT_VOICE, fmt: str = DEFAULT_FORMAT) -> str:
+    return hashlib.sha256(f"{voice}\0{fmt}\0{text}".encode("utf-8")).hexdigest()
+
+
+class MessageTemplate:
+    """
+    Plantilla de mensaje con campos de str.format, p. ej.
+    "Hello {name}, you have received a subsidy of ${amount}."
+
+    Las palabras sin campos forman segmentos fijos; cada palabra con un
+    campo (con su puntuación pegada, como "${amount}.") es un segmento
+    variable.
+    """
+
+    def __init__(self, template: str):
+        self.template = template
+        pattern = []
+        for literal, field, _, _ in string.Formatter().parse(template):
+            pattern.append(re.escape(literal))
+            if field is not None:
+                pattern.append(f"(?P<{field}>.+?)")
+        self._pattern = re.compile("".join(pattern), re.DOTALL)
+
+        self._parts: List[Tuple[str, bool]] = []
+        fixed: List[str] = []
+        for word in template.split():
+            if "{" in word:
+                if fixed:
+                    self._parts.append((" ".join(fixed), False))
+                    fixed = []
+                self._parts.append((word, True))
+            else:
+                fixed.append(word)
+        if fixed:
+            self._parts.append((" ".join(fixed), False))
+
+    def format(self, **values) -> str:
+        return self.template.format(**values)
+
+    def parts(self, text: str) -> Optional[List[Tuple[str, bool]]]:
+        """Segmentos de un mensaje ya formateado con su marca de variable, o None si no sigue la plantilla"""
+        match = self._pattern.fullmatch(text)
+        if match is None:
+            return None
+        values = match.groupdict()
+        return [(part.format(**values), True) if variable else (part, False) for part, variable in self._parts]
+
+    def segments(self, text: Optional[str] = None, **values) -> Optional[List[str]]:
+        """
+        Divide un mensaje en segmentos a sintetizar.
+
+        Args:
+            text (str): Mensaje ya formateado; se reconocen sus valores.
+            **values: Valores de los campos, si no se pasa `text`.
+
+        Returns:
+            List[str]: Segmentos en orden, o None si `text` no sigue la plantilla.
+        """
+        if text is not None:
+            parts = self.parts(text)
+            return [segment for segment, _ in parts] if parts is not None else None
+        return [part.format(**values) if variable else part for part, variable in self._parts]
+
+
+# Mensajes con plantilla conocidos por la aplicación
+NOTIFICATION_MESSAGE = MessageTemplate("Hello {name}, you have received a subsidy of ${amount}.")
+VOICE_REPLY = MessageTemplate("Usted dijo: {text}. ¿Cómo puedo ayudarle?")
+TEMPLATES = (NOTIFICATION_MESSAGE, VOICE_REPLY)
+
+
+class TTSCache:
+    """
+    Caché de dos niveles del audio sintetizado.
+
+    Args:
+        synthesize (Callable): Función (texto, voz, formato) que devuelve
+            el audio como un iterable de trozos de bytes.
+        max_bytes (int): Tamaño máximo del nivel en memoria.
+        cache_dir (str): Directorio del nivel en disco; None lo desactiva.
+        max_disk_bytes (int): Tamaño máximo del nivel en disco; se borran
+            primero los archivos usados hace más tiempo.
+    """
+
+    def __init__(self, synthesize: Callable[[str, str, str], Iterable[bytes]] = gtts_stream,
+                 max_bytes: int = 64 * 1024 * 1024, cache_dir: Optional[str] = None,
+                 max_disk_bytes: int = 256 * 1024 * 1024):
+        self.synthesize = synthesize
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_bytes
+        self._memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        # Archivos del nivel en disco -> tamaño, del usado hace más tiempo al más reciente
+        self._disk: "OrderedDict[str, int]" = OrderedDict()
+        self._disk_size = 0
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            self._scan_disk()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._first_audio_count = 0
+        self._first_audio_total = 0.0
+
+    def get(self, text: str, voice: str = DEFAULT_VOICE, fmt: str = DEFAULT_FORMAT) -> bytes:
+        """Devuelve el audio del texto, sintetizándolo sólo si no está en caché"""
+        return b"".join(self.stream(text, voice, fmt))
+
+    def stream(self, text: str, voice: str = DEFAULT_VOICE, fmt: str = DEFAULT_FORMAT,
+               persist: bool = False) -> Iterator[bytes]:
+        """
+        Audio del texto por trozos. Si está en caché sale de una vez; si no,
+        cada trozo se entrega según se sintetiza y el total se guarda al final.
+
+        Args:
+            persist (bool): Guardar también en disco; sólo para texto fijo sin datos personales.
+        """
+        key = audio_key(text, voice, fmt)
+        audio = self._lookup(key, fmt, persist)
+        if audio is not None:
+            yield audio
+            return
+
+        self.misses += 1
+        chunks = []
+        for chunk in self.synthesize(text, voice, fmt):
+            chunks.append(chunk)
+            yield chunk
+        audio = b"".join(chunks)
+        if persist:
+            self._write_disk(key, fmt, audio)
+        self._remember(key, audio)
+
+    def render(self, text: str, voice: str = DEFAULT_VOICE, fmt: str = DEFAULT_FORMAT,
+               templates: Sequence[MessageTemplate] = TEMPLATES) -> bytes:
+        """
+        Audio de un mensaje completo. Si sigue alguna de las plantillas se
+        arma con los segmentos en caché; si no, se cachea el texto entero.
+        """
+        return b"".join(self.render_stream(text, voice, fmt, templates))
+
+    def render_stream(self, text: str, voice: str = DEFAULT_VOICE, fmt: str = DEFAULT_FORMAT,
+                      templates: Sequence[MessageTemplate] = TEMPLATES) -> Iterator[bytes]:
+        """Como render(), pero entregando cada trozo en cuanto está disponible"""
+        started = time.perf_counter()
+        # Un texto que no sigue ninguna plantilla es libre: sólo en memoria
+        segments = [(text, True)]
+        for template in templates:
+            matched = template.parts(text)
+            if matched is not None:
+                segments = matched
+                break
+
+        first = True
+        for segment, variable in segments:
+            for chunk in self.stream(segment, voice, fmt, persist=not variable):
+                if first:
+                    self._record_first_audio(time.perf_counter() - started)
+                    first = False
+                yield chunk
+
+    def stats(self) -> Dict[str, float]:
+        count = self._first_audio_count
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "entries": len(self._memory),
+            "bytes": self._size,
+            "disk_entries": len(self._disk),
+            "disk_bytes": self._disk_size,
+            "renders": count,
+            "avg_first_audio_ms": 1000 * self._first_audio_total / count if count else 0.0,
+        }
+
+    def _lookup(self, key: str, fmt: str, persist: bool) -> Optional[bytes]:
+        with self._lock:
+            audio = self._memory.get(key)
+            if audio is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return audio
+
+        audio = self._read_disk(key, fmt) if persist else None
+        if audio is not None:
+            self.disk_hits += 1
+            self._remember(key, audio)
+        return audio
+
+    def _record_first_audio(self, seconds: float):
+        with self._lock:
+            self._first_audio_count += 1
+            self._first_audio_total += seconds
+
+    def _remember(self, key: str, audio: bytes):
+        if len(audio) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._memory.pop(key, None)
+            if previous is not None:
+                self._size -= len(previous)
+            self._memory[key] = audio
+            self._size += len(audio)
+            while self._size > self.max_bytes:
+                _, evicted = self._memory.popitem(last=False)
+                self._size -= len(evicted)
+
+    def _path(self, key: str, fmt: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.{fmt}")
+
+    def _scan_disk(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".tmp"):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.cache_dir, name))
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, name, stat.st_size))
+        for _, name, size in sorted(entries):
+            self._disk[name] = size
+            self._disk_size += size
+        self._evict_disk()
+
+    def _evict_disk(self):
+        """Borra los archivos usados hace más tiempo hasta caber en max_disk_bytes; con el lock tomado"""
+        while self._disk_size > self.max_disk_bytes and self._disk:
+            name, size = self._disk.popitem(last=False)
+            self._disk_size -= size
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except FileNotFoundError:
+                pass
+
+    def _read_disk(self, key: str, fmt: str) -> Optional[bytes]:
+        if not self.cache_dir:
+            return None
+        path = self._path(key, fmt)
+        try:
+            with open(path, "rb") as f:
+                audio = f.read()
+        except FileNotFoundError:
+            return None
+        name = os.path.basename(path)
+        with self._lock:
+            if name in self._disk:
+                self._disk.move_to_end(name)
+        # La fecha de modificación marca el uso, para el orden de borrado tras un reinicio
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return audio
+
+    def _write_disk(self, key: str, fmt: str, audio: bytes):
+        if not self.cache_dir:
+            return
+        # Escritura atómica: otro proceso nunca ve un archivo a medias
+        path = self._path(key, fmt)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(audio)
+        os.replace(tmp_path, path)
+        name = os.path.basename(path)
+        with self._lock:
+            self._disk_size += len(audio) - self._disk.pop(name, 0)
+            self._disk[name] = len(audio)
+            self._evict_disk()
+
+
+_tts_cache: Optional[TTSCache] = None
+_tts_cache_lock = threading.Lock()
+
+
+def get_tts_cache() -> TTSCache:
+    """Caché compartida del proceso, en TTS_CACHE_DIR"""
+    global _tts_cache
+    with _tts_cache_lock:
+        if _tts_cache is None:
+            _tts_cache = TTSCache(
+                max_bytes=int(os.getenv("TTS_CACHE_MB", 64)) * 1024 * 1024,
+                cache_dir=os.getenv("TTS_CACHE_DIR", "tts_cache") or None,
+                max_disk_bytes=int(os.getenv("TTS_CACHE_DISK_MB", 256)) * 1024 * 1024
+            )
+        return _tts_cache
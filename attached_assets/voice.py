@@ -1,75 +1,79 @@
 import os
-import tempfile
+from concurrent.futures import ThreadPoolExecutor
 import speech_recognition as sr
-from gtts import gTTS
-from dotenv import load_dotenv
-from elevenlabs.client import ElevenLabs
 from elevenlabs.conversational_ai.conversation import Conversation
 from elevenlabs.conversational_ai.default_audio_interface import DefaultAudioInterface
 import streamlit as st
+from clients import elevenlabs_client
+from resources import load_env
+from tts_cache import VOICE_REPLY, get_tts_cache
+from speech_stream import VoskRecognizer, microphone_frames, recognize_stream, vosk
+
+# Síntesis en segundo plano; el módulo sobrevive a las re-ejecuciones de Streamlit
+_tts_executor = ThreadPoolExecutor(max_workers=4)
 
 def voice_interface():
     """Función para la interfaz de voz"""
-    load_dotenv("./conversational_call/.env")
+    load_env()
     agent_id = os.getenv("ELEVENLABS_AGENT_ID")
     api_key = os.getenv("ELEVENLABS_API_KEY")
 
-    client = ElevenLabs(api_key=api_key)
-    conversation = Conversation(
-        client,
-        agent_id,
-        requires_auth=bool(api_key),
-        audio_interface=DefaultAudioInterface(),
-<<<<<<< HEAD
-        callback_agent_response=lambda response: st.write(f"Agente: {response}"),
-        callback_user_transcript=lambda transcript: st.write(f"Usuario: {transcript}")
-=======
-        callback_agent_response=lambda response: print(f"Agente: {response}"),
-        callback_user_transcript=lambda transcript: print(f"Usuario: {transcript}")
->>>>>>> 3860e70654b18814303192fce43725e459f9d47a
-    )
+    vosk_model_path = os.getenv("VOSK_MODEL_PATH")
 
     st.title("Interfaz de Voz")
+    # El modo streaming reconoce mientras se habla con un modelo local de Vosk
+    streaming = bool(vosk_model_path and vosk) and st.checkbox("Reconocimiento en streaming (Vosk)", value=True)
 
     if st.button("Iniciar Reconocimiento de Voz"):
         recognizer = sr.Recognizer()
         with sr.Microphone() as source:
             st.write("Por favor, hable ahora...")
-<<<<<<< HEAD
-            try:
-                audio = recognizer.listen(source, timeout=5)
-=======
-            audio = recognizer.listen(source)
-
             try:
->>>>>>> 3860e70654b18814303192fce43725e459f9d47a
-                text = recognizer.recognize_google(audio, language='es-ES')
+                if streaming:
+                    partial = st.empty()
+                    text = recognize_stream(
+                        microphone_frames(source),
+                        VoskRecognizer(vosk_model_path, source.SAMPLE_RATE),
+                        on_partial=lambda hypothesis: partial.write(f"... {hypothesis}")
+                    )
+                    if not text:
+                        raise sr.UnknownValueError()
+                else:
+                    audio = recognizer.listen(source, timeout=5)
+                    text = recognizer.recognize_google(audio, language='es-ES')
                 st.write(f"Usted dijo: {text}")
 
+                # La respuesta sólo depende del texto reconocido: se sintetiza
+                # en memoria mientras dura la sesión con el agente
+                response = VOICE_REPLY.format(text=text)
+                reply_audio = _tts_executor.submit(get_tts_cache().render, response, 'es')
+
+                # El cliente de ElevenLabs se comparte entre re-ejecuciones;
+                # la conversación sólo se crea cuando se va a usar
+                conversation = Conversation(
+                    elevenlabs_client(),
+                    agent_id,
+                    requires_auth=bool(api_key),
+                    audio_interface=DefaultAudioInterface(),
+                    callback_agent_response=lambda response: st.write(f"Agente: {response}"),
+                    callback_user_transcript=lambda transcript: st.write(f"Usuario: {transcript}")
+                )
+
                 # Iniciar la conversación con ElevenLabs
                 conversation.start_session()
                 conversation_id = conversation.wait_for_session_end()
                 st.write(f"ID de Conversación: {conversation_id}")
 
                 # Respuesta del agente
-                response = f"Usted dijo: {text}. ¿Cómo puedo ayudarle?"
                 st.write(response)
-
-                # Convertir la respuesta a voz
-                tts = gTTS(response, lang='es')
-                with tempfile.NamedTemporaryFile(delete=True) as tmp_file:
-                    tts.save(f"{tmp_file.name}.mp3")
-                    st.audio(f"{tmp_file.name}.mp3", format="audio/mp3")
+                st.audio(reply_audio.result(), format="audio/mp3")
 
             except sr.UnknownValueError:
                 st.error("No se pudo entender el audio.")
             except sr.RequestError as e:
                 st.error(f"No se pudo solicitar resultados; {e}")
-<<<<<<< HEAD
             except Exception as e:
                 st.error(f"Ocurrió un error: {str(e)}")
-=======
->>>>>>> 3860e70654b18814303192fce43725e459f9d47a
 
 
 